@@ -1,3 +1,15 @@
+import ctypes
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.startup import configureOpenGL, startup
+
+# PyOpenGL without per-call error checks or silent array copies and only pygame's display initialised,
+# the PyOpenGL part has to be decided before OpenGL.GL is imported, so this setting lives up here
+fast_startup = False
+configureOpenGL(fast_startup)
+startup.begin("imports")
 import pygame as pg
 import pyrr
 from OpenGL.GL import *
@@ -6,220 +18,279 @@ from OpenGL.raw.GL.VERSION.GL_1_0 import GL_UNSIGNED_INT
 from OpenGL.raw.GL.VERSION.GL_2_0 import glUniformMatrix4fv
 import numpy as np
 
+from engine.arena import GeometryArena
+from engine.gl_state import state
+from engine.profiler import profiler
+from engine.meshes import Mesh, loadMesh
+from engine.resources import resources
+from engine.shaders import preprocess
+from engine.timing import Scheduler
+# engine.offscreen, engine.quantize and engine.streaming are imported by the features that use them
+startup.end("imports")
+
 width, height = 1000, 1000
+# snorm16 positions with the rabbit's colour in a uniform instead of float32 x, y, z, r, g, b
+compact_vertices = False
+# the rabbit moves in fixed steps of 1 / step_rate seconds at move_speed units per second,
+# frames are paced to target_fps (None: uncapped)
+step_rate = 120
+target_fps = 120
+move_speed = 1.0
+# points thrown up from the rabbit, recomputed on the CPU every frame into a triple-buffered mapped buffer,
+# 1000000 streams 16 MB a frame, 0 turns the fountain off
+particles = 0
+particle_lifetime = 1.5
+# where the startup phases are written as JSON after the first frame, None prints them only
+startup_profile_path = None
+# cpu and gpu time of the frame's scopes in the caption and a table on exit,
+# profile_trace_path also writes them as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+profile = False
+profile_trace_path = None
 
 
 class App:
-    def __init__(self):
+    def __init__(self, headless=False):
+        self.headless = headless
         # initialise pygame
-        pg.init()
-        pg.display.set_mode((width, height), pg.OPENGL | pg.DOUBLEBUF)
-        self.clock = pg.time.Clock()
+        startup.begin("context")
+        if fast_startup:
+            # everything the lab uses hangs off the display, pg.init would also open audio and joysticks
+            pg.display.init()
+        else:
+            pg.init()
+        if headless:
+            from engine.offscreen import OffscreenContext
+            self.context = OffscreenContext(width, height)
+        else:
+            pg.display.set_mode((width, height), pg.OPENGL | pg.DOUBLEBUF)
+        startup.end("context")
+        if profile or profile_trace_path:
+            profiler.enable()
+        self.clock = Scheduler(step_rate, target_fps)
         # initialise opengl
         glClearColor(0.5, 0.5, 0.1, 1)
-        self.shader = self.createShader("shaders/vertex.txt", "shaders/fragment.txt")
+        defines = {"COMPACT_VERTICES": 1} if compact_vertices else {}
+        with startup.phase("shaders"):
+            self.shader = self.createShader("shaders/vertex.txt", "shaders/fragment.txt", defines)
         # self.triangle = Triangle(self.shader)
-        self.rabbit = Rabbit(self.shader)
-        self.mainLoop()
+        startup.begin("meshes")
+        mesh = loadMesh("models/rabbit.obj", "pos_colour")
+        if compact_vertices:
+            self.arena = GeometryArena("pos_compact", positionBounds=mesh.bounds())
+            state.useProgram(self.shader)
+            glUniform3fv(glGetUniformLocation(self.shader, "positionOffset"), 1, self.arena.positionOffset)
+            glUniform3fv(glGetUniformLocation(self.shader, "positionScale"), 1, self.arena.positionScale)
+        else:
+            self.arena = GeometryArena("pos_colour")
+        self.rabbit = Rabbit(self.shader, self.arena, mesh)
+        startup.end("meshes")
+        self.particles = None
+        if particles:
+            lo, hi = mesh.bounds()
+            self.particles = Particles(self.createShader("shaders/particle_vertex.txt",
+                                                         "shaders/particle_fragment.txt", {}),
+                                       particles, particle_lifetime, [(lo[0] + hi[0]) / 2, hi[1], 0])
+        if compact_vertices:
+            from engine.quantize import describe
+            for report in self.arena.reports:
+                print(describe(report))
+        # uploaded by renderFrame whenever the blended position changes
+        self.model_transform = None
+        self.position = np.zeros(3, dtype=np.float32)
+        # position before the last fixed step, rendering blends the two
+        self.previous = self.position.copy()
+        self.transLocation = glGetUniformLocation(self.shader, "trans")
+        if not headless:
+            self.mainLoop()
 
-    def createShader(self, vertexFilepath, fragmentFilepath):
+    def createShader(self, vertexFilepath, fragmentFilepath, defines):
         with open(vertexFilepath, 'r') as f:
-            vertex_src = f.readlines()
+            vertex_src = preprocess(f.read(), defines)
 
         with open(fragmentFilepath, 'r') as f:
-            fragment_src = f.readlines()
+            fragment_src = preprocess(f.read(), defines)
 
         shader = compileProgram(compileShader(vertex_src, GL_VERTEX_SHADER),
                                 compileShader(fragment_src, GL_FRAGMENT_SHADER))
-        return shader
+        return resources.adoptProgram(shader, f"{vertexFilepath} + {fragmentFilepath}")
 
     def mainLoop(self):
         running = True
-        model_transform = pyrr.matrix44.create_identity(dtype=np.float32)
+        firstFrame = True
         while (running):
-            # check events
-            for event in pg.event.get():
-                if event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
-                    running = False
-                    break
-                model_transform = self.control(model_transform)
-                glUniformMatrix4fv(glGetUniformLocation(self.shader, "trans"), 1, GL_FALSE, model_transform)
+            self.clock.beginFrame()
+            profiler.beginFrame()
+            with profiler.scope("input"):
+                # check events
+                for event in pg.event.get():
+                    if event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
+                        running = False
+                        break
+            with profiler.scope("simulate"):
+                alpha = self.clock.update(self.control)
 
             # refresh screen
-            glClear(GL_COLOR_BUFFER_BIT)
-            self.rabbit.draw(self.shader)
-            pg.display.flip()
+            self.renderFrame(alpha)
+            with profiler.scope("flip"):
+                pg.display.flip()
+            if firstFrame:
+                firstFrame = False
+                startup.mark("first frame")
+                print(startup.describe())
+                if startup_profile_path:
+                    startup.save(startup_profile_path)
 
             # timing
-            self.clock.tick()
-            framerate = int(self.clock.get_fps())
-            pg.display.set_caption(f"Running at {framerate} fps.")
+            self.clock.endFrame()
+            timing = self.clock.timings.stats()
+            stream = self.particles.stream.stats if self.particles is not None else None
+            pg.display.set_caption(f"Running at {int(timing['fps'])} fps, {timing['frameMs']:.2f} ms "
+                                   f"(p99 {timing['p99Ms']:.2f} ms, {timing['busy']:.0%} busy)."
+                                   + (f" Particles: {particles}, {stream['bytes'] / 2 ** 20:.2f} MB/frame streamed, "
+                                      f"{stream['stalls']} stalls." if stream is not None else "")
+                                   + (f" {profiler.caption()}" if profiler.enabled else ""))
         self.quit()
 
-    def control(self, transform):
+    def renderFrame(self, alpha=1.0):
+        state.beginFrame()
+        resources.beginFrame()
+        with profiler.scope("update"):
+            position = self.previous + (self.position - self.previous) * np.float32(alpha)
+            model_transform = pyrr.matrix44.create_from_translation(position, dtype=np.float32)
+            if not np.array_equal(model_transform, self.model_transform):
+                self.model_transform = model_transform
+                state.useProgram(self.shader)
+                glUniformMatrix4fv(self.transLocation, 1, GL_FALSE, self.model_transform)
+        if self.particles is not None:
+            with profiler.scope("particles"):
+                self.particles.update(self.clock.fixed.time + alpha * self.clock.fixed.dt, position)
+        with profiler.scope("draw"):
+            glClear(GL_COLOR_BUFFER_BIT)
+            self.rabbit.draw(self.shader)
+            if self.particles is not None:
+                self.particles.draw()
+
+    def control(self, dt):
+        # one fixed step, held keys move the rabbit by move_speed * dt
+        self.previous[:] = self.position
         keys = pg.key.get_pressed()
         if keys[pg.K_a]:
-            return pyrr.matrix44.multiply(transform, pyrr.matrix44.create_from_translation(np.array([-0.05, 0, 0], dtype=np.float32)))
-        if keys[pg.K_d]:
-            return pyrr.matrix44.multiply(transform, pyrr.matrix44.create_from_translation(np.array([0.05, 0, 0], dtype=np.float32)))
-        if keys[pg.K_w]:
-            return pyrr.matrix44.multiply(transform, pyrr.matrix44.create_from_translation(np.array([0, 0.05, 0], dtype=np.float32)))
-        if keys[pg.K_s]:
-            return pyrr.matrix44.multiply(transform, pyrr.matrix44.create_from_translation(np.array([0, -0.05, 0], dtype=np.float32)))
-        return transform
+            self.move(-move_speed * dt, 0)
+        elif keys[pg.K_d]:
+            self.move(move_speed * dt, 0)
+        elif keys[pg.K_w]:
+            self.move(0, move_speed * dt)
+        elif keys[pg.K_s]:
+            self.move(0, -move_speed * dt)
+
+    def move(self, x, y):
+        self.position += np.array([x, y, 0], dtype=np.float32)
 
     def quit(self):
+        if profiler.enabled:
+            profiler.flush()
+            print(profiler.describe())
+            if profile_trace_path:
+                profiler.export(profile_trace_path)
+        profiler.destroy()
+        if self.particles is not None:
+            self.particles.destroy()
         self.rabbit.destroy()
-        glDeleteProgram(self.shader)
+        self.arena.destroy()
+        resources.deleteProgram(self.shader)
+        if self.headless:
+            self.context.destroy()
+        resources.checkLeaks()
         pg.quit()
 
 
 class Rabbit:
-    def __init__(self, shader):
-        glUseProgram(shader)
-        self.vertices = (
-            # head
-            -0.2, 0.6, 0.0, 0.0, 1.0, 0.0,
-            0.0, 0.6, 0.0, 0.0, 1.0, 0.0,
-            -0.2, 0.4, 0.0, 0.0, 1.0, 0.0,
-            0.0, 0.4, 0.0, 0.0, 1.0, 0.0,
-            # ear
-            0.3, 0.6, 0.0, 0.0, 1, 0.0,
-            0.15, 0.75, 0.0, 0.0, 1.0, 0.0,
-            0.45, 0.75, 0.0, 0.0, 1.0, 0.0,
-            # body
-            0.0, 0.0, 0.0, 0.0, 1.0, 0.0,
-            0.4, 0.0, 0.0, 0.0, 1.0, 0.0,
-            0.4, -0.4, 0.0, 0.0, 1.0, 0.0,
-            # leg
-            0.0, -0.2, 0.0, 0.0, 1.0, 0.0,
-            0.0, -0.4, 0.0, 0.0, 1.0, 0.0,
-            0.2, -0.2, 0.0, 0.0, 1.0, 0.0,
-            # front paws
-            -0.15, 0.0, 0.0, 0.0, 1.0, 0.0,
-            0.0, 0.15, 0.0, 0.0, 1.0, 0.0,
-            0.0, -0.15, 0.0, 0.0, 1.0, 0.0,
-        )
-
-        self.black_lines_vertices = (
-            # head
-            -0.2, 0.6, 0.0, 0.0, 0.0, 0.0,
-            0.0, 0.6, 0.0, 0.0, 0.0, 0.0,
-            -0.2, 0.4, 0.0, 0.0, 0.0, 0.0,
-            0.0, 0.4, 0.0, 0.0, 0.0, 0.0,
-            # ear
-            0.3, 0.6, 0.0, 0.0, 0.0, 0.0,
-            0.15, 0.75, 0.0, 0.0, 0.0, 0.0,
-            0.45, 0.75, 0.0, 0.0, 0.0, 0.0,
-            # body
-            0.0, 0.0, 0.0, 0.0, 0.0, 0.0,
-            0.4, 0.0, 0.0, 0.0, 0.0, 0.0,
-            0.4, -0.4, 0.0, 0.0, 0.0, 0.0,
-            # leg
-            0.0, -0.2, 0.0, 0.0, 0.0, 0.0,
-            0.0, -0.4, 0.0, 0.0, 0.0, 0.0,
-            0.2, -0.2, 0.0, 0.0, 0.0, 0.0,
-            # front paws
-            -0.15, 0.0, 0.0, 0.0, 0.0, 0.0,
-            0.0, 0.15, 0.0, 0.0, 0.0, 0.0,
-            0.0, -0.15, 0.0, 0.0, 0.0, 0.0,
-        )
-        self.indicies = (
-            # head
-            0, 1, 2,
-            1, 3, 2,
-            # ear
-            5, 6, 1,
-            6, 4, 1,
-            # body
-            3, 8, 7,
-            7, 8, 9,
-            # leg
-            12, 9, 11,
-            10, 12, 11,
-            # front paw
-            13, 14, 15
-        )
-
-        self.lines_indicies = (
-            # head
-            0, 1,
-            1, 3,
-            3, 2,
-            2, 0,
-            # ear
-            1, 5,
-            5, 6,
-            6, 4,
-            4, 1,
-            # body
-            3, 7,
-            7, 8,
-            3, 8,
-            # leg
-            7, 9,
-            8, 9,
-            9, 12,
-            11, 9,
-            10, 12,
-            10, 11,
-            12, 11,
-            # paw
-            14, 13,
-            13, 15,
-            15, 7,
-        )
-        self.vertices = np.array(self.vertices, dtype=np.float32)
-        self.black_lines_vertices = np.array(self.black_lines_vertices, dtype=np.float32)
-        self.indicies = np.array(self.indicies, dtype=np.uint32)
-        self.lines_indicies = np.array(self.lines_indicies, dtype=np.uint32)
-
-        # rabbit itself
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
-
-        self.vbo = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_STATIC_DRAW)
-
-        self.ebo = glGenBuffers(1)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indicies.nbytes, self.indicies, GL_STATIC_DRAW)
-
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
-
-        glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
+    def __init__(self, shader, arena, mesh):
+        state.useProgram(shader)
+        self.arena = arena
+        # x, y, z, r, g, b with triangles for the body and lines for the outline
+        self.colour = np.array(mesh.vertices[0, 3:6], dtype=np.float32)
+        self.colourLocation = glGetUniformLocation(shader, "objectColour")
+        black_lines_vertices = np.array(mesh.vertices, dtype=np.float32)
+        black_lines_vertices[:, 3:6] = 0
+        # rabbit itself and its black lines, both from the arena's buffers
+        self.body = arena.add(mesh)
+        self.outline = arena.add(Mesh(black_lines_vertices, mesh.lines, None, "pos_colour"))
 
-        # black lines of rabbit
-        self.vao1 = glGenVertexArrays(1)
-        glBindVertexArray(self.vao1)
+    def draw(self, shader):
+        state.useProgram(shader)
+        # compact vertices have no colour, the body's and the black of the lines come from objectColour
+        if self.arena.quantized:
+            glUniform3fv(self.colourLocation, 1, self.colour)
+        self.arena.draw(GL_TRIANGLES, [self.body])
+        if self.arena.quantized:
+            glUniform3fv(self.colourLocation, 1, np.zeros(3, dtype=np.float32))
+        self.arena.draw(GL_LINES, [self.outline])
 
-        self.vbo1 = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo1)
-        glBufferData(GL_ARRAY_BUFFER, self.black_lines_vertices.nbytes, self.black_lines_vertices, GL_STATIC_DRAW)
+    def destroy(self):
+        self.arena.remove(self.body)
+        self.arena.remove(self.outline)
 
-        self.ebo1 = glGenBuffers(1)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo1)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.lines_indicies.nbytes, self.lines_indicies, GL_STATIC_DRAW)
 
+class Particles:
+    # a fountain from the rabbit, every point follows a fixed arc from its birth time, so a frame's points are
+    # computed straight into the stream buffer's region with no state carried between frames
+    def __init__(self, shader, count, lifetime, emitter):
+        self.shader = shader
+        self.count = count
+        self.lifetime = lifetime
+        self.emitter = np.array(emitter, dtype=np.float32)
+        self.gravity = 2.0
+        rng = np.random.default_rng(0)
+        # births before time 0 keep ages positive, np.fmod is several times faster than np.mod
+        self.birth = rng.uniform(-lifetime, 0, count).astype(np.float32)
+        angle = rng.uniform(-0.4, 0.4, count)
+        speed = rng.uniform(0.9, 1.5, count)
+        self.velocityX = (speed * np.sin(angle)).astype(np.float32)
+        self.velocityY = (speed * np.cos(angle)).astype(np.float32)
+        self.age = np.empty(count, dtype=np.float32)
+        self.scratch = np.empty(count, dtype=np.float32)
+        # x, y, z and the fraction of the lifetime gone
+        from engine.streaming import StreamBuffer
+        self.stream = StreamBuffer(count, np.dtype((np.float32, 4)), label="particles")
+        self.vao = resources.genVertexArrays(1, "particles")
+        state.bindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.stream.vbo)
         glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
+        glVertexAttribPointer(0, 4, GL_FLOAT, GL_FALSE, 16, ctypes.c_void_p(0))
+        state.bindVertexArray(0)
 
-        glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
+    def update(self, time, position):
+        vertices = self.stream.begin()
+        x, y, z, life = vertices[:, 0], vertices[:, 1], vertices[:, 2], vertices[:, 3]
+        age = self.age
+        np.subtract(np.float32(time), self.birth, out=age)
+        np.fmod(age, np.float32(self.lifetime), out=age)
+        origin = self.emitter + position
+        np.multiply(self.velocityX, age, out=x)
+        x += origin[0]
+        # y = (vy - g age / 2) age, the strided writes into the region are the slow ones so there are few
+        np.multiply(age, np.float32(-0.5 * self.gravity), out=self.scratch)
+        self.scratch += self.velocityY
+        np.multiply(self.scratch, age, out=y)
+        y += origin[1]
+        z[:] = origin[2]
+        np.multiply(age, np.float32(1 / self.lifetime), out=life)
+        self.stream.end(self.count)
 
-    def draw(self, shader):
-        glUseProgram(shader)
-        glBindVertexArray(self.vao)
-        glDrawElements(GL_TRIANGLES, len(self.indicies), GL_UNSIGNED_INT, None)
-        glBindVertexArray(self.vao1)
-        glDrawElements(GL_LINES, len(self.lines_indicies), GL_UNSIGNED_INT, None)
+    def draw(self):
+        state.useProgram(self.shader)
+        state.bindVertexArray(self.vao)
+        glDrawArrays(GL_POINTS, self.stream.first, self.stream.count)
+        state.countDraw()
+        self.stream.fence()
 
     def destroy(self):
-        glDeleteVertexArrays(2, (self.vao, self.vao1,))
-        glDeleteBuffers(3, (self.vbo, self.vbo1, self.ebo,))
+        self.stream.destroy()
+        state.forgetVertexArray(self.vao)
+        resources.deleteVertexArrays(self.vao)
+        resources.deleteProgram(self.shader)
 
 
-myApp = App()
+if __name__ == "__main__":
+    myApp = App()
@@ -1,289 +1,523 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.startup import configureOpenGL, startup
+
+# PyOpenGL without per-call error checks or silent array copies and only pygame's display initialised,
+# the PyOpenGL part has to be decided before OpenGL.GL is imported, so this setting lives up here
+fast_startup = False
+configureOpenGL(fast_startup)
+startup.begin("imports")
 import pygame as pg
 from OpenGL.GL import *
-from OpenGL.GL.shaders import compileProgram, compileShader
 import numpy as np
 import pyrr
 
+from engine.arena import GeometryArena
+from engine.camera import CameraBuffer
+from engine.commands import CommandList
+from engine.culling import BVH, OUTSIDE, frustumPlanes, transformBounds, visibleRange
+from engine.gl_state import state
+from engine.profiler import profiler
+from engine.instancing import CubeBatch, CubeBasicBatch
+from engine.lighting import LightSet
+from engine.materials import MaterialLibrary
+from engine.meshes import Mesh, loadMesh
+from engine.resources import resources
+from engine.shaders import ShaderCache
+from engine.spatial import createIndex, pushOut
+from engine.textures import TextureManager
+from engine.timing import Scheduler
+from engine.transforms import TransformStore
+# engine.capture, engine.deferred, engine.lod, engine.offscreen, engine.pipeline and engine.quantize are imported
+# by the features that use them
+startup.end("imports")
+
 width = 1280
 height = 800
+# crates drawn through the instanced batch, crate_grid x crate_grid of them
+crate_grid = 0
+# degrees per second the crates turn, spinning crates are updated one frame ahead of rendering by
+# update_workers threads (processes with update_processes), 0 workers updates them on the GL thread
+crate_spin = 0
+update_workers = 2
+update_processes = False
+# records every frame, to a video through ffmpeg for .mp4/.mkv/.webm/.mov/.avi, otherwise to a directory of pngs
+capture_path = None
+# GPU memory the scene may allocate in MB, creating more raises ResourceBudgetError, None for no limit
+gpu_budget_mb = None
+# point lights scattered over the scene on top of the two fixed ones
+extra_lights = 0
+max_lights = 512
+# upper bound on the lights one cluster shades, applied when lights are assigned and compiled into the lit shaders
+max_lights_per_cluster = 64
+# the crates are lit from a G-buffer with one sphere per light instead of by the clustered forward shader,
+# tab switches between the two while running
+deferred_shading = False
+# crates are drawn from simplified copies of the cube once they look small, level i + 1 below lod_screen_sizes[i]
+# pixels across, a crate near a threshold only changes level lod_hysteresis past it,
+# the view ends 10 units out where a crate is still about 180 pixels across
+level_of_detail = False
+lod_screen_sizes = (360, 270, 200)
+lod_hysteresis = 0.15
+# what the player bumps into and clicks on, "grid" for the spatial hash or "bvh"
+spatial_index = "grid"
+# the camera walks 0.2 above the big cube's top, the sphere has to reach down to it
+player_radius = 0.5
+pick_range = 10
+# snorm16 positions, half float uvs and 10-10-10-2 normals instead of float32 vertices
+compact_vertices = False
+# the simulation advances in fixed steps of 1 / step_rate seconds, frames are paced to target_fps (None: uncapped)
+step_rate = 120
+target_fps = 144
+# units per second and degrees per pixel of mouse movement
+walk_speed = 2.5
+mouse_sensitivity = 0.8
+# where the startup phases are written as JSON once the textures are in, None prints them only
+startup_profile_path = None
+# cpu and gpu time of the frame's scopes in the caption and a table on exit,
+# profile_trace_path also writes them as a Chrome trace (chrome://tracing, ui.perfetto.dev)
+profile = False
+profile_trace_path = None
+
 
 class App:
-    def __init__(self):
+    def __init__(self, headless=False):
+        self.headless = headless
+        if gpu_budget_mb is not None:
+            resources.setBudget("total", gpu_budget_mb * 2 ** 20)
         # initialise pygame
-        pg.init()
-        pg.display.set_mode((width, height), pg.OPENGL | pg.DOUBLEBUF)
-        pg.mouse.set_pos((width/2, height/2))
-        pg.mouse.set_visible(False)
+        startup.begin("context")
+        if fast_startup:
+            # everything the lab uses hangs off the display, pg.init would also open audio and joysticks
+            pg.display.init()
+        else:
+            pg.init()
+        if headless:
+            from engine.offscreen import OffscreenContext
+            self.context = OffscreenContext(width, height)
+        else:
+            pg.display.set_mode((width, height), pg.OPENGL | pg.DOUBLEBUF)
+            pg.mouse.set_pos((width/2, height/2))
+            pg.mouse.set_visible(False)
+        startup.end("context")
+        if profile or profile_trace_path:
+            profiler.enable()
         self.lastTime = 0
         self.currentTime = 0
-        self.numFrames = 0
-        self.frameTime = 0
-        self.lightCount = 0
+        self.clock = Scheduler(step_rate, target_fps)
         # initialise opengl
         glClearColor(0.1, 0.1, 0.1, 1)
-        self.shader = self.createShader("shaders/vertex.txt", "shaders/fragment.txt")
-        self.shaderBasic = self.createShader("shaders/simple_3d_vertex.txt", "shaders/simple_3d_fragment.txt")
-        glUseProgram(self.shader)
-        self.resetLights()
-
-        projection_transform = pyrr.matrix44.create_perspective_projection(45, width / height, 0.1, 10, dtype=np.float32)
-        glUniformMatrix4fv(glGetUniformLocation(self.shader, "projection"), 1, GL_FALSE, projection_transform)
-
-        glUniform3fv(glGetUniformLocation(self.shader, "ambient"), 1, np.array([0.1, 0.1, 0.1], dtype=np.float32))
-
-        glUniform1i(glGetUniformLocation(self.shader, "material.diffuse"), 0)
-        glUniform1i(glGetUniformLocation(self.shader, "material.specular"), 1)
-
-        glUseProgram(self.shaderBasic)
-
-        glUniformMatrix4fv(glGetUniformLocation(self.shaderBasic, "projection"), 1, GL_FALSE, projection_transform)
+        # the images start decoding first, so they stream in while the shaders build and the first frames draw
+        startup.begin("textures")
+        self.textures = TextureManager()
+        # every material's images share one texture array, instances pick theirs by index
+        self.materials = MaterialLibrary(self.textures)
+        self.crateMaterial = self.materials.add("gfx/crate_diffuse.jpg", "gfx/crate_specular.jpg")
+        self.woodMaterial = self.materials.add("gfx/wood.jpeg")
+        startup.end("textures")
+        startup.begin("shaders")
+        self.shaders = ShaderCache()
+        lit = {"MAX_LIGHTS_PER_CLUSTER": max_lights_per_cluster}
+        basic = {}
+        if compact_vertices:
+            lit["COMPACT_VERTICES"] = basic["COMPACT_VERTICES"] = 1
+        self.shaderBasic, self.shaderInstanced = self.shaders.build([
+            ("shaders/simple_3d_vertex_instanced.txt", "shaders/simple_3d_fragment.txt", basic),
+            ("shaders/vertex_instanced.txt", "shaders/fragment.txt", lit),
+        ])
+        startup.end("shaders")
+        self.litShaders = [self.shaderInstanced]
+        self.lights = LightSet(max_lights, near=0.1, far=10, maxPerCluster=max_lights_per_cluster)
+        self.camera = CameraBuffer()
+
+        self.projection = pyrr.matrix44.create_perspective_projection(45, width / height, 0.1, 10, dtype=np.float32)
+        self.camera.projection[:] = self.projection
+        for shader in self.litShaders:
+            shader.setVec3("ambient", np.array([0.1, 0.1, 0.1], dtype=np.float32))
+            shader.setInt("materialTextures", 0)
+            shader.setUVec3("clusterGrid", (*self.lights.tiles, self.lights.slices))
+            shader.setVec2("screenSize", (width, height))
+            shader.setVec2("depthRange", (self.lights.near, self.lights.far))
 
         glEnable(GL_DEPTH_TEST)
 
-        self.wood_texture = Material("gfx/crate")
-        self.cube = Cube(self.shader, self.wood_texture, [1, 1, 0.5])
-        self.player = Player([0, 0, 1.2])
-        self.light = Light([self.shaderBasic, self.shader], [0.2, 0.7, 0.8], [1, 1.7, 1.5], 2, self.lightCount)
-        self.lightCount += 1
-        self.light2 = Light([self.shaderBasic, self.shader], [0.9, 0.4, 0.0], [0, 1.7, 0.5], 2, self.lightCount)
-        self.lightCount += 1
-        self.mainLoop()
-
-    def createShader(self, vertexFilepath, fragmentFilepath):
-
-        with open(vertexFilepath, 'r') as f:
-            vertex_src = f.readlines()
-
-        with open(fragmentFilepath, 'r') as f:
-            fragment_src = f.readlines()
-
-        shader = compileProgram(compileShader(vertex_src, GL_VERTEX_SHADER),
-                                compileShader(fragment_src, GL_FRAGMENT_SHADER))
-
-        return shader
-
-    def resetLights(self):
-        glUseProgram(self.shader)
-        for i in range(8):
-            glUniform1i(glGetUniformLocation(self.shader, f"lights[{i}].enabled"), 0)
+        # the cube, the crates and a marker per light
+        self.transforms = TransformStore(1 + crate_grid * crate_grid + max_lights)
+        # one vertex and index buffer per vertex layout, every mesh lives in one of them
+        startup.begin("meshes")
+        cubeMesh = loadMesh("models/cube.obj", "pos_uv_normal")
+        if compact_vertices:
+            # each arena holds a single mesh, so that mesh's bounds are the quantization box
+            self.litArena = GeometryArena("pos_uv_normal_compact", positionBounds=cubeMesh.bounds())
+            self.basicArena = GeometryArena("pos_compact",
+                                            positionBounds=CubeBasic.buildMesh(0.1, 0.1, 0.1, 1, 1, 1).bounds())
+            for shader, arena in ((self.shaderInstanced, self.litArena), (self.shaderBasic, self.basicArena)):
+                shader.setVec3("positionOffset", arena.positionOffset)
+                shader.setVec3("positionScale", arena.positionScale)
+        else:
+            self.litArena = GeometryArena("pos_uv_normal")
+            self.basicArena = GeometryArena("pos_colour")
+        # every drawable's world bounds, the cube first, then the crates, then one marker per light
+        self.scene = BVH(1 + crate_grid * crate_grid + max_lights)
+        self.cubeMesh = self.litArena.add(cubeMesh)
+        self.lod = None
+        if level_of_detail:
+            from engine.lod import LodSelector, buildLodChain, describeChain
+            chain, report = buildLodChain(cubeMesh)
+            print(describeChain(report))
+            self.cubeLevels = np.array([self.cubeMesh] + [self.litArena.add(mesh) for mesh in chain[1:]])
+            self.lod = LodSelector(1 + crate_grid * crate_grid, lod_screen_sizes[:len(chain) - 1], lod_hysteresis)
+            # the bounding sphere every level fits in, in the cube's own space
+            lo, hi = cubeMesh.bounds()
+            self.cubeCentre = (lo + hi) / 2
+            self.cubeRadius = np.linalg.norm(hi - lo) / 2
+        startup.end("meshes")
+        # the cube and the crates are instances of one batch, its rows line up with their scene handles
+        self.cubes = CubeBatch(self.shaderInstanced, self.materials, self.litArena, self.cubeMesh,
+                               1 + crate_grid * crate_grid)
+        self.cube = Cube(self.cubes, [1, 1, 0.5], self.transforms, self.scene, self.crateMaterial)
+        self.crateSlots = np.array([self.transforms.add([2 + 1.5 * i, 1.5 * (j - crate_grid / 2), -1])
+                                    for i in range(crate_grid) for j in range(crate_grid)], dtype=np.int64)
+        self.transforms.update()
+        for slot in self.crateSlots:
+            i, j = divmod(int(slot - self.crateSlots[0]), crate_grid)
+            self.cubes.add(self.transforms.matrices[slot].ravel(), (self.crateMaterial, self.woodMaterial)[(i + j) % 2])
+        crateMins, crateMaxs = transformBounds(*self.litArena.bounds(self.cubeMesh), self.cubes.models()[1:])
+        # spinning crates are tested against the frustum by the workers that move them, the scene culls the rest
+        spinning = bool(crate_spin and crate_grid)
+        if not spinning:
+            self.scene.addMany(crateMins, crateMaxs)
+        self.cubeHandles = (self.cube.handle, 1 if spinning else self.cubes.count)
+        # the cube and the crates again without the markers, for collisions and picking, handles are batch rows
+        self.colliders = createIndex(spatial_index, 1 + crate_grid * crate_grid)
+        self.colliders.add(self.scene.mins[self.cube.handle], self.scene.maxs[self.cube.handle])
+        self.colliders.addMany(crateMins, crateMaxs)
+        self.crateUpdate = None
+        self.visibleCrates = np.zeros(0, dtype=np.int64)
+        self.cullStats = {"visible": 0, "culled": 0}
+        if spinning:
+            from engine.pipeline import SPIN_INPUTS, SPIN_OUTPUTS, FramePipeline, spinObjects
+            self.crateUpdate = FramePipeline(spinObjects, SPIN_INPUTS, SPIN_OUTPUTS, crate_grid * crate_grid,
+                                             update_workers, update_processes)
+            self.crateUpdate.inputs["positions"][:] = self.transforms.positions[self.crateSlots]
+            self.crateUpdate.inputs["scales"][:] = self.transforms.scales[self.crateSlots]
+            self.crateUpdate.inputs["spin"][:] = np.radians(crate_spin)
+            # the first frame needs a finished update to show
+            self.crateUpdate.begin(self.crateParams(0))
+        self.player = Player([0, 0, 1.2], self.colliders, player_radius)
+        self.markerCube = CubeBasic(self.basicArena, 0.1, 0.1, 0.1, 1, 1, 1)
+        self.markers = CubeBasicBatch(self.shaderBasic, self.basicArena, self.markerCube.handle, max_lights)
+        firstMarker = self.scene.count
+        self.light = Light(self.lights, self.markers, self.transforms, self.scene, [0.2, 0.7, 0.8], [1, 1.7, 1.5], 2)
+        self.light2 = Light(self.lights, self.markers, self.transforms, self.scene, [0.9, 0.4, 0.0], [0, 1.7, 0.5], 2)
+        rng = np.random.default_rng(0)
+        self.extraLights = [Light(self.lights, self.markers, self.transforms, self.scene, rng.uniform(0.2, 1, 3),
+                                  rng.uniform([-2, -5, -1], [10, 5, 2]), rng.uniform(0.5, 1.5))
+                            for _ in range(extra_lights)]
+        self.markerHandles = (firstMarker, self.markers.count)
+        allLights = [self.light, self.light2] + self.extraLights
+        self.markerSlots = np.array([light.slot for light in allLights], dtype=np.int64)
+        self.markerRows = np.array([light.marker for light in allLights], dtype=np.int64)
+        # built the first time deferred shading is switched on
+        self.deferred = None
+        self.useDeferred = deferred_shading
+        if compact_vertices:
+            from engine.quantize import describe
+            for report in self.litArena.reports + self.basicArena.reports:
+                print(describe(report))
+        # the frame's draws are recorded once and replayed, a batch is re-recorded when its commands change
+        self.commandList = CommandList()
+        self.cubes.track(self.commandList)
+        self.markers.track(self.commandList)
+        self.capture = None
+        if capture_path:
+            from engine.capture import FrameCapture, createWriter
+            self.capture = FrameCapture(width, height, createWriter(capture_path, width, height, target_fps or 60))
+        if not headless:
+            self.mainLoop()
 
     def mainLoop(self):
         running = True
+        firstFrame = True
         while (running):
-            # check events
-            for event in pg.event.get():
-                if (event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
-                    running = False
-            self.handleMouse()
-            self.handleKeys()
-            # update objects
-            self.cube.update()
-            self.light.update()
-            self.light2.update()
-            self.player.update([self.shaderBasic, self.shader])
-            # refresh screen
-            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-            self.cube.draw()
-            self.light.draw()
-            self.light2.draw()
-            pg.display.flip()
+            self.clock.beginFrame()
+            profiler.beginFrame()
+            with profiler.scope("input"):
+                # check events
+                for event in pg.event.get():
+                    if (event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
+                        running = False
+                    if event.type == pg.KEYDOWN and event.key == pg.K_TAB:
+                        self.useDeferred = not self.useDeferred
+                    if event.type == pg.MOUSEBUTTONDOWN and event.button == 1:
+                        self.pick()
+                self.handleMouse()
+            with profiler.scope("simulate"):
+                alpha = self.clock.update(self.step)
+            self.renderFrame(alpha)
+            with profiler.scope("flip"):
+                if self.capture is not None:
+                    self.capture.capture()
+                pg.display.flip()
+            if firstFrame:
+                firstFrame = False
+                startup.mark("first frame")
+                print(f"first frame after {startup.marks['first frame']:.1f} ms")
+            elif not self.materials.pending and "textures ready" not in startup.marks:
+                startup.mark("textures ready")
+                print(f"{startup.describe()} {self.textures.stats} {self.materials.stats}")
+                if startup_profile_path:
+                    startup.save(startup_profile_path)
 
             # timing
+            self.clock.endFrame()
             self.showFrameRate()
         self.quit()
 
-    def handleKeys(self):
+    def step(self, dt):
+        self.player.beginStep()
+        self.handleKeys(dt)
+
+    def renderFrame(self, alpha=1.0):
+        state.beginFrame()
+        resources.beginFrame()
+        self.shaderBasic.beginFrame()
+        self.shaderInstanced.beginFrame()
+        # update objects
+        with profiler.scope("update"):
+            self.materials.poll()
+            if self.transforms.update():
+                self.updateMarkers()
+            with profiler.scope("Player.update"):
+                self.player.update(self.camera, alpha)
+            if self.crateUpdate is not None:
+                with profiler.scope("crates"):
+                    self.updateCrates(alpha)
+            with profiler.scope("lights"):
+                self.lights.update(self.player.view, self.projection, clusters=not self.useDeferred)
+        # only what intersects the view frustum is updated and drawn
+        with profiler.scope("cull"):
+            visible = self.scene.cull(frustumPlanes(self.player.view, self.projection))
+            visibleCubes = np.concatenate((visibleRange(visible, *self.cubeHandles), self.visibleCrates))
+            self.cubes.setVisible(visibleCubes)
+            # the crates the scene does not hold count too
+            crates = len(self.visibleCrates)
+            self.cullStats["visible"] = self.scene.stats["visible"] + crates
+            self.cullStats["culled"] = self.scene.stats["culled"] + self.cubes.count - self.cubeHandles[1] - crates
+            if self.lod is not None:
+                self.selectLevels(visibleCubes)
+            self.markers.setVisible(visibleRange(visible, *self.markerHandles))
+        with profiler.scope("draw"):
+            if len(visibleCubes) and visibleCubes[0] == self.cube.row:
+                self.cube.update()
+            self.cubes.prepare()
+            self.markers.prepare()
+            self.commandList.update()
+            if self.useDeferred:
+                self.drawDeferred()
+            else:
+                # refresh screen
+                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+                self.commandList.replay()
+            self.camera.endFrame()
+
+    def createDeferred(self):
+        defines = {"COMPACT_VERTICES": 1} if compact_vertices else {}
+        geometry, ambient, light = self.shaders.build([
+            ("shaders/vertex_instanced.txt", "shaders/gbuffer_fragment.txt", defines),
+            ("shaders/fullscreen_vertex.txt", "shaders/ambient_fragment.txt"),
+            ("shaders/light_volume_vertex.txt", "shaders/light_volume_fragment.txt"),
+        ])
+        geometry.setInt("materialTextures", 0)
+        if compact_vertices:
+            geometry.setVec3("positionOffset", self.litArena.positionOffset)
+            geometry.setVec3("positionScale", self.litArena.positionScale)
+        ambient.setVec3("ambient", np.array([0.1, 0.1, 0.1], dtype=np.float32))
+        target = self.context.fbo if self.headless else 0
+        from engine.deferred import DeferredRenderer
+        self.deferred = DeferredRenderer(width, height, geometry, ambient, light, self.lights, target)
+
+    def drawDeferred(self):
+        # the crates go into the G-buffer and are lit from it, the markers are unlit and drawn forward on top
+        if self.deferred is None:
+            self.createDeferred()
+        with profiler.scope("geometry"):
+            self.deferred.begin()
+            self.commandList.replay({self.shaderInstanced: self.deferred.geometryProgram, self.shaderBasic: None})
+        with profiler.scope("lighting"):
+            self.deferred.resolve()
+        self.commandList.replay({self.shaderInstanced: None})
+
+    def selectLevels(self, rows):
+        # the visible crates' levels from how large their bounding spheres are on screen
+        from engine.lod import screenDiameters
+        models = self.cubes.models()[rows]
+        centres = models[:, 3, :3] + self.cubeCentre @ models[:, :3, :3]
+        radii = self.cubeRadius * np.linalg.norm(models[:, :3, :3], axis=2).max(axis=1)
+        diameters = screenDiameters(centres, radii, self.camera.position, self.projection, height)
+        self.cubes.setMeshes(rows, self.cubeLevels[self.lod.select(rows, diameters)])
+
+    def crateParams(self, time, planes=None):
+        lo, hi = self.litArena.bounds(self.cubeMesh)
+        return {"time": time, "localMin": lo, "localMax": hi, "planes": planes}
+
+    def updateMarkers(self):
+        # the markers are drawn where the transform store placed their lights, only moved rows are uploaded
+        positions = self.transforms.matrices[self.markerSlots, 3, :3]
+        moved = np.flatnonzero((self.markers.instances[self.markerRows, 0:3] != positions).any(axis=1))
+        if len(moved):
+            self.markers.instances[self.markerRows[moved], 0:3] = positions[moved]
+            self.markers.markDirty(self.markerRows[moved])
+
+    def updateCrates(self, alpha):
+        # shows the crates the workers finished during the last frame and starts on the next frame's,
+        # which run while this frame is culled and submitted
+        crates = self.crateUpdate.finish()
+        count = self.cubes.count
+        self.cubes.instances[1:count, :16] = crates["matrices"].reshape(-1, 16)
+        self.cubes.markDirty(slice(1, count))
+        # batch rows of the crates the workers found in the frustum, which was one frame old when they started
+        self.visibleCrates = np.flatnonzero(crates["classes"] != OUTSIDE) + 1
+        self.colliders.setBounds(slice(1, count), crates["mins"], crates["maxs"])
+        # the next frame is assumed to take as long as the last one
+        shown = self.clock.fixed.time + alpha * self.clock.fixed.dt
+        self.crateUpdate.begin(self.crateParams(shown + self.clock.elapsed,
+                                                frustumPlanes(self.player.view, self.projection)))
+
+    def handleKeys(self, dt):
         keys = pg.key.get_pressed()
         if keys[pg.K_w]:
-            self.player.move(0, 0.0025 * self.frameTime)
+            self.player.move(0, walk_speed * dt)
             return
         if keys[pg.K_a]:
-            self.player.move(90, 0.0025 * self.frameTime)
+            self.player.move(90, walk_speed * dt)
             return
         if keys[pg.K_s]:
-            self.player.move(180, 0.0025 * self.frameTime)
+            self.player.move(180, walk_speed * dt)
             return
         if keys[pg.K_d]:
-            self.player.move(-90, 0.0025 * self.frameTime)
+            self.player.move(-90, walk_speed * dt)
             return
 
+    def pick(self):
+        # swaps the material of whatever is in the middle of the screen
+        hits, _ = self.colliders.raycast(self.player.position, self.player.forward, pick_range)
+        row = int(hits[0])
+        if row >= 0:
+            material = self.cubes.instances[row, 16]
+            self.cubes.setMaterial(row, self.woodMaterial if material == self.crateMaterial else self.crateMaterial)
+
     def handleMouse(self):
+        # the mouse reports a distance, not a rate, so it is not scaled by the frame time
         (x, y) = pg.mouse.get_pos()
-        theta_increment = self.frameTime * 0.05 * (width/2 - x)
-        phi_increment = self.frameTime * 0.05 * (height/2 - y)
+        theta_increment = mouse_sensitivity * (width/2 - x)
+        phi_increment = mouse_sensitivity * (height/2 - y)
         self.player.increment_direction(theta_increment, phi_increment)
         pg.mouse.set_pos((width/2, height/2))
 
     def showFrameRate(self):
-        self.currentTime = pg.time.get_ticks()
+        # perf_counter rather than pg.time.get_ticks, which stays 0 when only the display was initialised
+        self.currentTime = time.perf_counter()
         delta = self.currentTime - self.lastTime
-        if (delta >= 1000):
-            framerate = int(1000.0 * self.numFrames / delta)
-            pg.display.set_caption(f"Running at {framerate} fps.")
+        if (delta >= 1):
+            timing = self.clock.timings.stats()
+            pg.display.set_caption(f"Running at {int(timing['fps'])} fps, "
+                                   f"{timing['frameMs']:.2f} ms (p99 {timing['p99Ms']:.2f} ms, "
+                                   f"{timing['busy']:.0%} busy). "
+                                   f"GL binds: {state.lastFrame['issued']} issued, {state.lastFrame['skipped']} skipped. "
+                                   f"Objects: {self.cullStats['visible']} visible, {self.cullStats['culled']} culled. "
+                                   f"Commands: {self.commandList.stats['reused']} reused, "
+                                   f"record {self.commandList.stats['recordMs']:.2f} ms, "
+                                   f"replay {self.commandList.stats['replayMs']:.2f} ms, "
+                                   f"{self.commandList.stats['triangles']} triangles. "
+                                   f"Shading: {'deferred' if self.useDeferred else 'forward'}. "
+                                   f"GPU memory: {resources.total / 2 ** 20:.1f} MB."
+                                   + (f" {profiler.caption()}" if profiler.enabled else ""))
             self.lastTime = self.currentTime
-            self.numFrames = -1
-            self.frameTime = float(1000.0 / framerate)
-        self.numFrames += 1
 
     def quit(self):
-        self.cube.destroy()
-        self.wood_texture.destroy()
-        self.light.destroy()
-        self.light2.destroy()
-        glDeleteProgram(self.shader)
+        if profiler.enabled:
+            profiler.flush()
+            print(profiler.describe())
+            if profile_trace_path:
+                profiler.export(profile_trace_path)
+        profiler.destroy()
+        if self.capture is not None:
+            self.capture.finish()
+            print(f"captured {self.capture.stats}")
+        if self.crateUpdate is not None:
+            self.crateUpdate.destroy()
+        self.commandList.destroy()
+        if self.deferred is not None:
+            self.deferred.destroy()
+        self.cubes.destroy()
+        self.materials.destroy()
+        self.textures.destroy()
+        self.markers.destroy()
+        self.markerCube.destroy()
+        self.litArena.destroy()
+        self.basicArena.destroy()
+        self.lights.destroy()
+        self.camera.destroy()
+        self.shaderInstanced.destroy()
+        self.shaderBasic.destroy()
+        if self.headless:
+            self.context.destroy()
+        resources.checkLeaks()
         pg.quit()
 
 
 class Cube:
-    def __init__(self, shader, material, position):
-        self.material = material
-        self.shader = shader
+    def __init__(self, batch, position, transforms, scene, material):
+        self.batch = batch
         self.position = position
-        glUseProgram(shader)
-        # x, y, z, s, t, nx, ny, nz
-        self.vertices = (
-            -0.5, -0.5, -0.5, 0, 0, 0, 0, -1,
-            0.5, -0.5, -0.5, 1, 0, 0, 0, -1,
-            0.5, 0.5, -0.5, 1, 1, 0, 0, -1,
-
-            0.5, 0.5, -0.5, 1, 1, 0, 0, -1,
-            -0.5, 0.5, -0.5, 0, 1, 0, 0, -1,
-            -0.5, -0.5, -0.5, 0, 0, 0, 0, -1,
-
-            -0.5, -0.5, 0.5, 0, 0, 0, 0, 1,
-            0.5, -0.5, 0.5, 1, 0, 0, 0, 1,
-            0.5, 0.5, 0.5, 1, 1, 0, 0, 1,
-
-            0.5, 0.5, 0.5, 1, 1, 0, 0, 1,
-            -0.5, 0.5, 0.5, 0, 1, 0, 0, 1,
-            -0.5, -0.5, 0.5, 0, 0, 0, 0, 1,
-
-            -0.5, 0.5, 0.5, 1, 0, -1, 0, 0,
-            -0.5, 0.5, -0.5, 1, 1, -1, 0, 0,
-            -0.5, -0.5, -0.5, 0, 1, -1, 0, 0,
-
-            -0.5, -0.5, -0.5, 0, 1, -1, 0, 0,
-            -0.5, -0.5, 0.5, 0, 0, -1, 0, 0,
-            -0.5, 0.5, 0.5, 1, 0, -1, 0, 0,
-
-            0.5, 0.5, 0.5, 1, 0, 1, 0, 0,
-            0.5, 0.5, -0.5, 1, 1, 1, 0, 0,
-            0.5, -0.5, -0.5, 0, 1, 1, 0, 0,
-
-            0.5, -0.5, -0.5, 0, 1, 1, 0, 0,
-            0.5, -0.5, 0.5, 0, 0, 1, 0, 0,
-            0.5, 0.5, 0.5, 1, 0, 1, 0, 0,
-
-            -0.5, -0.5, -0.5, 0, 1, 0, -1, 0,
-            0.5, -0.5, -0.5, 1, 1, 0, -1, 0,
-            0.5, -0.5, 0.5, 1, 0, 0, -1, 0,
-
-            0.5, -0.5, 0.5, 1, 0, 0, -1, 0,
-            -0.5, -0.5, 0.5, 0, 0, 0, -1, 0,
-            -0.5, -0.5, -0.5, 0, 1, 0, -1, 0,
-
-            -0.5, 0.5, -0.5, 0, 1, 0, 1, 0,
-            0.5, 0.5, -0.5, 1, 1, 0, 1, 0,
-            0.5, 0.5, 0.5, 1, 0, 0, 1, 0,
-
-            0.5, 0.5, 0.5, 1, 0, 0, 1, 0,
-            -0.5, 0.5, 0.5, 0, 0, 0, 1, 0,
-            -0.5, 0.5, -0.5, 0, 1, 0, 1, 0
-        )
-        self.vertex_count = len(self.vertices) // 8
-        self.vertices = np.array(self.vertices, dtype=np.float32)
-
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
-        self.vbo = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_STATIC_DRAW)
-
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(0))
-
-        glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(12))
-
-        glEnableVertexAttribArray(2)
-        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, 32, ctypes.c_void_p(20))
+        self.transforms = transforms
+        self.slot = transforms.add(position)
+        self.row = batch.add(transforms.matrices[self.slot].ravel(), material)
+        self.scene = scene
+        lo, hi = batch.arena.bounds(batch.mesh)
+        self.handle = scene.add(lo + position, hi + position)
 
     def update(self):
-        glUseProgram(self.shader)
-        angle = np.radians((20 * (pg.time.get_ticks() / 1000)) % 360)
-        model_transform = pyrr.matrix44.create_identity(dtype=np.float32)
-        # model_transform = pyrr.matrix44.multiply(model_transform, pyrr.matrix44.create_from_z_rotation(theta=angle,dtype=np.float32))
-        model_transform = pyrr.matrix44.multiply(model_transform,
-                                                 pyrr.matrix44.create_from_translation(vec=np.array(self.position),
-                                                                                       dtype=np.float32))
-        glUniformMatrix4fv(glGetUniformLocation(self.shader, "model"), 1, GL_FALSE, model_transform)
-
-    def draw(self):
-        glUseProgram(self.shader)
-        self.material.use()
-        glBindVertexArray(self.vao)
-        glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
-
-    def destroy(self):
-        glDeleteVertexArrays(1, (self.vao,))
-        glDeleteBuffers(1, (self.vbo,))
-
-
-class Material:
-    def __init__(self, filepath):
-        self.diffuseTexture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.diffuseTexture)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        image = pg.image.load(f"{filepath}_diffuse.jpg").convert()
-        image_width, image_height = image.get_rect().size
-        img_data = pg.image.tostring(image, 'RGBA')
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, image_width, image_height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
-        glGenerateMipmap(GL_TEXTURE_2D)
-
-        self.specularTexture = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.specularTexture)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        image = pg.image.load(f"{filepath}_specular.jpg").convert()
-        image_width, image_height = image.get_rect().size
-        img_data = pg.image.tostring(image, 'RGBA')
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, image_width, image_height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
-        glGenerateMipmap(GL_TEXTURE_2D)
-
-    def use(self):
-        glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.diffuseTexture)
-        glActiveTexture(GL_TEXTURE1)
-        glBindTexture(GL_TEXTURE_2D, self.specularTexture)
-
-    def destroy(self):
-        glDeleteTextures(2, (self.diffuseTexture, self.specularTexture))
+        # the row follows the transform store, it is only uploaded when the matrix changed
+        model = self.transforms.matrices[self.slot].ravel()
+        if not np.array_equal(self.batch.instances[self.row, :16], model):
+            self.batch.setModel(self.row, model)
 
 
 class Player:
-    def __init__(self, position):
+    def __init__(self, position, colliders=None, radius=0.25):
         self.position = np.array(position, dtype=np.float32)
+        self.colliders = colliders
+        self.radius = radius
+        # position before the last fixed step, rendering blends the two
+        self.previous = self.position.copy()
         self.forward = np.array([0, 0, 0], dtype=np.float32)
         self.theta = 0
         self.phi = 0
         self.moveSpeed = 1
         self.global_up = np.array([0, 0, 1], dtype=np.float32)
 
+    def beginStep(self):
+        self.previous[:] = self.position
+
     def move(self, direction, amount):
         walkDirection = (direction + self.theta) % 360
         self.position[0] += amount * self.moveSpeed * np.cos(np.radians(walkDirection), dtype=np.float32)
         self.position[1] += amount * self.moveSpeed * np.sin(np.radians(walkDirection), dtype=np.float32)
+        if self.colliders is not None:
+            # the camera walks at a fixed height, so it only slides sideways along what it hits
+            pushOut(self.colliders, self.position, self.radius, axes=(0, 1))
 
     def increment_direction(self, theta_increase, phi_increase):
         self.theta = (self.theta + theta_increase) % 360
         self.phi = min(max(self.phi + phi_increase, -89), 89)
 
-    def update(self, shaders):
+    def update(self, camera, alpha=1.0):
+        position = self.previous + (self.position - self.previous) * np.float32(alpha)
         camera_cos = np.cos(np.radians(self.theta), dtype=np.float32)
         camera_sin = np.sin(np.radians(self.theta), dtype=np.float32)
         camera_cos2 = np.cos(np.radians(self.phi), dtype=np.float32)
@@ -294,117 +528,55 @@ class Player:
 
         right = pyrr.vector3.cross(self.global_up, self.forward)
         up = pyrr.vector3.cross(self.forward, right)
-        lookat_matrix = pyrr.matrix44.create_look_at(self.position, self.position + self.forward, up, dtype=np.float32)
-        for shader in shaders:
-            glUseProgram(shader)
-            glUniformMatrix4fv(glGetUniformLocation(shader, "view"), 1, GL_FALSE, lookat_matrix)
-            glUniform3fv(glGetUniformLocation(shader, "cameraPos"), 1, self.position)
+        self.view = pyrr.matrix44.create_look_at(position, position + self.forward, up, dtype=np.float32)
+        camera.view[:] = self.view
+        camera.position[:] = position
+        camera.upload()
 
 
 class Light:
-    def __init__(self, shaders, colour, position, strength, index):
-        self.model = CubeBasic(shaders[0], 0.1, 0.1, 0.1, colour[0], colour[1], colour[2])
+    def __init__(self, lights, markers, transforms, scene, colour, position, strength):
+        self.lights = lights
+        self.markers = markers
+        self.transforms = transforms
+        self.scene = scene
         self.colour = np.array(colour, dtype=np.float32)
-        self.shader = shaders[1]
         self.position = np.array(position, dtype=np.float32)
         self.strength = strength
-        self.index = index
+        self.index = lights.add(self.position, self.colour, strength)
+        self.slot = transforms.add(self.position)
+        self.marker = markers.add(self.position, self.colour)
+        self.handle = scene.add(*self.markerBounds())
 
-    def update(self):
-        glUseProgram(self.shader)
-        glUniform3fv(glGetUniformLocation(self.shader, f"lights[{self.index}].pos"), 1, self.position)
-        glUniform3fv(glGetUniformLocation(self.shader, f"lights[{self.index}].color"), 1, self.colour)
-        glUniform1f(glGetUniformLocation(self.shader, f"lights[{self.index}].strength"), self.strength)
-        glUniform1i(glGetUniformLocation(self.shader, f"lights[{self.index}].enabled"), 1)
+    def markerBounds(self):
+        lo, hi = self.markers.arena.bounds(self.markers.mesh)
+        return lo + self.position, hi + self.position
 
-    def draw(self):
-        self.model.draw(self.position)
-
-    def destroy(self):
-        self.model.destroy()
+    def move(self, position):
+        self.position[:] = position
+        self.lights.setPosition(self.index, self.position)
+        self.transforms.setPosition(self.slot, self.position)
+        self.scene.setBounds(self.handle, *self.markerBounds())
 
 
 class CubeBasic:
-    def __init__(self, shader, l, w, h, r, g, b):
-        self.shader = shader
-        glUseProgram(shader)
-        # x, y, z, r, g, b
-        self.vertices = (
-            -l / 2, -w / 2, -h / 2, r, g, b,
-            l / 2, -w / 2, -h / 2, r, g, b,
-            l / 2, w / 2, -h / 2, r, g, b,
-
-            l / 2, w / 2, -h / 2, r, g, b,
-            -l / 2, w / 2, -h / 2, r, g, b,
-            -l / 2, -w / 2, -h / 2, r, g, b,
-
-            -l / 2, -w / 2, h / 2, r, g, b,
-            l / 2, -w / 2, h / 2, r, g, b,
-            l / 2, w / 2, h / 2, r, g, b,
-
-            l / 2, w / 2, h / 2, r, g, b,
-            -l / 2, w / 2, h / 2, r, g, b,
-            -l / 2, -w / 2, h / 2, r, g, b,
-
-            -l / 2, w / 2, h / 2, r, g, b,
-            -l / 2, w / 2, -h / 2, r, g, b,
-            -l / 2, -w / 2, -h / 2, r, g, b,
-
-            -l / 2, -w / 2, -h / 2, r, g, b,
-            -l / 2, -w / 2, h / 2, r, g, b,
-            -l / 2, w / 2, h / 2, r, g, b,
-
-            l / 2, w / 2, h / 2, r, g, b,
-            l / 2, w / 2, -h / 2, r, g, b,
-            l / 2, -w / 2, -h / 2, r, g, b,
-
-            l / 2, -w / 2, -h / 2, r, g, b,
-            l / 2, -w / 2, h / 2, r, g, b,
-            l / 2, w / 2, h / 2, r, g, b,
-
-            -l / 2, -w / 2, -h / 2, r, g, b,
-            l / 2, -w / 2, -h / 2, r, g, b,
-            l / 2, -w / 2, h / 2, r, g, b,
-
-            l / 2, -w / 2, h / 2, r, g, b,
-            -l / 2, -w / 2, h / 2, r, g, b,
-            -l / 2, -w / 2, -h / 2, r, g, b,
-
-            -l / 2, w / 2, -h / 2, r, g, b,
-            l / 2, w / 2, -h / 2, r, g, b,
-            l / 2, w / 2, h / 2, r, g, b,
-
-            l / 2, w / 2, h / 2, r, g, b,
-            -l / 2, w / 2, h / 2, r, g, b,
-            -l / 2, w / 2, -h / 2, r, g, b
-        )
-        self.vertex_count = len(self.vertices) // 6
-        self.vertices = np.array(self.vertices, dtype=np.float32)
-
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
-        self.vbo = glGenBuffers(1)
-        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
-        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, GL_STATIC_DRAW)
-
-        glEnableVertexAttribArray(0)
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(0))
-
-        glEnableVertexAttribArray(1)
-        glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 24, ctypes.c_void_p(12))
-
-    def draw(self, position):
-        glUseProgram(self.shader)
-        model_transform = pyrr.matrix44.create_identity(dtype=np.float32)
-        model_transform = pyrr.matrix44.multiply(model_transform,
-                                                 pyrr.matrix44.create_from_translation(vec=position, dtype=np.float32))
-        glUniformMatrix4fv(glGetUniformLocation(self.shader, "model"), 1, GL_FALSE, model_transform)
-        glBindVertexArray(self.vao)
-        glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
+    def __init__(self, arena, l, w, h, r, g, b):
+        self.arena = arena
+        self.mesh = self.buildMesh(l, w, h, r, g, b)
+        self.handle = arena.add(self.mesh)
+
+    @staticmethod
+    def buildMesh(l, w, h, r, g, b):
+        # x, y, z, r, g, b, the unit cube scaled to l x w x h and painted one colour
+        cube = loadMesh("models/cube.obj", "pos_colour")
+        vertices = np.array(cube.vertices, dtype=np.float32)
+        vertices[:, 0:3] *= (l, w, h)
+        vertices[:, 3:6] = (r, g, b)
+        return Mesh(vertices, cube.indices, cube.lines, "pos_colour")
 
     def destroy(self):
-        glDeleteVertexArrays(1, (self.vao,))
-        glDeleteBuffers(1, (self.vbo,))
+        self.arena.remove(self.handle)
 
 
-myApp = App()
\ No newline at end of file
+if __name__ == "__main__":
+    myApp = App()
\ No newline at end of file
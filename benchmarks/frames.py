@@ -0,0 +1,261 @@
+# renders a scripted scene of Lab 1 or Lab 3 offscreen and records per-frame CPU time, GPU time and draw calls
+# run from the repository root: python -m benchmarks.frames --lab 3 --frames 600 --out lab3.json
+# a summary saved with --save-baseline can be checked against later with --baseline and --threshold
+# forward and deferred shading compare with the same scene, e.g. --crate-grid 20 --extra-lights 200 with and
+# without --deferred, and the triangles submitted with and without --lod
+# --lab 1 --particles 1000000 streams a million points a frame through engine.streaming
+# --crate-spin 45 turns the crates on the update workers, they move with the simulated time like the particles
+import argparse
+import csv
+import importlib.util
+import json
+import math
+import os
+import sys
+import ctypes
+import time
+
+from engine import headless
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LABS = {"1": ("Lab 1", "Lab 1.py"), "3": ("Lab 3", "Lab 3.py")}
+# GL_TIME_ELAPSED results are read this many frames after they were issued so the CPU never waits on them
+QUERY_LATENCY = 4
+# the scripts move by a fixed amount of simulated time per frame so every run follows the same path
+FRAME_TIME = 1.0 / 60
+
+
+def loadLab(lab):
+    directory, script = LABS[lab]
+    # the labs open shaders, models and textures relative to their own folder
+    os.chdir(os.path.join(ROOT, directory))
+    spec = importlib.util.spec_from_file_location(f"lab{lab}", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def scriptLab1(app, frame):
+    # the rabbit walks a square, 30 frames per side
+    step = [(0.01, 0), (0, 0.01), (-0.01, 0), (0, -0.01)][(frame // 30) % 4]
+    app.move(*step)
+
+
+def scriptLab3(app, frame):
+    # turn around the crates while strafing back and forth at walk_speed, with a slow nod
+    app.player.beginStep()
+    app.player.increment_direction(0.6, 0.3 * math.sin(frame * 0.05))
+    app.player.move(90 if (frame // 120) % 2 == 0 else -90, 2.5 * FRAME_TIME)
+
+
+SCRIPTS = {"1": scriptLab1, "3": scriptLab3}
+
+
+def advanceClock(app):
+    # crate spin and particles read the lab's fixed step clock, which only its main loop advances, the scripts
+    # do the moving so the steps themselves do nothing
+    app.clock.elapsed = FRAME_TIME
+    app.clock.update(lambda dt: None)
+
+
+class GpuTimer:
+    def __init__(self, gl, size):
+        # PyOpenGL's wrapper has no array type for GLuint64, the raw entry point takes a pointer
+        from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+        self.gl = gl
+        self.getResult = glGetQueryObjectui64v
+        self.queries = list(gl.glGenQueries(size))
+        self.pending = []
+        self.result = ctypes.c_uint64()
+
+    def begin(self, frame):
+        query = self.queries[frame % len(self.queries)]
+        self.gl.glBeginQuery(self.gl.GL_TIME_ELAPSED, query)
+        self.pending.append((frame, query))
+
+    def end(self):
+        self.gl.glEndQuery(self.gl.GL_TIME_ELAPSED)
+
+    def collect(self, samples, wait=False):
+        # with wait=False only queries at least QUERY_LATENCY frames old are read
+        while self.pending and (wait or len(self.pending) > QUERY_LATENCY):
+            frame, query = self.pending.pop(0)
+            self.getResult(query, self.gl.GL_QUERY_RESULT, ctypes.byref(self.result))
+            samples[frame]["gpuMs"] = self.result.value / 1e6
+
+    def destroy(self):
+        self.gl.glDeleteQueries(len(self.queries), self.queries)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * fraction
+    low = math.floor(position)
+    high = math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarise(samples):
+    summary = {}
+    for key in ("cpuMs", "gpuMs", "draws", "binds", "gpuMB", "visible", "culled", "recordMs", "replayMs", "reused",
+                "recorded", "triangles", "captureMs", "streamWaitMs"):
+        values = [sample[key] for sample in samples if sample.get(key) is not None]
+        if not values:
+            continue
+        summary[key] = {"mean": sum(values) / len(values), "p50": percentile(values, 0.5),
+                        "p90": percentile(values, 0.9), "p99": percentile(values, 0.99)}
+    return summary
+
+
+def run(lab, frames, warmup, crateGrid=None, capture=None, trace=None, deferred=False, extraLights=None, lod=False,
+        particles=None, crateSpin=None):
+    module = loadLab(lab)
+    from OpenGL import GL
+    from engine.gl_state import state
+    from engine.profiler import profiler
+    from engine.resources import resources
+
+    if crateGrid is not None:
+        module.crate_grid = crateGrid
+    if crateSpin is not None:
+        module.crate_spin = crateSpin
+    if extraLights is not None:
+        module.extra_lights = extraLights
+    if deferred:
+        module.deferred_shading = True
+    if lod:
+        module.level_of_detail = True
+    if particles is not None:
+        module.particles = particles
+    if capture is not None:
+        module.capture_path = capture
+    if trace is not None:
+        # the lab enables the profiler, prints its table and writes the trace when it quits
+        module.profile_trace_path = trace
+    app = module.App(headless=True)
+    culling = getattr(app, "cullStats", None)
+    commandList = getattr(app, "commandList", None)
+    frameCapture = getattr(app, "capture", None)
+    stream = app.particles.stream if getattr(app, "particles", None) is not None else None
+    script = SCRIPTS[lab]
+    if lab == "3":
+        # the benchmark measures steady state, not the background texture decode
+        app.materials.wait()
+    timer = GpuTimer(GL, QUERY_LATENCY + 2)
+    samples = []
+    for frame in range(warmup + frames):
+        start = time.perf_counter_ns()
+        profiler.beginFrame()
+        advanceClock(app)
+        script(app, frame)
+        if frame >= warmup:
+            timer.begin(len(samples))
+        app.renderFrame()
+        if frameCapture is not None:
+            frameCapture.capture()
+        if frame >= warmup:
+            timer.end()
+        GL.glFlush()
+        cpuMs = (time.perf_counter_ns() - start) / 1e6
+        if frame >= warmup:
+            # renderFrame starts with state.beginFrame, so stats hold exactly this frame
+            sample = {"frame": len(samples), "cpuMs": cpuMs, "gpuMs": None,
+                      "draws": state.stats["draws"], "binds": state.stats["issued"],
+                      "gpuMB": resources.total / 2 ** 20}
+            if culling is not None:
+                sample["visible"] = culling["visible"]
+                sample["culled"] = culling["culled"]
+            if commandList is not None:
+                for key in ("recordMs", "replayMs", "reused", "recorded", "triangles"):
+                    sample[key] = commandList.stats[key]
+            if frameCapture is not None:
+                sample["captureMs"] = frameCapture.stats["copyMs"]
+            if stream is not None:
+                sample["streamWaitMs"] = stream.stats["waitMs"]
+            samples.append(sample)
+            timer.collect(samples)
+    timer.collect(samples, wait=True)
+    timer.destroy()
+    renderer = GL.glGetString(GL.GL_RENDERER).decode()
+    app.quit()
+    return samples, renderer
+
+
+def compare(summary, baseline, threshold):
+    # a metric regresses when its p50 or p90 grew by more than threshold (0.1 = 10%) over the baseline
+    failures = []
+    for key in ("cpuMs", "gpuMs", "draws", "gpuMB"):
+        if key not in summary or key not in baseline:
+            continue
+        for stat in ("p50", "p90"):
+            old, new = baseline[key][stat], summary[key][stat]
+            if old > 0 and new > old * (1 + threshold):
+                failures.append(f"{key} {stat}: {new:.3f} vs baseline {old:.3f} (+{(new / old - 1) * 100:.1f}%)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lab", choices=sorted(LABS), default="3")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--warmup", type=int, default=60)
+    parser.add_argument("--crate-grid", type=int, help="Lab 3 only, overrides crate_grid")
+    parser.add_argument("--extra-lights", type=int, help="Lab 3 only, overrides extra_lights")
+    parser.add_argument("--crate-spin", type=float, help="Lab 3 only, overrides crate_spin in degrees per second")
+    parser.add_argument("--deferred", action="store_true", help="Lab 3 only, lights the scene with deferred shading")
+    parser.add_argument("--lod", action="store_true", help="Lab 3 only, draws small crates from simplified cubes")
+    parser.add_argument("--particles", type=int, help="Lab 1 only, overrides particles")
+    parser.add_argument("--capture", help="Lab 3 only, records the frames to a video file or a png directory")
+    parser.add_argument("--trace", help="profiles every frame's scopes and writes a Chrome trace")
+    parser.add_argument("--platform", choices=headless.PLATFORMS, default="egl")
+    parser.add_argument("--out", help="per-frame samples and summary as JSON")
+    parser.add_argument("--csv", help="per-frame samples as CSV")
+    parser.add_argument("--baseline", help="JSON written by --out or --save-baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--save-baseline", help="write only the summary, for use with --baseline")
+    args = parser.parse_args()
+
+    # has to happen before anything imports OpenGL
+    headless.configure(args.platform)
+    outputs = [os.path.abspath(path) if path else None
+               for path in (args.out, args.csv, args.baseline, args.save_baseline, args.capture, args.trace)]
+    out, csvPath, baselinePath, savePath, capturePath, tracePath = outputs
+
+    samples, renderer = run(args.lab, args.frames, args.warmup, args.crate_grid, capturePath, tracePath,
+                            args.deferred, args.extra_lights, args.lod, args.particles, args.crate_spin)
+    summary = summarise(samples)
+    report = {"lab": args.lab, "frames": args.frames, "warmup": args.warmup, "crateGrid": args.crate_grid,
+              "extraLights": args.extra_lights, "shading": "deferred" if args.deferred else "forward", "lod": args.lod,
+              "particles": args.particles, "crateSpin": args.crate_spin, "renderer": renderer,
+              "summary": summary}
+
+    for key, values in summary.items():
+        print(f"{key:>6}  mean {values['mean']:9.3f}  p50 {values['p50']:9.3f}  "
+              f"p90 {values['p90']:9.3f}  p99 {values['p99']:9.3f}")
+    if out:
+        with open(out, "w") as f:
+            json.dump(dict(report, samples=samples), f, indent=1)
+    if csvPath:
+        with open(csvPath, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(samples[0]) if samples else ["frame"])
+            writer.writeheader()
+            writer.writerows(samples)
+    if savePath:
+        with open(savePath, "w") as f:
+            json.dump(report, f, indent=1)
+    if baselinePath:
+        with open(baselinePath) as f:
+            baseline = json.load(f)
+        if baseline.get("renderer") != renderer:
+            print(f"warning: baseline was recorded on {baseline.get('renderer')}, this run is on {renderer}")
+        failures = compare(summary, baseline["summary"], args.threshold)
+        for failure in failures:
+            print(f"regression: {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# builds the LOD chains of the labs' meshes, or of any .obj, and reports triangles, vertices and error per level,
+# nothing here touches GL, so it runs anywhere numpy does
+# run from the repository root: python -m benchmarks.lod --mesh path/to/model.obj pos_uv_normal
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.frames import ROOT
+from engine.lod import LOD_RATIOS, buildLodChain, describeChain
+from engine.meshes import loadMesh
+
+# the rabbit of Lab 1 and the crate cube of Lab 3
+MESHES = ((os.path.join("Lab 1", "models", "rabbit.obj"), "pos_colour"),
+          (os.path.join("Lab 3", "models", "cube.obj"), "pos_uv_normal"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mesh", nargs=2, action="append", metavar=("PATH", "LAYOUT"),
+                        help="an .obj and the layout to load it in, instead of the labs' meshes")
+    parser.add_argument("--ratios", type=float, nargs="+", default=LOD_RATIOS)
+    parser.add_argument("--max-error", type=float, help="no level simplifies past this distance")
+    args = parser.parse_args()
+
+    meshes = [(path, layout) for path, layout in args.mesh] if args.mesh else \
+        [(os.path.join(ROOT, path), layout) for path, layout in MESHES]
+    with tempfile.TemporaryDirectory() as cacheDir:
+        for path, layout in meshes:
+            mesh = loadMesh(path, layout, cacheDir)
+            start = time.perf_counter()
+            _, report = buildLodChain(mesh, args.ratios, args.max_error)
+            print(f"{os.path.relpath(path, ROOT)}: {describeChain(report)} "
+                  f"in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
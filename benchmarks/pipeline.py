@@ -0,0 +1,90 @@
+# measures FramePipeline with the spinObjects update (rotation, model matrix, world bounds, frustum test)
+# over object counts and worker counts, with and without overlapping a stand-in for the GL thread's submission
+# run from the repository root: python -m benchmarks.pipeline --counts 10000 100000 1000000 --workers 0 1 2 4 8
+import argparse
+import os
+import time
+
+import numpy as np
+import pyrr
+
+from engine.culling import frustumPlanes
+from engine.pipeline import SPIN_INPUTS, SPIN_OUTPUTS, FramePipeline, spinObjects
+
+FRAME_TIME = 1.0 / 60
+
+
+def createPipeline(count, workers, processes):
+    pipeline = FramePipeline(spinObjects, SPIN_INPUTS, SPIN_OUTPUTS, count, workers, processes)
+    rng = np.random.default_rng(0)
+    pipeline.inputs["positions"][:] = rng.uniform(-100, 100, (count, 3))
+    pipeline.inputs["scales"][:] = 1
+    pipeline.inputs["spin"][:] = rng.uniform(-np.pi, np.pi, count)
+    return pipeline
+
+
+def params(frame):
+    view = pyrr.matrix44.create_look_at([0, 0, 0], [np.cos(frame * 0.01), np.sin(frame * 0.01), 0], [0, 0, 1],
+                                        dtype=np.float32)
+    projection = pyrr.matrix44.create_perspective_projection(45, 1.6, 0.1, 200, dtype=np.float32)
+    return {"time": frame * FRAME_TIME, "localMin": np.full(3, -0.5, dtype=np.float32),
+            "localMax": np.full(3, 0.5, dtype=np.float32), "planes": frustumPlanes(view, projection)}
+
+
+def submit(seconds):
+    # stands in for the GL thread's work, sleeping releases the GIL like a driver call or a swap does
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def measure(pipeline, frames, submitSeconds, overlap):
+    # (update ms, frame ms) medians, the update is timed from begin to the end of finish
+    updates, frameTimes = [], []
+    pipeline.begin(params(0))
+    pipeline.finish()
+    for frame in range(1, frames + 1):
+        start = time.perf_counter()
+        if overlap:
+            pipeline.finish()
+            pipeline.begin(params(frame))
+            submit(submitSeconds)
+        else:
+            pipeline.begin(params(frame))
+            pipeline.finish()
+            submit(submitSeconds)
+        frameTimes.append(time.perf_counter() - start)
+        updates.append(pipeline.stats["updateMs"])
+    pipeline.finish()
+    return float(np.median(updates)), float(np.median(frameTimes)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4, 8])
+    parser.add_argument("--processes", action="store_true", help="process pool over shared memory instead of threads")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--submit-ms", type=float, default=5.0, help="GL thread time the update can overlap with")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cpus, {'processes' if args.processes else 'threads'}, submit {args.submit_ms} ms")
+    print(f"{'objects':>8} {'workers':>7} {'update ms':>10} {'Mobj/s':>8} {'serial ms':>10} {'overlap ms':>10} "
+          f"{'speedup':>8}")
+    for count in args.counts:
+        baseline = None
+        for workers in args.workers:
+            pipeline = createPipeline(count, workers, args.processes)
+            try:
+                # the first frames start the pool's threads or processes
+                measure(pipeline, 3, 0, True)
+                update, serial = measure(pipeline, args.frames, args.submit_ms / 1000, False)
+                _, overlapped = measure(pipeline, args.frames, args.submit_ms / 1000, workers > 0)
+            finally:
+                pipeline.destroy()
+            baseline = baseline or serial
+            print(f"{count:>8} {workers:>7} {update:>10.2f} {count / update / 1000:>8.1f} {serial:>10.2f} "
+                  f"{overlapped:>10.2f} {baseline / overlapped:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# times the spatial hash and the BVH over random boxes: building, moving a fraction of the objects and batched
+# ray, sphere and box queries, with a brute force pass as the reference where it fits in memory
+# objects keep the same density at every size, so queries find about as much at 1k objects as at 1M
+# run from the repository root: python -m benchmarks.spatial --sizes 1000 100000 1000000
+import argparse
+import time
+
+import numpy as np
+
+from engine.culling import boxesOverlap, nearestPerQuery, normalizeRays, rayBoxes, spheresOverlap
+from engine.spatial import createIndex
+
+# pairs per pass of the brute force reference, it tests every query against every object
+BRUTE_CHUNK = 1 << 22
+
+
+class BruteForce:
+    # every query against every object, the same calls as the indices
+    def __init__(self, capacity):
+        self.mins = np.zeros((capacity, 3), dtype=np.float32)
+        self.maxs = np.zeros((capacity, 3), dtype=np.float32)
+        self.count = 0
+
+    def addMany(self, mins, maxs):
+        self.mins[self.count:self.count + len(mins)] = mins
+        self.maxs[self.count:self.count + len(mins)] = maxs
+        self.count += len(mins)
+
+    def setBounds(self, handles, mins, maxs):
+        self.mins[handles] = mins
+        self.maxs[handles] = maxs
+
+    def pairs(self, count, test):
+        # test(queries, handles) over every pair, a few queries at a time
+        step = max(1, BRUTE_CHUNK // max(self.count, 1))
+        found = []
+        for first in range(0, count, step):
+            queries = np.repeat(np.arange(first, min(first + step, count)), self.count)
+            handles = np.tile(np.arange(self.count), len(queries) // max(self.count, 1))
+            hit = test(queries, handles)
+            found.append((queries[hit], handles[hit]))
+        return np.concatenate([pair[0] for pair in found]), np.concatenate([pair[1] for pair in found])
+
+    def queryBoxes(self, mins, maxs):
+        return self.pairs(len(mins), lambda q, h: boxesOverlap(mins[q], maxs[q], self.mins[h], self.maxs[h]))
+
+    def querySpheres(self, centres, radii):
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float32), len(centres))
+        return self.pairs(len(centres), lambda q, h: spheresOverlap(centres[q], radii[q], self.mins[h], self.maxs[h]))
+
+    def raycast(self, origins, directions, maxDistance=np.inf):
+        directions, inverse = normalizeRays(directions)
+        distances = {}
+
+        def test(rays, handles):
+            entry, exit = rayBoxes(origins[rays], inverse[rays], self.mins[handles], self.maxs[handles])
+            hit = (entry <= exit) & (entry <= maxDistance)
+            distances[len(distances)] = entry[hit]
+            return hit
+
+        rays, handles = self.pairs(len(origins), test)
+        return nearestPerQuery(rays, handles, np.concatenate(list(distances.values())), len(origins))
+
+
+def randomBoxes(rng, count, side):
+    centres = rng.uniform(0, side, (count, 3)).astype(np.float32)
+    extents = rng.uniform(0.1, 1.0, (count, 3)).astype(np.float32)
+    return centres - extents, centres + extents
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=(1000, 100000, 1000000))
+    parser.add_argument("--backends", nargs="+", default=("grid", "bvh", "brute"), choices=("grid", "bvh", "brute"))
+    parser.add_argument("--queries", type=int, default=1000, help="rays, spheres and boxes per batch")
+    parser.add_argument("--moved", type=float, default=0.01, help="fraction of the objects moved per update")
+    parser.add_argument("--cell-size", type=float, default=2.0)
+    parser.add_argument("--density", type=float, default=0.05, help="objects per unit of volume")
+    parser.add_argument("--brute-limit", type=int, default=10000, help="largest size brute force runs at")
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'backend':>7} {'build ms':>9} {'move ms':>8} {'rays ms':>8} {'spheres ms':>10} "
+          f"{'boxes ms':>9} {'hits':>6} {'pairs':>8} {'agrees':>6}")
+    for size in args.sizes:
+        rng = np.random.default_rng(0)
+        side = (size / args.density) ** (1 / 3)
+        mins, maxs = randomBoxes(rng, size, side)
+        moved = rng.choice(size, int(size * args.moved), replace=False)
+        shift = rng.uniform(-1, 1, (len(moved), 3)).astype(np.float32)
+        origins = rng.uniform(0, side, (args.queries, 3))
+        directions = rng.normal(size=(args.queries, 3))
+        centres = rng.uniform(0, side, (args.queries, 3)).astype(np.float32)
+        radii = rng.uniform(0.5, 2.0, args.queries).astype(np.float32)
+        reference = None
+        for backend in args.backends:
+            if backend == "brute" and size > args.brute_limit:
+                continue
+            index = BruteForce(size) if backend == "brute" else createIndex(backend, size, args.cell_size)
+
+            def build():
+                index.addMany(mins, maxs)
+                # the BVH builds on its first query
+                if hasattr(index, "update"):
+                    index.update()
+
+            def move():
+                index.setBounds(moved, mins[moved] + shift, maxs[moved] + shift)
+                if hasattr(index, "update"):
+                    index.update()
+
+            buildMs, _ = timed(build)
+            moveMs, _ = timed(move)
+            raysMs, (hits, _) = timed(index.raycast, origins, directions)
+            spheresMs, spheres = timed(index.querySpheres, centres, radii)
+            boxesMs, boxes = timed(index.queryBoxes, centres - radii[:, None], centres + radii[:, None])
+            # pairs come back sorted by query, so results compare directly across backends
+            result = (hits, spheres, boxes)
+            if reference is None:
+                reference = result
+            agrees = np.array_equal(hits, reference[0]) and all(
+                np.array_equal(a, b) for mine, theirs in zip(result[1:], reference[1:]) for a, b in zip(mine, theirs))
+            print(f"{size:>8} {backend:>7} {buildMs:>9.1f} {moveMs:>8.2f} {raysMs:>8.1f} {spheresMs:>10.1f} "
+                  f"{boxesMs:>9.1f} {int((hits >= 0).sum()):>6} {len(spheres[0]):>8} {str(agrees):>6}")
+
+
+if __name__ == "__main__":
+    main()
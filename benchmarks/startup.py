@@ -0,0 +1,116 @@
+# starts Lab 1 or Lab 3 offscreen in fresh processes and reports where startup time goes: imports, context creation,
+# shaders, textures, meshes, the first frame and the textures being ready
+# run from the repository root: python -m benchmarks.startup --lab 3 --runs 10 --fast
+# a summary saved with --save-baseline can be checked against later with --baseline and --threshold
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from benchmarks.frames import LABS, ROOT, percentile
+from engine import headless
+
+# phases and marks shorter than this are noise and never count as a regression
+MIN_REGRESSION_MS = 2.0
+
+
+def child(lab, fast, platform):
+    # one startup in this process, the report goes to stdout as the last line
+    headless.configure(platform)
+    from engine.startup import configureOpenGL, startup
+    configureOpenGL(fast)
+    from benchmarks.frames import loadLab
+    module = loadLab(lab)
+    module.fast_startup = fast
+    app = module.App(headless=True)
+    from OpenGL import GL
+    app.renderFrame()
+    GL.glFinish()
+    startup.mark("first frame")
+    materials = getattr(app, "materials", None)
+    if materials is not None:
+        while materials.pending:
+            app.renderFrame()
+            GL.glFinish()
+        startup.mark("textures ready")
+    report = startup.report()
+    app.quit()
+    print(json.dumps(report))
+
+
+def runChild(lab, fast, platform, cold):
+    if cold:
+        # the shader binaries, decoded mip chains and parsed meshes are all under the lab's .cache
+        shutil.rmtree(os.path.join(ROOT, LABS[lab][0], ".cache"), ignore_errors=True)
+    command = [sys.executable, "-m", "benchmarks.startup", "--child", "--lab", lab, "--platform", platform]
+    if fast:
+        command.append("--fast")
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"startup run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarise(reports):
+    # phase or mark name: p50, min and max in ms over the runs
+    values = {}
+    for report in reports:
+        for group in ("phases", "marks"):
+            for name, ms in report[group].items():
+                values.setdefault(name, []).append(ms)
+    return {name: {"p50": percentile(times, 0.5), "min": min(times), "max": max(times)}
+            for name, times in values.items()}
+
+
+def compare(summary, baseline, threshold):
+    # a phase or mark regresses when its median grew by more than threshold (0.1 = 10%) and MIN_REGRESSION_MS
+    failures = []
+    for name, values in summary.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]["p50"], values["p50"]
+        if new > old * (1 + threshold) and new - old > MIN_REGRESSION_MS:
+            failures.append(f"{name}: {new:.1f} ms vs baseline {old:.1f} ms (+{(new / old - 1) * 100:.1f}%)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lab", choices=sorted(LABS), default="3")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fast", action="store_true", help="start the lab with fast_startup")
+    parser.add_argument("--cold", action="store_true", help="clear the lab's asset caches before every run")
+    parser.add_argument("--platform", choices=headless.PLATFORMS, default="egl")
+    parser.add_argument("--baseline", help="JSON written by --save-baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--save-baseline", help="write the summary, for use with --baseline")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.lab, args.fast, args.platform)
+        return
+
+    reports = [runChild(args.lab, args.fast, args.platform, args.cold) for _ in range(args.runs)]
+    summary = summarise(reports)
+    print(f"Lab {args.lab}, {'fast' if args.fast else 'default'} startup, {'cold' if args.cold else 'warm'} caches, "
+          f"{args.runs} runs")
+    for name, values in summary.items():
+        print(f"{name:>15}  p50 {values['p50']:8.1f} ms  min {values['min']:8.1f} ms  max {values['max']:8.1f} ms")
+    report = {"lab": args.lab, "fast": args.fast, "cold": args.cold, "runs": args.runs, "summary": summary}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(summary, baseline["summary"], args.threshold)
+        for failure in failures:
+            print(f"regression: {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# compares the per-object pyrr path of Cube.update / CubeBasic.draw with TransformStore.update, after checking
+# composeMatrices against pyrr for random translations, rotations and scales
+# run from the repository root: python -m benchmarks.transforms
+import time
+
+import numpy as np
+import pyrr
+
+from engine.transforms import TransformStore, composeMatrices
+
+
+def pyrrPath(positions):
+    for position in positions:
+        model_transform = pyrr.matrix44.create_identity(dtype=np.float32)
+        model_transform = pyrr.matrix44.multiply(model_transform,
+                                                 pyrr.matrix44.create_from_translation(vec=position, dtype=np.float32))
+
+
+def pyrrMatrices(positions, rotations, scales):
+    # scale * rotation * translation one object at a time, what composeMatrices has to reproduce
+    return np.array([pyrr.matrix44.multiply(
+        pyrr.matrix44.multiply(pyrr.matrix44.create_from_scale(scale, dtype=np.float32),
+                               pyrr.matrix44.create_from_quaternion(rotation / np.linalg.norm(rotation),
+                                                                    dtype=np.float32)),
+        pyrr.matrix44.create_from_translation(position, dtype=np.float32))
+        for position, rotation, scale in zip(positions, rotations, scales)])
+
+
+def checkAgainstPyrr(rng, count=1000):
+    positions = rng.uniform(-10, 10, (count, 3)).astype(np.float32)
+    rotations = rng.normal(size=(count, 4)).astype(np.float32)
+    scales = rng.uniform(0.1, 3, (count, 3)).astype(np.float32)
+    matrices = np.empty((count, 4, 4), dtype=np.float32)
+    composeMatrices(positions, rotations, scales, matrices)
+    expected = pyrrMatrices(positions, rotations, scales)
+    assert np.allclose(matrices, expected, atol=1e-5), \
+        f"composeMatrices differs from pyrr by up to {np.abs(matrices - expected).max()}"
+
+
+def storePath(store):
+    store.dirty[:store.count] = True
+    store.update()
+
+
+def timeIt(function, argument, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(argument)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(0)
+    checkAgainstPyrr(rng)
+    print(f"{'objects':>8} {'pyrr ms':>10} {'store ms':>10} {'speedup':>8}")
+    for count in (1, 1000, 100000):
+        positions = rng.uniform(-10, 10, (count, 3)).astype(np.float32)
+        store = TransformStore(count)
+        for position in positions:
+            store.add(position)
+        repeats = 3 if count > 1000 else 20
+        pyrrTime = timeIt(pyrrPath, positions, repeats)
+        storeTime = timeIt(storePath, store, repeats)
+        print(f"{count:>8} {pyrrTime * 1000:>10.3f} {storeTime * 1000:>10.3f} {pyrrTime / storeTime:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
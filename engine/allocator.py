@@ -0,0 +1,88 @@
+import bisect
+
+
+class RangeAllocator:
+    # first fit sub-allocation of [0, capacity) in units of the caller's choosing (vertices, indices, ...),
+    # handles stay valid across compaction, only their offsets change
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # sorted, coalesced (offset, size) runs of free space
+        self.free = [(0, capacity)] if capacity > 0 else []
+        self.allocations = {}
+        self.nextHandle = 0
+
+    def allocate(self, size):
+        if size <= 0:
+            raise ValueError(f"allocation size must be positive, got {size}")
+        for i, (offset, length) in enumerate(self.free):
+            if length >= size:
+                if length == size:
+                    del self.free[i]
+                else:
+                    self.free[i] = (offset + size, length - size)
+                handle = self.nextHandle
+                self.nextHandle += 1
+                self.allocations[handle] = (offset, size)
+                return handle
+        raise IndexError(f"no free run of {size} in allocator ({self.freeSpace()} free, "
+                         f"largest run {self.largestFree()})")
+
+    def release(self, handle):
+        offset, size = self.allocations.pop(handle)
+        i = bisect.bisect_left(self.free, (offset, size))
+        # merge with the run before and after when they touch
+        if i > 0 and self.free[i - 1][0] + self.free[i - 1][1] == offset:
+            i -= 1
+            offset, size = self.free[i][0], self.free[i][1] + size
+            del self.free[i]
+        if i < len(self.free) and offset + size == self.free[i][0]:
+            size += self.free[i][1]
+            del self.free[i]
+        self.free.insert(i, (offset, size))
+
+    def offset(self, handle):
+        return self.allocations[handle][0]
+
+    def size(self, handle):
+        return self.allocations[handle][1]
+
+    def freeSpace(self):
+        return sum(length for _, length in self.free)
+
+    def largestFree(self):
+        return max((length for _, length in self.free), default=0)
+
+    def used(self):
+        # one past the end of the highest allocation
+        return max((offset + size for offset, size in self.allocations.values()), default=0)
+
+    def fragmentation(self):
+        # 0 when all free space is one run, approaching 1 as it splinters
+        free = self.freeSpace()
+        return 0.0 if free == 0 else 1.0 - self.largestFree() / free
+
+    def compact(self):
+        # slides every allocation down to close the gaps, keeping their order, and returns the moves as
+        # (handle, oldOffset, newOffset, size) in ascending order, every move is towards lower offsets
+        # so applying them in order with memmove semantics never overwrites data that still has to move
+        moves = []
+        cursor = 0
+        for handle, (offset, size) in sorted(self.allocations.items(), key=lambda item: item[1][0]):
+            if offset != cursor:
+                moves.append((handle, offset, cursor, size))
+                self.allocations[handle] = (cursor, size)
+            cursor += size
+        self.free = [(cursor, self.capacity - cursor)] if cursor < self.capacity else []
+        return moves
+
+    def grow(self, capacity):
+        if capacity < self.capacity:
+            raise ValueError(f"allocator can only grow, {capacity} < {self.capacity}")
+        added = (self.capacity, capacity - self.capacity)
+        self.capacity = capacity
+        if added[1] == 0:
+            return
+        if self.free and self.free[-1][0] + self.free[-1][1] == added[0]:
+            self.free[-1] = (self.free[-1][0], self.free[-1][1] + added[1])
+        else:
+            self.free.append(added)
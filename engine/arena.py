@@ -0,0 +1,206 @@
+from OpenGL.GL import *
+import numpy as np
+
+from engine.allocator import RangeAllocator
+from engine.gl_state import state
+from engine.quantize import COMPACT_LAYOUTS, compactMesh, decodeBox
+from engine.resources import resources
+
+# bytes per vertex and (location, size, type, normalized, offset) of every attribute, all read from VERTEX_BINDING
+FORMATS = {
+    "pos_uv_normal": (32, ((0, 3, GL_FLOAT, GL_FALSE, 0), (1, 2, GL_FLOAT, GL_FALSE, 12),
+                           (2, 3, GL_FLOAT, GL_FALSE, 20))),
+    "pos_colour": (24, ((0, 3, GL_FLOAT, GL_FALSE, 0), (1, 3, GL_FLOAT, GL_FALSE, 12))),
+    "pos_uv_normal_compact": (16, ((0, 3, GL_SHORT, GL_TRUE, 0), (1, 2, GL_HALF_FLOAT, GL_FALSE, 8),
+                                   (2, 4, GL_INT_2_10_10_10_REV, GL_TRUE, 12))),
+    "pos_compact": (8, ((0, 3, GL_SHORT, GL_TRUE, 0),)),
+}
+VERTEX_BINDING = 0
+INSTANCE_BINDING = 1
+# DrawElementsIndirectCommand: count, instanceCount, firstIndex, baseVertex, baseInstance
+COMMAND_WIDTH = 5
+
+
+class GeometryArena:
+    # one vertex buffer and one index buffer for every mesh of a vertex layout, meshes get sub-ranges
+    # of both from a RangeAllocator and are drawn with glMultiDrawElementsIndirect using baseVertex,
+    # so any number of meshes share one VAO and one draw call
+    # compact layouts need positionBounds, every mesh is quantized inside that box and the shaders
+    # decode with positionOffset + positionScale * position
+    def __init__(self, layout, vertexCapacity=65536, indexCapacity=262144, positionBounds=None):
+        self.layout = layout
+        self.stride, self.attributes = FORMATS[layout]
+        self.quantized = layout in COMPACT_LAYOUTS.values()
+        if self.quantized:
+            if positionBounds is None:
+                raise ValueError(f"{layout} arena needs positionBounds to quantize into")
+            self.positionBounds = positionBounds
+            self.positionOffset, self.positionScale = decodeBox(positionBounds)
+        self.reports = []
+        self.vertices = RangeAllocator(vertexCapacity)
+        self.indices = RangeAllocator(indexCapacity)
+        self.vbo = self.createBuffer(vertexCapacity * self.stride)
+        self.ebo = self.createBuffer(indexCapacity * 4)
+        self.indirect = resources.genBuffers(1, f"{layout} arena indirect")
+        # bytes the indirect buffer holds, it only ever grows so submits just overwrite it
+        self.indirectCapacity = 0
+        self.meshes = {}
+        self.nextMesh = 0
+        # per mesh handle, looked up with fancy indexing when commands are built
+        self.table = np.zeros((16, 3), dtype=np.int64)
+        self.vaos = []
+        self.vao = resources.genVertexArrays(1, f"{layout} arena")
+        self.attach(self.vao)
+        self.stats = {"compactions": 0, "grown": 0}
+
+    def createBuffer(self, size):
+        buffer = resources.genBuffers(1, f"{self.layout} arena")
+        # uploads go through the copy targets, binding GL_ELEMENT_ARRAY_BUFFER would change the bound VAO
+        glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+        resources.bufferData(GL_COPY_WRITE_BUFFER, buffer, size, None, GL_STATIC_DRAW)
+        return buffer
+
+    def attach(self, vao):
+        # points vao at the arena's buffers and sets up the layout's attributes, vao stays bound
+        state.bindVertexArray(vao)
+        glBindVertexBuffer(VERTEX_BINDING, self.vbo, 0, self.stride)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        for location, size, kind, normalized, offset in self.attributes:
+            glEnableVertexAttribArray(location)
+            glVertexAttribFormat(location, size, kind, normalized, offset)
+            glVertexAttribBinding(location, VERTEX_BINDING)
+        self.vaos.append(vao)
+
+    def detach(self, vao):
+        self.vaos.remove(vao)
+
+    def add(self, mesh):
+        if self.quantized and COMPACT_LAYOUTS.get(mesh.layout) == self.layout:
+            # every mesh shares the one decode box the shaders get, it cannot grow once meshes are stored in it
+            lo, hi = mesh.bounds()
+            if np.abs((np.array((lo, hi)) - self.positionOffset) / self.positionScale).max() > 1 + 1e-5:
+                raise ValueError(f"mesh bounds {lo}, {hi} are outside the {self.layout} arena's decode box "
+                                 f"{self.positionBounds}, positionBounds has to cover every mesh added")
+            mesh, report = compactMesh(mesh, self.positionBounds)
+            self.reports.append(report)
+        if mesh.layout != self.layout:
+            raise ValueError(f"{mesh.layout} mesh cannot go into a {self.layout} arena")
+        vertexHandle = self.allocate(self.vertices, len(mesh.vertices))
+        indexHandle = self.allocate(self.indices, len(mesh.indices))
+        handle = self.nextMesh
+        self.nextMesh += 1
+        if handle == len(self.table):
+            self.table = np.concatenate((self.table, np.zeros_like(self.table)))
+        self.meshes[handle] = (vertexHandle, indexHandle, mesh.bounds())
+
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.vbo)
+        glBufferSubData(GL_COPY_WRITE_BUFFER, self.vertices.offset(vertexHandle) * self.stride, mesh.vertices.nbytes,
+                        np.ascontiguousarray(mesh.vertices))
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.ebo)
+        glBufferSubData(GL_COPY_WRITE_BUFFER, self.indices.offset(indexHandle) * 4, len(mesh.indices) * 4,
+                        np.ascontiguousarray(mesh.indices, dtype=np.uint32))
+        self.updateTable(handle)
+        return handle
+
+    def remove(self, handle):
+        vertexHandle, indexHandle, _ = self.meshes.pop(handle)
+        self.vertices.release(vertexHandle)
+        self.indices.release(indexHandle)
+        self.table[handle] = 0
+
+    def bounds(self, handle):
+        return self.meshes[handle][2]
+
+    def updateTable(self, handle):
+        vertexHandle, indexHandle, _ = self.meshes[handle]
+        self.table[handle] = (self.indices.size(indexHandle), self.indices.offset(indexHandle),
+                              self.vertices.offset(vertexHandle))
+
+    def allocate(self, allocator, size):
+        try:
+            return allocator.allocate(size)
+        except IndexError:
+            pass
+        if allocator.freeSpace() >= size:
+            # enough room in total, only scattered
+            self.compact()
+        else:
+            self.grow(allocator, max(allocator.capacity * 2, allocator.used() + size))
+        return allocator.allocate(size)
+
+    def compact(self):
+        for allocator, buffer, unit in ((self.vertices, self.vbo, self.stride), (self.indices, self.ebo, 4)):
+            end = allocator.used()
+            moves = allocator.compact()
+            if not moves:
+                continue
+            # ranges may overlap their destination, so everything is copied out once and moved back from there
+            scratch = resources.genBuffers(1, f"{self.layout} arena compaction")
+            glBindBuffer(GL_COPY_WRITE_BUFFER, scratch)
+            resources.bufferData(GL_COPY_WRITE_BUFFER, scratch, end * unit, None, GL_STREAM_COPY)
+            glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+            glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, end * unit)
+            glBindBuffer(GL_COPY_READ_BUFFER, scratch)
+            glBindBuffer(GL_COPY_WRITE_BUFFER, buffer)
+            for _, old, new, size in moves:
+                glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, old * unit, new * unit, size * unit)
+            resources.deleteBuffers(scratch)
+        for handle in self.meshes:
+            self.updateTable(handle)
+        self.stats["compactions"] += 1
+
+    def grow(self, allocator, capacity):
+        vertices = allocator is self.vertices
+        unit = self.stride if vertices else 4
+        old = self.vbo if vertices else self.ebo
+        new = self.createBuffer(capacity * unit)
+        glBindBuffer(GL_COPY_READ_BUFFER, old)
+        used = allocator.used()
+        if used:
+            glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, used * unit)
+        resources.deleteBuffers(old)
+        allocator.grow(capacity)
+        if vertices:
+            self.vbo = new
+        else:
+            self.ebo = new
+        for vao in self.vaos:
+            state.bindVertexArray(vao)
+            if vertices:
+                glBindVertexBuffer(VERTEX_BINDING, self.vbo, 0, self.stride)
+            else:
+                glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        self.stats["grown"] += 1
+
+    def commands(self, handles, instanceCounts=1, baseInstances=0):
+        # (len(handles), 5) uint32 DrawElementsIndirectCommands, built without a python loop
+        handles = np.asarray(handles, dtype=np.int64)
+        commands = np.empty((len(handles), COMMAND_WIDTH), dtype=np.uint32)
+        rows = self.table[handles]
+        commands[:, 0] = rows[:, 0]
+        commands[:, 1] = instanceCounts
+        commands[:, 2] = rows[:, 1]
+        commands[:, 3] = rows[:, 2]
+        commands[:, 4] = baseInstances
+        return commands
+
+    def submit(self, mode, commands):
+        # the VAO to draw with has to be bound already
+        if len(commands) == 0:
+            return
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.indirect)
+        if commands.nbytes > self.indirectCapacity:
+            self.indirectCapacity = max(commands.nbytes, 2 * self.indirectCapacity)
+            resources.bufferData(GL_DRAW_INDIRECT_BUFFER, self.indirect, self.indirectCapacity, None, GL_DYNAMIC_DRAW)
+        glBufferSubData(GL_DRAW_INDIRECT_BUFFER, 0, commands.nbytes, commands)
+        glMultiDrawElementsIndirect(mode, GL_UNSIGNED_INT, None, len(commands), 0)
+        state.countDraw()
+
+    def draw(self, mode, handles):
+        state.bindVertexArray(self.vao)
+        self.submit(mode, self.commands(handles))
+
+    def destroy(self):
+        state.forgetVertexArray(self.vao)
+        resources.deleteVertexArrays(self.vao)
+        resources.deleteBuffers((self.vbo, self.ebo, self.indirect))
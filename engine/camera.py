@@ -0,0 +1,40 @@
+from OpenGL.GL import *
+import numpy as np
+
+from engine.resources import resources
+from engine.streaming import BufferRing
+
+CAMERA_BINDING = 0
+
+
+class CameraBuffer:
+    # std140 block Camera { mat4 view; mat4 projection; vec3 cameraPos; }, shared by every program
+    def __init__(self, persistent=True):
+        self.data = np.zeros(36, dtype=np.float32)
+        self.view = self.data[0:16].reshape(4, 4)
+        self.projection = self.data[16:32].reshape(4, 4)
+        self.position = self.data[32:35]
+        self.ubo = resources.genBuffers(1, "camera")
+        # a ring of blocks so the CPU never writes the one a frame still in flight reads
+        alignment = int(glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT))
+        stride = (self.data.nbytes + alignment - 1) // alignment * alignment
+        self.ring = BufferRing(GL_UNIFORM_BUFFER, self.ubo, stride, persistent=persistent, usage=GL_DYNAMIC_DRAW)
+        if self.ring.persistent:
+            self.blocks = [self.ring.view(i, np.float32, len(self.data)) for i in range(self.ring.regions)]
+
+    def upload(self):
+        region = self.ring.advance()
+        if self.ring.persistent:
+            self.blocks[region][:] = self.data
+        else:
+            glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+            glBufferSubData(GL_UNIFORM_BUFFER, self.ring.offset, self.data.nbytes, self.data)
+        glBindBufferRange(GL_UNIFORM_BUFFER, CAMERA_BINDING, self.ubo, self.ring.offset, self.data.nbytes)
+
+    def endFrame(self):
+        self.ring.fence()
+
+    def destroy(self):
+        self.blocks = None
+        self.ring.destroy()
+        resources.deleteBuffers(self.ubo)
@@ -0,0 +1,181 @@
+import ctypes
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as readPixelsInto
+import numpy as np
+
+from engine.resources import resources
+
+# extensions createWriter hands to ffmpeg, anything else is a directory of numbered frames
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm", ".mov", ".avi")
+
+
+class RawWriter:
+    # frame_000000.rgba, ... top row first, 4 bytes per pixel without a header
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, index, pixels):
+        with open(os.path.join(self.directory, f"frame_{index:06d}.rgba"), "wb") as f:
+            f.write(np.ascontiguousarray(pixels[::-1]).data)
+
+    def close(self):
+        pass
+
+
+class PngWriter:
+    def __init__(self, directory):
+        import pygame
+        self.image = pygame.image
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, index, pixels):
+        height, width = pixels.shape[:2]
+        surface = self.image.frombuffer(np.ascontiguousarray(pixels[::-1]).tobytes(), (width, height), "RGBA")
+        self.image.save(surface, os.path.join(self.directory, f"frame_{index:06d}.png"))
+
+    def close(self):
+        pass
+
+
+class FfmpegWriter:
+    # raw frames go down a pipe to a local ffmpeg, which flips them and encodes
+    def __init__(self, path, width, height, fps):
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg was not found on PATH, capture to a directory instead")
+        self.process = subprocess.Popen([ffmpeg, "-y", "-loglevel", "error",
+                                         "-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}",
+                                         "-r", str(fps), "-i", "-",
+                                         "-vf", "vflip", "-pix_fmt", "yuv420p", path], stdin=subprocess.PIPE)
+
+    def write(self, index, pixels):
+        self.process.stdin.write(pixels.data)
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with {self.process.returncode}")
+
+
+def createWriter(path, width, height, fps=60, format="png"):
+    # a video file for the extensions in VIDEO_EXTENSIONS, otherwise a directory of png or raw frames
+    if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+        return FfmpegWriter(path, width, height, fps)
+    if format == "raw":
+        return RawWriter(path)
+    return PngWriter(path)
+
+
+class FrameCapture:
+    # reads the bound read framebuffer into a ring of pixel pack buffers, each readback gets a fence and is copied
+    # out once the fence has signalled, which is normally a frame or two later, so glReadPixels never stalls
+    # copies go to a fixed pool of frames that an encoder thread writes and hands back, memory stays at
+    # ringSize frames on the GPU and poolSize in RAM, dropFrames skips frames instead of waiting when the
+    # encoder falls behind
+    def __init__(self, width, height, writer, ringSize=3, poolSize=8, dropFrames=False):
+        self.width = width
+        self.height = height
+        self.size = width * height * 4
+        self.writer = writer
+        self.dropFrames = dropFrames
+        self.pbos = list(np.atleast_1d(resources.genBuffers(ringSize, "frame capture")))
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            resources.bufferData(GL_PIXEL_PACK_BUFFER, pbo, self.size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        # (pbo index, fence, frame index) in submission order
+        self.inFlight = []
+        self.next = 0
+        self.frame = 0
+        self.free = queue.Queue()
+        for _ in range(poolSize):
+            self.free.put(np.empty((height, width, 4), dtype=np.uint8))
+        self.work = queue.Queue()
+        self.error = None
+        self.encoder = threading.Thread(target=self.encode, name="frame capture encoder", daemon=True)
+        self.encoder.start()
+        self.stats = {"captured": 0, "written": 0, "dropped": 0, "stalls": 0, "copyMs": 0.0}
+
+    def capture(self):
+        # call after the frame is drawn and before the swap
+        if self.error is not None:
+            raise self.error
+        start = time.perf_counter()
+        self.collect()
+        if len(self.inFlight) == len(self.pbos):
+            # the ring is full, the oldest readback has to land before its buffer can be reused
+            self.stats["stalls"] += 1
+            self.collectOne(wait=True)
+        pbo = self.next
+        self.next = (self.next + 1) % len(self.pbos)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[pbo])
+        readPixelsInto(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.inFlight.append((pbo, glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0), self.frame))
+        self.frame += 1
+        self.stats["captured"] += 1
+        self.stats["copyMs"] = (time.perf_counter() - start) * 1000
+
+    def collect(self, wait=False):
+        # oldest first, stops at the first readback that has not finished unless wait is set
+        while self.inFlight and self.collectOne(wait):
+            pass
+
+    def collectOne(self, wait):
+        pbo, fence, frame = self.inFlight[0]
+        # GL_SYNC_FLUSH_COMMANDS_BIT so a fence that was never flushed cannot block forever
+        result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1_000_000_000 if wait else 0)
+        while wait and result == GL_TIMEOUT_EXPIRED:
+            result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1_000_000_000)
+        if result not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+            if result == GL_WAIT_FAILED:
+                raise RuntimeError("glClientWaitSync failed on a capture fence")
+            return False
+        self.inFlight.pop(0)
+        glDeleteSync(fence)
+        try:
+            pixels = self.free.get(block=not self.dropFrames)
+        except queue.Empty:
+            self.stats["dropped"] += 1
+            return True
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[pbo])
+        pointer = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.size, GL_MAP_READ_BIT)
+        ctypes.memmove(pixels.ctypes.data, pointer, self.size)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.work.put((frame, pixels))
+        return True
+
+    def encode(self):
+        while True:
+            item = self.work.get()
+            if item is None:
+                return
+            frame, pixels = item
+            try:
+                if self.error is None:
+                    self.writer.write(frame, pixels)
+                    self.stats["written"] += 1
+            except Exception as error:
+                self.error = error
+            finally:
+                self.free.put(pixels)
+
+    def finish(self):
+        # waits for every readback and every write, then closes the writer
+        self.collect(wait=True)
+        self.work.put(None)
+        self.encoder.join()
+        resources.deleteBuffers(self.pbos)
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,127 @@
+import ctypes
+import time
+
+from OpenGL.GL import *
+import numpy as np
+
+from engine.arena import COMMAND_WIDTH
+from engine.gl_state import state
+from engine.resources import resources
+
+# one recorded draw: the state it needs and its range of DrawElementsIndirectCommands in the list's indirect buffer,
+# program and textures index the program and texture set tables of the last rebuild
+ENTRY_DTYPE = np.dtype([("source", np.int32), ("program", np.int32), ("textures", np.int32), ("vao", np.int64),
+                        ("mode", np.int64), ("first", np.int64), ("count", np.int64)])
+STATE_FIELDS = ("program", "textures", "vao", "mode")
+
+
+class CommandList:
+    # sources (anything with record(commandList)) are recorded once and replayed every frame, a source that
+    # changed calls invalidate() and only its entries are recorded again
+    def __init__(self):
+        self.sources = []
+        self.recorded = []
+        self.dirty = set()
+        self.programs = []
+        self.textureSets = []
+        self.recording = None
+        self.runs = []
+        self.indirect = resources.genBuffers(1, "command list")
+        self.stats = {"recordMs": 0.0, "replayMs": 0.0, "recorded": 0, "reused": 0, "entries": 0, "runs": 0,
+                      "triangles": 0}
+
+    def register(self, source):
+        index = len(self.sources)
+        self.sources.append(source)
+        self.recorded.append([])
+        self.dirty.add(index)
+        return index
+
+    def invalidate(self, index):
+        self.dirty.add(index)
+
+    def draw(self, program, vao, textures, mode, commands):
+        # called by a source from inside its record(), textures is ((unit, target, texture), ...)
+        if len(commands) == 0:
+            return
+        self.recorded[self.recording].append((program, tuple(textures), vao, mode,
+                                              np.asarray(commands, dtype=np.uint32)))
+
+    def update(self):
+        # once per frame before the replays, which add up their time in replayMs and what they drew in triangles
+        start = time.perf_counter()
+        self.stats["replayMs"] = 0.0
+        self.stats["triangles"] = 0
+        rebuilt = sorted(self.dirty)
+        self.dirty.clear()
+        for index in rebuilt:
+            self.recorded[index] = []
+            self.recording = index
+            self.sources[index].record(self)
+        self.recording = None
+        if rebuilt:
+            self.rebuild()
+        self.stats["recordMs"] = (time.perf_counter() - start) * 1000
+        self.stats["recorded"] = len(rebuilt)
+        self.stats["reused"] = len(self.sources) - len(rebuilt)
+
+    def rebuild(self):
+        # the tables only hold what is recorded now, programs and textures of dropped entries go with them
+        drawList = [(source, entry) for source, entries in enumerate(self.recorded) for entry in entries]
+        entries = np.zeros(len(drawList), dtype=ENTRY_DTYPE)
+        programs, textureSets = {}, {}
+        for i, (source, (program, textures, vao, mode, commands)) in enumerate(drawList):
+            entries[i] = (source, programs.setdefault(program, len(programs)),
+                          textureSets.setdefault(textures, len(textureSets)), vao, mode, 0, len(commands))
+        self.programs = list(programs)
+        self.textureSets = list(textureSets)
+        # sorted by program first, then textures, then VAO, so state changes between neighbours are rare
+        order = np.lexsort(tuple(entries[field] for field in reversed(STATE_FIELDS)))
+        entries = entries[order]
+        entries["first"] = np.cumsum(entries["count"]) - entries["count"]
+        commands = [drawList[i][1][4] for i in order]
+        packed = np.concatenate(commands) if commands else np.zeros((0, COMMAND_WIDTH), dtype=np.uint32)
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.indirect)
+        resources.bufferData(GL_DRAW_INDIRECT_BUFFER, self.indirect, max(packed.nbytes, 4),
+                             packed if len(packed) else None, GL_STATIC_DRAW)
+
+        # neighbours with identical state are one multi-draw, their commands are already adjacent
+        self.runs = []
+        if len(entries):
+            keys = np.stack([entries[field] for field in STATE_FIELDS], axis=1)
+            starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)])
+            ends = np.r_[starts[1:], len(entries)]
+            for first, last in zip(starts, ends):
+                entry = entries[first]
+                count = int(entries["count"][first:last].sum())
+                runCommands = packed[entry["first"]:entry["first"] + count].astype(np.int64)
+                triangles = int((runCommands[:, 0] * runCommands[:, 1]).sum()) // 3 \
+                    if entry["mode"] == GL_TRIANGLES else 0
+                self.runs.append((self.programs[entry["program"]], int(entry["vao"]),
+                                  self.textureSets[entry["textures"]], int(entry["mode"]),
+                                  ctypes.c_void_p(int(entry["first"]) * COMMAND_WIDTH * 4), count, triangles))
+        self.entries = entries
+        self.stats["entries"] = len(entries)
+        self.stats["runs"] = len(self.runs)
+
+    def replay(self, programs=None):
+        # programs maps a recorded program to the one to draw its runs with instead, or to None to skip them,
+        # e.g. a G-buffer pass drawing the lit batches with a program of the same vertex layout
+        start = time.perf_counter()
+        glBindBuffer(GL_DRAW_INDIRECT_BUFFER, self.indirect)
+        for program, vao, textures, mode, offset, count, triangles in self.runs:
+            if programs is not None:
+                program = programs.get(program, program)
+                if program is None:
+                    continue
+            program.use()
+            state.bindVertexArray(vao)
+            for unit, target, texture in textures:
+                state.bindTexture(unit, target, texture)
+            glMultiDrawElementsIndirect(mode, GL_UNSIGNED_INT, offset, count, 0)
+            state.countDraw()
+            self.stats["triangles"] += triangles
+        self.stats["replayMs"] += (time.perf_counter() - start) * 1000
+
+    def destroy(self):
+        resources.deleteBuffers(self.indirect)
@@ -0,0 +1,323 @@
+import numpy as np
+
+OUTSIDE = 0
+INTERSECTING = 1
+INSIDE = 2
+
+
+def frustumPlanes(view, projection):
+    # (6, 4) planes a*x + b*y + c*z + d >= 0 for points inside, normals unit length
+    # matrices are pyrr style, points are row vectors, so the planes come from the columns of view * projection
+    m = view @ projection
+    planes = np.array([m[:, 3] + m[:, 0], m[:, 3] - m[:, 0],
+                       m[:, 3] + m[:, 1], m[:, 3] - m[:, 1],
+                       m[:, 3] + m[:, 2], m[:, 3] - m[:, 2]], dtype=np.float32)
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def classifyBoxes(planes, mins, maxs):
+    # OUTSIDE, INTERSECTING or INSIDE for every box, from the distance of its centre to each plane against the
+    # box's extent projected on the plane normal, the same as testing its furthest and nearest corner
+    normals = planes[:, :3]
+    centres = (mins + maxs) * 0.5
+    extents = (maxs - mins) * 0.5
+    distance = centres @ normals.T + planes[:, 3]
+    radius = extents @ np.abs(normals).T
+    result = np.full(len(mins), INTERSECTING, dtype=np.int8)
+    result[(distance - radius >= 0).all(axis=1)] = INSIDE
+    result[(distance + radius < 0).any(axis=1)] = OUTSIDE
+    return result
+
+
+def boxesOverlap(minsA, maxsA, minsB, maxsB):
+    # pairwise, touching counts as overlapping
+    return ((minsA <= maxsB) & (minsB <= maxsA)).all(axis=1)
+
+
+def spheresOverlap(centres, radii, mins, maxs):
+    # pairwise, from the squared distance of every centre to the nearest point of its box
+    gap = np.maximum(np.maximum(mins - centres, centres - maxs), 0)
+    return (gap * gap).sum(axis=1) <= radii * radii
+
+
+def rayBoxes(origins, inverseDirections, mins, maxs):
+    # pairwise (entry, exit) distances of rays through boxes, a ray misses where entry > exit,
+    # entry is 0 for rays starting inside, directions are given by their reciprocals
+    with np.errstate(invalid="ignore"):
+        t0 = (mins - origins) * inverseDirections
+        t1 = (maxs - origins) * inverseDirections
+    # fmin and fmax skip the nan of a ray running exactly along a face
+    entry = np.fmax(np.fmin(t0, t1).max(axis=1, initial=-np.inf), 0)
+    exit = np.fmax(t0, t1)
+    exit = np.fmin(np.fmin(exit[:, 0], exit[:, 1]), exit[:, 2])
+    return entry, exit
+
+
+def normalizeRays(directions):
+    # unit directions and their reciprocals, distances along rays are then world units
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    lengths = np.linalg.norm(directions, axis=1, keepdims=True)
+    directions = np.divide(directions, lengths, out=np.zeros_like(directions), where=lengths > 0)
+    with np.errstate(divide="ignore"):
+        return directions, 1.0 / directions
+
+
+def nearestPerQuery(queries, handles, distances, count):
+    # the closest (handle, distance) for each of count queries, -1 and inf where there is none,
+    # ties go to the lowest handle so every index answers the same
+    best = np.full(count, -1, dtype=np.int64)
+    bestDistance = np.full(count, np.inf)
+    order = np.lexsort((handles, distances, queries))
+    queries, handles, distances = queries[order], handles[order], distances[order]
+    first = np.r_[True, queries[1:] != queries[:-1]] if len(queries) else np.zeros(0, dtype=bool)
+    best[queries[first]] = handles[first]
+    bestDistance[queries[first]] = distances[first]
+    return best, bestDistance
+
+
+def transformBounds(mins, maxs, matrices):
+    # world space AABBs of local boxes under (N, 4, 4) pyrr style model matrices
+    centres = (mins + maxs) * 0.5
+    extents = (maxs - mins) * 0.5
+    rotation = matrices[..., :3, :3]
+    worldCentres = np.einsum("...k,...kj->...j", centres, rotation) + matrices[..., 3, :3]
+    worldExtents = np.einsum("...k,...kj->...j", extents, np.abs(rotation))
+    return worldCentres - worldExtents, worldCentres + worldExtents
+
+
+def expandRanges(starts, counts):
+    # concatenation of arange(start, start + count) for every pair, without a python loop
+    total = int(counts.sum())
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(total)
+
+
+def visibleRange(visible, first, count):
+    # the visible handles in [first, first + count) as indices relative to first, visible has to be sorted
+    low, high = np.searchsorted(visible, (first, first + count))
+    return visible[low:high] - first
+
+
+class BVH:
+    # axis aligned bounds of every object in a binary tree over leaves of at most leafSize objects,
+    # moved objects refit their leaf and its ancestors, adds or a badly degraded tree trigger a rebuild
+    # besides frustum culling it answers the queries of engine.spatial.SpatialHash, as its optional backend
+    def __init__(self, capacity, leafSize=8):
+        self.mins = np.zeros((capacity, 3), dtype=np.float32)
+        self.maxs = np.zeros((capacity, 3), dtype=np.float32)
+        # removed objects keep their slot and bounds until the next build, queries skip them
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.count = 0
+        self.leafSize = leafSize
+        self.leafOf = np.zeros(capacity, dtype=np.int64)
+        self.moved = np.zeros(capacity, dtype=bool)
+        self.needsBuild = True
+        self.builtArea = 0.0
+        self.stats = {"visible": 0, "culled": 0, "nodesTested": 0, "refitted": 0, "builds": 0}
+
+    def add(self, mins, maxs):
+        if self.count == len(self.mins):
+            raise IndexError(f"BVH is full ({len(self.mins)} objects)")
+        handle = self.count
+        self.count += 1
+        self.mins[handle] = mins
+        self.maxs[handle] = maxs
+        self.alive[handle] = True
+        self.needsBuild = True
+        return handle
+
+    def addMany(self, mins, maxs):
+        # handles of the new objects are consecutive, the first one is returned
+        first = self.count
+        if first + len(mins) > len(self.mins):
+            raise IndexError(f"BVH is full ({len(self.mins)} objects)")
+        self.count += len(mins)
+        self.mins[first:self.count] = mins
+        self.maxs[first:self.count] = maxs
+        self.alive[first:self.count] = True
+        self.needsBuild = True
+        return first
+
+    def remove(self, handle):
+        self.alive[handle] = False
+
+    def setBounds(self, handle, mins, maxs):
+        self.mins[handle] = mins
+        self.maxs[handle] = maxs
+        self.moved[handle] = True
+
+    def build(self):
+        count = self.count
+        self.order = np.arange(count)
+        nodeMin, nodeMax, left, right, start, size = [], [], [], [], [], []
+        centres = (self.mins[:count] + self.maxs[:count]) * 0.5
+        # preorder with an explicit stack, so every child has a larger index than its parent
+        stack = [(0, count, -1, 0)]
+        while stack:
+            first, last, parent, side = stack.pop()
+            node = len(left)
+            objects = self.order[first:last]
+            nodeMin.append(self.mins[objects].min(axis=0) if len(objects) else np.zeros(3, dtype=np.float32))
+            nodeMax.append(self.maxs[objects].max(axis=0) if len(objects) else np.zeros(3, dtype=np.float32))
+            left.append(-1)
+            right.append(-1)
+            start.append(first)
+            size.append(last - first)
+            if parent >= 0:
+                (left if side == 0 else right)[parent] = node
+            if last - first <= self.leafSize:
+                self.leafOf[objects] = node
+                continue
+            # median split along the longest axis of the centres
+            axis = int(np.argmax(centres[objects].max(axis=0) - centres[objects].min(axis=0)))
+            middle = (last - first) // 2
+            split = np.argpartition(centres[objects, axis], middle)
+            self.order[first:last] = objects[split]
+            stack.append((first + middle, last, node, 1))
+            stack.append((first, first + middle, node, 0))
+
+        self.nodeMin = np.array(nodeMin, dtype=np.float32).reshape(-1, 3)
+        self.nodeMax = np.array(nodeMax, dtype=np.float32).reshape(-1, 3)
+        self.left = np.array(left, dtype=np.int64)
+        self.right = np.array(right, dtype=np.int64)
+        self.start = np.array(start, dtype=np.int64)
+        self.size = np.array(size, dtype=np.int64)
+        self.parent = np.full(len(left), -1, dtype=np.int64)
+        internal = np.flatnonzero(self.left >= 0)
+        self.parent[self.left[internal]] = internal
+        self.parent[self.right[internal]] = internal
+        self.leaves = np.flatnonzero(self.left < 0)
+        self.moved[:] = False
+        self.needsBuild = False
+        self.builtArea = self.leafArea()
+        self.stats["builds"] += 1
+
+    def leafArea(self):
+        extent = self.nodeMax[self.leaves] - self.nodeMin[self.leaves]
+        return float((extent[:, 0] * extent[:, 1] + extent[:, 1] * extent[:, 2] + extent[:, 2] * extent[:, 0]).sum())
+
+    def refit(self):
+        moved = np.flatnonzero(self.moved[:self.count])
+        self.stats["refitted"] = len(moved)
+        if len(moved) == 0:
+            return
+        self.moved[moved] = False
+        leaves = np.unique(self.leafOf[moved])
+        for leaf in leaves:
+            objects = self.order[self.start[leaf]:self.start[leaf] + self.size[leaf]]
+            self.nodeMin[leaf] = self.mins[objects].min(axis=0)
+            self.nodeMax[leaf] = self.maxs[objects].max(axis=0)
+        # walk up one level at a time, a node reached again from a deeper leaf is simply refitted again
+        nodes = leaves
+        while len(nodes):
+            parents = np.unique(self.parent[nodes])
+            parents = parents[parents >= 0]
+            self.nodeMin[parents] = np.minimum(self.nodeMin[self.left[parents]], self.nodeMin[self.right[parents]])
+            self.nodeMax[parents] = np.maximum(self.nodeMax[self.left[parents]], self.nodeMax[self.right[parents]])
+            nodes = parents
+        # objects that moved far apart leave large overlapping leaves behind, start over once culling suffers
+        if self.leafArea() > 2 * max(self.builtArea, 1e-6):
+            self.needsBuild = True
+
+    def update(self):
+        if not self.needsBuild:
+            self.refit()
+        if self.needsBuild:
+            self.build()
+
+    def cull(self, planes):
+        # handles of every object whose bounds touch the frustum, in ascending order
+        self.update()
+        if self.count == 0:
+            return np.zeros(0, dtype=np.int64)
+        frontier = np.zeros(1, dtype=np.int64)
+        accepted = []
+        tested = 0
+        while len(frontier):
+            tested += len(frontier)
+            result = classifyBoxes(planes, self.nodeMin[frontier], self.nodeMax[frontier])
+            inside = frontier[result == INSIDE]
+            accepted.append(self.order[expandRanges(self.start[inside], self.size[inside])])
+            partial = frontier[result == INTERSECTING]
+            leaves = partial[self.left[partial] < 0]
+            if len(leaves):
+                objects = self.order[expandRanges(self.start[leaves], self.size[leaves])]
+                tested += len(objects)
+                objectResult = classifyBoxes(planes, self.mins[objects], self.maxs[objects])
+                accepted.append(objects[objectResult != OUTSIDE])
+            internal = partial[self.left[partial] >= 0]
+            frontier = np.concatenate((self.left[internal], self.right[internal]))
+        visible = np.sort(np.concatenate(accepted))
+        visible = visible[self.alive[visible]]
+        self.stats["visible"] = len(visible)
+        self.stats["culled"] = self.count - len(visible)
+        self.stats["nodesTested"] = tested
+        return visible
+
+    def traverse(self, count, test):
+        # (query, handle) pairs of the live objects test accepts, test(queries, mins, maxs) is pairwise,
+        # every query starts at the root and descends into the nodes it accepts, all queries one level at a time
+        self.update()
+        found = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))]
+        queries = np.arange(count if self.count else 0)
+        nodes = np.zeros(len(queries), dtype=np.int64)
+        while len(queries):
+            accepted = test(queries, self.nodeMin[nodes], self.nodeMax[nodes])
+            queries, nodes = queries[accepted], nodes[accepted]
+            leaf = self.left[nodes] < 0
+            counts = self.size[nodes[leaf]]
+            objects = self.order[expandRanges(self.start[nodes[leaf]], counts)]
+            owners = np.repeat(queries[leaf], counts)
+            hit = self.alive[objects]
+            hit[hit] = test(owners[hit], self.mins[objects[hit]], self.maxs[objects[hit]])
+            found.append((owners[hit], objects[hit]))
+            queries = np.repeat(queries[~leaf], 2)
+            nodes = np.stack((self.left[nodes[~leaf]], self.right[nodes[~leaf]]), axis=1).reshape(-1)
+        queries = np.concatenate([pair[0] for pair in found])
+        handles = np.concatenate([pair[1] for pair in found])
+        order = np.lexsort((handles, queries))
+        return queries[order], handles[order]
+
+    def queryBoxes(self, mins, maxs):
+        # (query, handle) for every object overlapping each of the boxes, sorted by query
+        mins = np.asarray(mins, dtype=np.float32).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float32).reshape(-1, 3)
+        return self.traverse(len(mins), lambda q, lo, hi: boxesOverlap(mins[q], maxs[q], lo, hi))
+
+    def querySpheres(self, centres, radii):
+        centres = np.asarray(centres, dtype=np.float32).reshape(-1, 3)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float32), len(centres))
+        return self.traverse(len(centres), lambda q, lo, hi: spheresOverlap(centres[q], radii[q], lo, hi))
+
+    def raycast(self, origins, directions, maxDistance=np.inf):
+        # the nearest object along each ray as (handles, distances), -1 and inf for rays that hit nothing,
+        # nodes further away than the best hit so far are not descended into
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions, inverse = normalizeRays(directions)
+        best = np.full(len(origins), np.inf)
+        hits = np.full(len(origins), -1, dtype=np.int64)
+        limit = np.broadcast_to(np.asarray(maxDistance, dtype=np.float64), len(origins)).copy()
+        # a ray without a direction hits nothing
+        limit[(directions == 0).all(axis=1)] = -1
+
+        self.update()
+        rays = np.arange(len(origins) if self.count else 0)
+        nodes = np.zeros(len(rays), dtype=np.int64)
+        while len(rays):
+            entry, exit = rayBoxes(origins[rays], inverse[rays], self.nodeMin[nodes], self.nodeMax[nodes])
+            accepted = (entry <= exit) & (entry <= np.minimum(best[rays], limit[rays]))
+            rays, nodes = rays[accepted], nodes[accepted]
+            leaf = self.left[nodes] < 0
+            counts = self.size[nodes[leaf]]
+            objects = self.order[expandRanges(self.start[nodes[leaf]], counts)]
+            owners = np.repeat(rays[leaf], counts)
+            objects, owners = objects[self.alive[objects]], owners[self.alive[objects]]
+            entry, exit = rayBoxes(origins[owners], inverse[owners], self.mins[objects], self.maxs[objects])
+            hit = (entry <= exit) & (entry <= limit[owners])
+            nearest, nearestDistance = nearestPerQuery(owners[hit], objects[hit], entry[hit], len(origins))
+            closer = (nearestDistance < best) | ((nearestDistance == best) & (nearest >= 0) & (nearest < hits))
+            best[closer] = nearestDistance[closer]
+            hits[closer] = nearest[closer]
+            rays = np.repeat(rays[~leaf], 2)
+            nodes = np.stack((self.left[nodes[~leaf]], self.right[nodes[~leaf]]), axis=1).reshape(-1)
+        return hits, best
@@ -0,0 +1,175 @@
+import ctypes
+
+from OpenGL.GL import *
+import numpy as np
+
+from engine.gl_state import state
+from engine.resources import resources
+
+# (sampler name, internal format, pixel type) of the G-buffer's colour attachments, in attachment order,
+# position's w is 1 wherever geometry was drawn and 0 over the background
+GBUFFER_LAYOUT = (("gPosition", GL_RGBA32F, GL_FLOAT), ("gNormal", GL_RGBA16F, GL_FLOAT),
+                  ("gDiffuse", GL_RGBA8, GL_UNSIGNED_BYTE), ("gSpecular", GL_RGBA8, GL_UNSIGNED_BYTE))
+# the depth texture follows the colour attachments on the texture units
+DEPTH_UNIT = len(GBUFFER_LAYOUT)
+
+
+def lightVolume(subdivisions=1):
+    # an icosphere as (vertices, indices), pushed out so its flat faces enclose the unit sphere,
+    # scaled by a light's strength it covers every point the light reaches
+    t = (1 + 5 ** 0.5) / 2
+    vertices = [(-1, t, 0), (1, t, 0), (-1, -t, 0), (1, -t, 0), (0, -1, t), (0, 1, t), (0, -1, -t), (0, 1, -t),
+                (t, 0, -1), (t, 0, 1), (-t, 0, -1), (-t, 0, 1)]
+    faces = [(0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11), (1, 5, 9), (5, 11, 4), (11, 10, 2),
+             (10, 7, 6), (7, 1, 8), (3, 9, 4), (3, 4, 2), (3, 2, 6), (3, 6, 8), (3, 8, 9), (4, 9, 5), (2, 4, 11),
+             (6, 2, 10), (8, 6, 7), (9, 8, 1)]
+    vertices = [np.array(v, dtype=np.float64) / np.linalg.norm(v) for v in vertices]
+    for _ in range(subdivisions):
+        midpoints = {}
+        split = []
+        for face in faces:
+            middle = []
+            for a, b in ((face[0], face[1]), (face[1], face[2]), (face[2], face[0])):
+                key = (min(a, b), max(a, b))
+                if key not in midpoints:
+                    point = vertices[a] + vertices[b]
+                    midpoints[key] = len(vertices)
+                    vertices.append(point / np.linalg.norm(point))
+                middle.append(midpoints[key])
+            ab, bc, ca = middle
+            split += [(face[0], ab, ca), (face[1], bc, ab), (face[2], ca, bc), (ab, bc, ca)]
+        faces = split
+    vertices = np.array(vertices)
+    indices = np.array(faces, dtype=np.uint32)
+    # the faces cut inside the unit sphere, the nearest one decides how far everything moves out
+    corners = vertices[indices]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    distances = np.abs(np.einsum("ij,ij->i", normals, corners[:, 0])) / np.linalg.norm(normals, axis=1)
+    return (vertices / distances.min()).astype(np.float32), indices
+
+
+class GBuffer:
+    # world position, normal, diffuse and specular colour targets with a depth texture, all sampled with texelFetch
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.fbo = resources.genFramebuffers(1, "G-buffer")
+        self.textures = resources.genTextures(len(GBUFFER_LAYOUT) + 1, "G-buffer")
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        formats = [(internalFormat, GL_RGBA, kind) for _, internalFormat, kind in GBUFFER_LAYOUT]
+        formats.append((GL_DEPTH_COMPONENT32F, GL_DEPTH_COMPONENT, GL_FLOAT))
+        for texture, (internalFormat, format, kind) in zip(self.textures, formats):
+            state.bindTexture(0, GL_TEXTURE_2D, texture)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            resources.texImage2D(texture, 0, internalFormat, width, height, format, kind, None)
+        attachments = [GL_COLOR_ATTACHMENT0 + i for i in range(len(GBUFFER_LAYOUT))]
+        for attachment, texture in zip(attachments + [GL_DEPTH_ATTACHMENT], self.textures):
+            glFramebufferTexture2D(GL_FRAMEBUFFER, attachment, GL_TEXTURE_2D, texture, 0)
+        glDrawBuffers(len(attachments), np.array(attachments, dtype=np.uint32))
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("G-buffer framebuffer is incomplete")
+        self.clearColour = np.zeros(4, dtype=np.float32)
+        self.clearDepth = np.ones(1, dtype=np.float32)
+
+    def bind(self):
+        # binds and clears for the geometry pass, without touching the clear colour the forward path uses
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        for i in range(len(GBUFFER_LAYOUT)):
+            glClearBufferfv(GL_COLOR, i, self.clearColour)
+        glClearBufferfv(GL_DEPTH, 0, self.clearDepth)
+
+    def textureSet(self):
+        return tuple((unit, GL_TEXTURE_2D, texture) for unit, texture in enumerate(self.textures))
+
+    def destroy(self):
+        for texture in self.textures:
+            state.forgetTexture(texture)
+        resources.deleteTextures(self.textures)
+        resources.deleteFramebuffers(self.fbo)
+
+
+class DeferredRenderer:
+    # geometryProgram draws the lit batches into the G-buffer, the scene's vertex shader with a fragment shader
+    # that writes the material instead of lighting it, then resolve() shades target from the G-buffer:
+    # a fullscreen pass adds the ambient term and copies the scene depth, then every light draws the back faces
+    # of its volume with the depth test reversed, so a pixel is only shaded by lights whose sphere contains it
+    # and each light costs the pixels it covers instead of overdraw x lights
+    def __init__(self, width, height, geometryProgram, ambientProgram, lightProgram, lights, target=0):
+        self.width = width
+        self.height = height
+        self.geometryProgram = geometryProgram
+        self.ambientProgram = ambientProgram
+        self.lightProgram = lightProgram
+        self.lights = lights
+        self.target = target
+        self.gbuffer = GBuffer(width, height)
+        for program in (ambientProgram, lightProgram):
+            for unit, (name, _, _) in enumerate(GBUFFER_LAYOUT):
+                program.setInt(name, unit)
+        ambientProgram.setInt("gDepth", DEPTH_UNIT)
+
+        vertices, indices = lightVolume()
+        self.indexCount = indices.size
+        self.vao, self.screenVao = resources.genVertexArrays(2, "light volumes")
+        self.vbo, self.ebo = resources.genBuffers(2, "light volumes")
+        state.bindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        resources.bufferData(GL_ARRAY_BUFFER, self.vbo, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        resources.bufferData(GL_ELEMENT_ARRAY_BUFFER, self.ebo, indices.nbytes, indices, GL_STATIC_DRAW)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, 12, ctypes.c_void_p(0))
+        state.bindVertexArray(0)
+        self.stats = {"lights": 0}
+
+    def begin(self):
+        # the lit batches are drawn with geometryProgram between begin() and resolve()
+        self.gbuffer.bind()
+
+    def resolve(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.target)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        for unit, target, texture in self.gbuffer.textureSet():
+            state.bindTexture(unit, target, texture)
+
+        # ambient and depth, the background keeps the clear colour
+        glDepthFunc(GL_ALWAYS)
+        self.ambientProgram.use()
+        state.bindVertexArray(self.screenVao)
+        glDrawArrays(GL_TRIANGLES, 0, 3)
+        state.countDraw()
+
+        # back faces behind the scene's depth: the surface is in front of the far side of the sphere, the near
+        # side is not tested so this holds with the camera inside a volume, depth clamp keeps far sides that
+        # would be clipped away
+        glDepthFunc(GL_GEQUAL)
+        glDepthMask(GL_FALSE)
+        glEnable(GL_DEPTH_CLAMP)
+        glEnable(GL_CULL_FACE)
+        glCullFace(GL_FRONT)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_ONE, GL_ONE)
+        self.lightProgram.use()
+        state.bindVertexArray(self.vao)
+        # disabled lights collapse to a point in the vertex shader
+        glDrawElementsInstanced(GL_TRIANGLES, self.indexCount, GL_UNSIGNED_INT, ctypes.c_void_p(0), self.lights.count)
+        state.countDraw()
+        self.stats["lights"] = self.lights.count
+
+        # back to the state the forward draws expect
+        glDisable(GL_BLEND)
+        glCullFace(GL_BACK)
+        glDisable(GL_CULL_FACE)
+        glDisable(GL_DEPTH_CLAMP)
+        glDepthMask(GL_TRUE)
+        glDepthFunc(GL_LESS)
+
+    def destroy(self):
+        self.gbuffer.destroy()
+        state.forgetVertexArray(self.vao)
+        state.forgetVertexArray(self.screenVao)
+        resources.deleteVertexArrays((self.vao, self.screenVao))
+        resources.deleteBuffers((self.vbo, self.ebo))
+        for program in (self.geometryProgram, self.ambientProgram, self.lightProgram):
+            program.destroy()
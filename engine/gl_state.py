@@ -0,0 +1,79 @@
+from OpenGL.GL import *
+
+
+class GLState:
+    def __init__(self):
+        self.stats = {"issued": 0, "skipped": 0, "draws": 0}
+        self.lastFrame = dict(self.stats)
+        self.reset()
+
+    def reset(self):
+        # forget everything, e.g. after a new context was created or foreign code touched the bindings
+        self.program = None
+        self.vao = None
+        self.unit = None
+        self.textures = {}
+
+    def issue(self):
+        self.stats["issued"] += 1
+
+    def skip(self):
+        self.stats["skipped"] += 1
+
+    def countDraw(self, calls=1):
+        self.stats["draws"] += calls
+
+    def useProgram(self, program):
+        if self.program == program:
+            self.skip()
+            return
+        glUseProgram(program)
+        self.program = program
+        self.issue()
+
+    def bindVertexArray(self, vao):
+        if self.vao == vao:
+            self.skip()
+            return
+        glBindVertexArray(vao)
+        self.vao = vao
+        self.issue()
+
+    def activeTexture(self, unit):
+        if self.unit == unit:
+            self.skip()
+            return
+        glActiveTexture(GL_TEXTURE0 + unit)
+        self.unit = unit
+        self.issue()
+
+    def bindTexture(self, unit, target, texture):
+        if self.textures.get(unit) == (target, texture):
+            self.skip()
+            return
+        self.activeTexture(unit)
+        glBindTexture(target, texture)
+        self.textures[unit] = (target, texture)
+        self.issue()
+
+    def forgetProgram(self, program):
+        if self.program == program:
+            self.program = None
+
+    def forgetVertexArray(self, vao):
+        if self.vao == vao:
+            self.vao = None
+
+    def forgetTexture(self, texture):
+        for unit, (target, bound) in list(self.textures.items()):
+            if bound == texture:
+                del self.textures[unit]
+
+    def beginFrame(self):
+        self.lastFrame = dict(self.stats)
+        for key in self.stats:
+            self.stats[key] = 0
+
+
+# the GL context is process wide, so is the cache of what is bound in it
+state = GLState()
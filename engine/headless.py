@@ -0,0 +1,14 @@
+import os
+
+# PYOPENGL_PLATFORM has to be egl or osmesa before OpenGL is imported anywhere, so this module must not import it
+PLATFORMS = ("egl", "osmesa")
+
+
+def configure(platform="egl"):
+    if platform not in PLATFORMS:
+        raise ValueError(f"unknown headless platform {platform!r}, expected one of {PLATFORMS}")
+    os.environ["PYOPENGL_PLATFORM"] = platform
+    # no X server on render servers, Mesa's surfaceless EGL platform still offers pbuffers
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+    # pygame is still used for timing and image loading, it must not try to open a window
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
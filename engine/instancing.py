@@ -0,0 +1,192 @@
+from OpenGL.GL import *
+import numpy as np
+
+from engine.arena import INSTANCE_BINDING
+from engine.gl_state import state
+from engine.resources import resources
+
+
+class InstanceBatch:
+    # instances of meshes from one geometry arena, per-instance data lives in one (capacity, width) float32 array,
+    # the whole batch is one glMultiDrawElementsIndirect with a command per mesh
+    def __init__(self, shader, arena, mesh, instanceWidth, instanceAttributes, capacity):
+        self.shader = shader
+        self.arena = arena
+        # instances added without a mesh of their own use this one
+        self.mesh = mesh
+        self.instances = np.zeros((capacity, instanceWidth), dtype=np.float32)
+        self.meshOf = np.zeros(capacity, dtype=np.int64)
+        self.mixed = False
+        self.count = 0
+        self.dirty = np.zeros(capacity, dtype=bool)
+        # with culling only these instances are drawn
+        self.visible = None
+        # which row each buffer slot holds and which slot holds each row's current data, -1 for none, a slot is
+        # only reused when both still agree and the row is not dirty
+        self.slots = np.full(capacity, -1, dtype=np.int64)
+        self.slotOf = np.full(capacity, -1, dtype=np.int64)
+        # set by track(), the indirect commands last handed to the command list
+        self.commandList = None
+        self.commandIndex = None
+        self.recorded = None
+
+        self.vao = resources.genVertexArrays(1, type(self).__name__)
+        arena.attach(self.vao)
+        self.instanceVbo = resources.genBuffers(1, f"{type(self).__name__} instances")
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceVbo)
+        resources.bufferData(GL_ARRAY_BUFFER, self.instanceVbo, self.instances.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindVertexBuffer(INSTANCE_BINDING, self.instanceVbo, 0, self.instances.strides[0])
+        glVertexBindingDivisor(INSTANCE_BINDING, 1)
+        for location, size, offset in instanceAttributes:
+            glEnableVertexAttribArray(location)
+            glVertexAttribFormat(location, size, GL_FLOAT, GL_FALSE, offset)
+            glVertexAttribBinding(location, INSTANCE_BINDING)
+
+    def add(self, row, mesh=None):
+        if self.count == len(self.instances):
+            raise IndexError(f"instance batch is full ({len(self.instances)} instances)")
+        index = self.count
+        self.count += 1
+        self.meshOf[index] = self.mesh if mesh is None else mesh
+        if self.meshOf[index] != self.meshOf[0]:
+            self.mixed = True
+        self.set(index, row)
+        return index
+
+    def set(self, index, row):
+        self.instances[index] = row
+        self.dirty[index] = True
+
+    def setMeshes(self, indices, meshes):
+        # e.g. a level of detail per instance, instances of one mesh still go out as one command
+        self.meshOf[indices] = meshes
+        self.mixed = bool((self.meshOf[:self.count] != self.meshOf[0]).any())
+
+    def markDirty(self, indices):
+        self.dirty[indices] = True
+
+    def setVisible(self, indices):
+        self.visible = indices
+
+    def drawOrder(self):
+        # None while the buffer can mirror self.instances row for row, otherwise the rows to pack
+        if self.visible is None and not self.mixed:
+            return None
+        rows = np.arange(self.count) if self.visible is None else self.visible
+        if self.mixed:
+            rows = rows[np.argsort(self.meshOf[rows], kind="stable")]
+        return rows
+
+    def upload(self, order):
+        # slot i of the buffer gets row order[i], or row i when the buffer mirrors self.instances
+        rows = np.arange(self.count) if order is None else np.asarray(order)
+        slots = np.arange(len(rows))
+        current = (self.slots[slots] == rows) & (self.slotOf[rows] == slots) & ~self.dirty[rows]
+        changed = np.flatnonzero(~current)
+        if len(changed) == 0:
+            return
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceVbo)
+        rowBytes = self.instances.strides[0]
+        # one glBufferSubData per contiguous run of changed slots
+        breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+        for run in np.split(changed, breaks):
+            start, stop = run[0], run[-1] + 1
+            glBufferSubData(GL_ARRAY_BUFFER, int(start) * rowBytes, int(stop - start) * rowBytes,
+                            np.ascontiguousarray(self.instances[rows[start:stop]]))
+        self.slots[changed] = rows[changed]
+        self.slotOf[rows[changed]] = changed
+        self.dirty[rows] = False
+
+    def commands(self, order):
+        if order is None:
+            return self.arena.commands(self.meshOf[:1], self.count, 0)
+        # instances of a mesh are consecutive in the packed buffer, baseInstance points at the first of them
+        meshes, first, counts = np.unique(self.meshOf[order], return_index=True, return_counts=True)
+        return self.arena.commands(meshes, counts, first)
+
+    def textureSet(self):
+        return ()
+
+    def bind(self):
+        self.shader.use()
+        state.bindVertexArray(self.vao)
+
+    def track(self, commandList):
+        self.commandList = commandList
+        self.commandIndex = commandList.register(self)
+
+    def prepare(self):
+        # uploads the instance data for this frame, the command list only re-records us when the commands changed
+        order = self.drawOrder()
+        if self.count == 0 or (order is not None and len(order) == 0):
+            commands = self.arena.commands([])
+        else:
+            self.upload(order)
+            commands = self.commands(order)
+        if self.recorded is None or not np.array_equal(self.recorded, commands):
+            self.recorded = commands
+            self.commandList.invalidate(self.commandIndex)
+
+    def record(self, commandList):
+        commandList.draw(self.shader, self.vao, self.textureSet(), GL_TRIANGLES, self.recorded)
+
+    def draw(self):
+        order = self.drawOrder()
+        if self.count == 0 or (order is not None and len(order) == 0):
+            return
+        self.upload(order)
+        self.bind()
+        self.arena.submit(GL_TRIANGLES, self.commands(order))
+
+    def destroy(self):
+        self.arena.detach(self.vao)
+        state.forgetVertexArray(self.vao)
+        resources.deleteVertexArrays(self.vao)
+        resources.deleteBuffers(self.instanceVbo)
+
+
+class CubeBatch(InstanceBatch):
+    # pos_uv_normal meshes, one model matrix per instance at locations 3-6 and its index into the
+    # MaterialLibrary at location 7, every instance samples the library's one texture array
+    def __init__(self, shader, materials, arena, mesh, capacity):
+        super().__init__(shader, arena, mesh, 17, ((3, 4, 0), (4, 4, 16), (5, 4, 32), (6, 4, 48), (7, 1, 64)),
+                         capacity)
+        self.materials = materials
+
+    def add(self, model, material=0, mesh=None):
+        return super().add(np.append(model, np.float32(material)), mesh)
+
+    def setModel(self, index, model):
+        self.instances[index, :16] = model
+        self.dirty[index] = True
+
+    def setMaterial(self, index, material):
+        self.instances[index, 16] = material
+        self.dirty[index] = True
+
+    def models(self):
+        return self.instances[:self.count, :16].reshape(-1, 4, 4)
+
+    def textureSet(self):
+        return self.materials.textureSet()
+
+    def bind(self):
+        super().bind()
+        self.materials.use()
+
+
+class CubeBasicBatch(InstanceBatch):
+    # pos_colour meshes, one position and colour per instance at locations 2 and 3
+    def __init__(self, shader, arena, mesh, capacity):
+        super().__init__(shader, arena, mesh, 6, ((2, 3, 0), (3, 3, 12)), capacity)
+
+    def add(self, position, colour, mesh=None):
+        return super().add(np.concatenate((position, colour)), mesh)
+
+    def setPosition(self, index, position):
+        self.instances[index, 0:3] = position
+        self.dirty[index] = True
+
+    def setColour(self, index, colour):
+        self.instances[index, 3:6] = colour
+        self.dirty[index] = True
@@ -0,0 +1,193 @@
+from OpenGL.GL import *
+import numpy as np
+
+from engine.resources import resources
+
+# std430 layout of struct Light { vec3 pos; float strength; vec3 color; float enabled; }
+LIGHT_DTYPE = np.dtype([("position", np.float32, 3), ("strength", np.float32),
+                        ("colour", np.float32, 3), ("enabled", np.float32)])
+
+LIGHT_BINDING = 1
+CLUSTER_BINDING = 2
+LIGHT_INDEX_BINDING = 3
+
+
+def sliceOf(depth, near, far, slices):
+    # exponential depth slices, slice k spans near * (far / near) ** (k / slices) onwards
+    depth = np.maximum(depth, near)
+    return np.floor(np.log(depth / near) / np.log(far / near) * slices).astype(np.int64)
+
+
+def clusterBounds(projection, tiles, slices, near, far):
+    # (mins, maxs) of the view space box around every cluster's piece of the frustum, in cluster order
+    tilesX, tilesY = tiles
+    z, y, x = np.meshgrid(np.arange(slices), np.arange(tilesY), np.arange(tilesX), indexing="ij")
+    x, y, z = x.ravel(), y.ravel(), z.ravel()
+    corners = []
+    for depth in (near * (far / near) ** (z / slices), near * (far / near) ** ((z + 1) / slices)):
+        for ndcX in (-1 + 2 * x / tilesX, -1 + 2 * (x + 1) / tilesX):
+            for ndcY in (-1 + 2 * y / tilesY, -1 + 2 * (y + 1) / tilesY):
+                corners.append(np.stack((ndcX * depth / projection[0, 0], ndcY * depth / projection[1, 1], -depth),
+                                        axis=1))
+    corners = np.stack(corners)
+    return corners.min(axis=0), corners.max(axis=0)
+
+
+def assignLights(positions, radii, view, projection, tiles, slices, near, far, maxPerCluster=None, bounds=None):
+    # returns (clusters, indices): clusters is (tilesX * tilesY * slices, 2) uint32 of (offset, count)
+    # into indices, the flat list of light indices sorted by cluster
+    # a cluster keeps at most maxPerCluster lights, the lowest indices, which the shader would read anyway
+    # bounds is clusterBounds() for the same projection and grid, computed here when not given
+    tilesX, tilesY = tiles
+    clusterCount = tilesX * tilesY * slices
+    positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+    radii = np.asarray(radii, dtype=np.float32).reshape(-1)
+
+    # matrices are pyrr style, points are row vectors and the camera looks down -z
+    centres = positions @ view[:3, :3] + view[3, :3]
+    depth = -centres[:, 2]
+    visible = (depth + radii > near) & (depth - radii < far)
+    lightIds = np.flatnonzero(visible)
+    centres, depth, radii = centres[lightIds], depth[lightIds], radii[lightIds]
+
+    z0 = np.clip(sliceOf(depth - radii, near, far, slices), 0, slices - 1)
+    z1 = np.clip(sliceOf(depth + radii, near, far, slices), 0, slices - 1)
+
+    # screen rectangle of the sphere's view space bounding box, lights reaching the near plane cover everything
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+    boxes = centres[:, None, :] + corners[None, :, :] * radii[:, None, None]
+    clip = boxes @ projection[:3, :] + projection[3, :]
+    w = np.maximum(clip[..., 3], 1e-6)
+    ndcX = clip[..., 0] / w
+    ndcY = clip[..., 1] / w
+    crossesNear = depth - radii <= near
+    x0 = np.where(crossesNear, 0, np.floor((ndcX.min(axis=1) + 1) / 2 * tilesX))
+    x1 = np.where(crossesNear, tilesX - 1, np.floor((ndcX.max(axis=1) + 1) / 2 * tilesX))
+    y0 = np.where(crossesNear, 0, np.floor((ndcY.min(axis=1) + 1) / 2 * tilesY))
+    y1 = np.where(crossesNear, tilesY - 1, np.floor((ndcY.max(axis=1) + 1) / 2 * tilesY))
+    x0, x1 = np.clip(x0, 0, tilesX - 1).astype(np.int64), np.clip(x1, 0, tilesX - 1).astype(np.int64)
+    y0, y1 = np.clip(y0, 0, tilesY - 1).astype(np.int64), np.clip(y1, 0, tilesY - 1).astype(np.int64)
+    onScreen = (ndcX.max(axis=1) >= -1) & (ndcX.min(axis=1) <= 1) & (ndcY.max(axis=1) >= -1) & (ndcY.min(axis=1) <= 1)
+    onScreen |= crossesNear
+
+    spanX = np.where(onScreen, x1 - x0 + 1, 0)
+    spanY = y1 - y0 + 1
+    spanZ = z1 - z0 + 1
+    perLight = spanX * spanY * spanZ
+
+    # expand every light into the clusters of its box without a python loop
+    total = int(perLight.sum())
+    owner = np.repeat(np.arange(len(lightIds)), perLight)
+    local = np.arange(total) - np.repeat(np.cumsum(perLight) - perLight, perLight)
+    cx = x0[owner] + local % spanX[owner]
+    rest = local // spanX[owner]
+    cy = y0[owner] + rest % spanY[owner]
+    cz = z0[owner] + rest // spanY[owner]
+    cluster = (cz * tilesY + cy) * tilesX + cx
+
+    # the screen rectangle of the light's box overestimates, keep the clusters whose box the sphere reaches
+    mins, maxs = clusterBounds(projection, tiles, slices, near, far) if bounds is None else bounds
+    gap = np.maximum(np.maximum(mins[cluster] - centres[owner], centres[owner] - maxs[cluster]), 0)
+    keep = (gap * gap).sum(axis=1) <= radii[owner] * radii[owner]
+    cluster, owner = cluster[keep], owner[keep]
+    total = len(cluster)
+
+    order = np.argsort(cluster, kind="stable")
+    counts = np.bincount(cluster, minlength=clusterCount)
+    if maxPerCluster is not None:
+        rank = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        order = order[rank < maxPerCluster]
+        counts = np.minimum(counts, maxPerCluster)
+    indices = lightIds[owner[order]].astype(np.uint32)
+    clusters = np.empty((clusterCount, 2), dtype=np.uint32)
+    clusters[:, 1] = counts
+    clusters[:, 0] = np.cumsum(counts) - counts
+    return clusters, indices
+
+
+class LightSet:
+    def __init__(self, capacity, tiles=(16, 10), slices=24, near=0.1, far=10, maxPerCluster=None):
+        self.lights = np.zeros(capacity, dtype=LIGHT_DTYPE)
+        self.maxPerCluster = maxPerCluster
+        self.count = 0
+        self.tiles = tiles
+        self.slices = slices
+        self.near = near
+        self.far = far
+        self.dirty = True
+        self.clusters = np.zeros((tiles[0] * tiles[1] * slices, 2), dtype=np.uint32)
+        self.indices = np.zeros(0, dtype=np.uint32)
+        self.indexCapacity = 0
+        # clusterBounds() only changes with the projection, kept with the projection it was computed for
+        self.boundsProjection = None
+        self.bounds = None
+
+        self.lightBuffer, self.clusterBuffer, self.indexBuffer = resources.genBuffers(3, "lights")
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.lightBuffer)
+        resources.bufferData(GL_SHADER_STORAGE_BUFFER, self.lightBuffer, self.lights.nbytes,
+                             self.lights.view(np.float32), GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.clusterBuffer)
+        resources.bufferData(GL_SHADER_STORAGE_BUFFER, self.clusterBuffer, self.clusters.nbytes, self.clusters,
+                             GL_DYNAMIC_DRAW)
+        self.growIndices(1024)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, LIGHT_BINDING, self.lightBuffer)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, CLUSTER_BINDING, self.clusterBuffer)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, LIGHT_INDEX_BINDING, self.indexBuffer)
+
+    def add(self, position, colour, strength):
+        if self.count == len(self.lights):
+            raise IndexError(f"light set is full ({len(self.lights)} lights)")
+        index = self.count
+        self.count += 1
+        self.set(index, position, colour, strength)
+        return index
+
+    def set(self, index, position, colour, strength, enabled=True):
+        self.lights["position"][index] = position
+        self.lights["colour"][index] = colour
+        self.lights["strength"][index] = strength
+        self.lights["enabled"][index] = 1 if enabled else 0
+        self.dirty = True
+
+    def setPosition(self, index, position):
+        self.lights["position"][index] = position
+        self.dirty = True
+
+    def clear(self):
+        self.lights["enabled"] = 0
+        self.count = 0
+        self.dirty = True
+
+    def growIndices(self, needed):
+        self.indexCapacity = max(needed, 2 * self.indexCapacity)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.indexBuffer)
+        resources.bufferData(GL_SHADER_STORAGE_BUFFER, self.indexBuffer, self.indexCapacity * 4, None, GL_DYNAMIC_DRAW)
+
+    def update(self, view, projection, clusters=True):
+        # clusters=False only uploads the lights, for renderers that find a pixel's lights some other way
+        lights = self.lights[:self.count]
+        if self.dirty:
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.lightBuffer)
+            glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, lights.nbytes, lights.view(np.float32))
+            self.dirty = False
+        if not clusters:
+            return
+        if self.boundsProjection is None or not np.array_equal(self.boundsProjection, projection):
+            self.boundsProjection = np.array(projection, copy=True)
+            self.bounds = clusterBounds(projection, self.tiles, self.slices, self.near, self.far)
+        enabled = np.flatnonzero(lights["enabled"] != 0)
+        self.clusters, indices = assignLights(lights["position"][enabled], lights["strength"][enabled],
+                                              view, projection, self.tiles, self.slices, self.near, self.far,
+                                              self.maxPerCluster, self.bounds)
+        self.indices = enabled[indices].astype(np.uint32)
+
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.clusterBuffer)
+        glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, self.clusters.nbytes, self.clusters)
+        if len(self.indices) > self.indexCapacity:
+            self.growIndices(len(self.indices))
+        if len(self.indices):
+            glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.indexBuffer)
+            glBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, self.indices.nbytes, self.indices)
+
+    def destroy(self):
+        resources.deleteBuffers((self.lightBuffer, self.clusterBuffer, self.indexBuffer))
@@ -0,0 +1,250 @@
+import heapq
+
+import numpy as np
+
+from engine.meshes import Mesh
+
+# triangle counts of the levels after the first, as fractions of the full mesh
+LOD_RATIOS = (0.5, 0.25, 0.125)
+# how much more a boundary edge resists moving than a face does, open meshes keep their outline
+BOUNDARY_WEIGHT = 10.0
+
+
+def weld(positions):
+    # one group per distinct position, vertices split only by uv, normal or colour move together
+    _, group = np.unique(positions, axis=0, return_inverse=True)
+    return group.reshape(-1)
+
+
+def planes(points, triangles):
+    # (len(triangles), 4) unit plane equations, zero for degenerate triangles
+    a, b, c = (points[triangles[:, k]] for k in range(3))
+    normals = np.cross(b - a, c - a)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    return np.concatenate((normals, -np.einsum("ij,ij->i", normals, a)[:, None]), axis=1)
+
+
+def quadrics(points, triangles):
+    # Garland and Heckbert error quadrics, per point the sum of the squared distance to the planes of its
+    # triangles, plus planes through every boundary edge at right angles to its triangle
+    result = np.zeros((len(points), 4, 4))
+    faces = planes(points, triangles)
+    outer = faces[:, :, None] * faces[:, None, :]
+    for k in range(3):
+        np.add.at(result, triangles[:, k], outer)
+
+    edges = np.concatenate([triangles[:, [k, (k + 1) % 3]] for k in range(3)])
+    owners = np.tile(np.arange(len(triangles)), 3)
+    _, inverse, counts = np.unique(np.sort(edges, axis=1), axis=0, return_inverse=True, return_counts=True)
+    boundary = counts[inverse.reshape(-1)] == 1
+    edges, owners = edges[boundary], owners[boundary]
+    start, end = points[edges[:, 0]], points[edges[:, 1]]
+    normals = np.cross(end - start, faces[owners, :3])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+    sides = np.concatenate((normals, -np.einsum("ij,ij->i", normals, start)[:, None]), axis=1)
+    outer = BOUNDARY_WEIGHT * sides[:, :, None] * sides[:, None, :]
+    for k in range(2):
+        np.add.at(result, edges[:, k], outer)
+    return result
+
+
+def collapseCost(quadric, point):
+    homogeneous = np.append(point, 1.0)
+    return max(float(homogeneous @ quadric @ homogeneous), 0.0)
+
+
+class Simplifier:
+    # greedy half-edge collapses of the cheapest edge first, a point always moves onto one of its neighbours,
+    # so every level reuses the mesh's own vertices and only needs new indices
+    # collapses that would flip a triangle or make the surface non-manifold are skipped
+    def __init__(self, positions, indices):
+        positions = np.asarray(positions, dtype=np.float64)
+        self.group = weld(positions)
+        self.points = np.zeros((self.group.max(initial=-1) + 1, 3))
+        self.points[self.group] = positions
+        self.corners = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+        self.triangles = triangles = self.group[self.corners]
+        self.triangleAlive = (triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) & \
+                             (triangles[:, 0] != triangles[:, 2])
+        self.live = int(self.triangleAlive.sum())
+        self.quadrics = quadrics(self.points, self.triangles[self.triangleAlive])
+        self.parent = np.arange(len(self.points))
+        self.version = np.zeros(len(self.points), dtype=np.int64)
+        self.around = [set() for _ in self.points]
+        for triangle in np.flatnonzero(self.triangleAlive):
+            for point in self.triangles[triangle]:
+                self.around[point].add(int(triangle))
+        self.error = 0.0
+        self.heap = []
+        edges = np.concatenate([self.triangles[self.triangleAlive][:, [k, (k + 1) % 3]] for k in range(3)])
+        for u, v in np.unique(np.sort(edges, axis=1), axis=0).tolist():
+            self.push(u, v)
+            self.push(v, u)
+
+    def push(self, u, v):
+        cost = collapseCost(self.quadrics[u] + self.quadrics[v], self.points[v])
+        heapq.heappush(self.heap, (cost, u, v, self.version[u], self.version[v]))
+
+    def neighbours(self, point):
+        return {int(p) for triangle in self.around[point] for p in self.triangles[triangle]} - {point}
+
+    def valid(self, u, v, shared):
+        # the link condition: u and v may only share the neighbours of the triangles on their edge
+        opposite = {int(p) for triangle in shared for p in self.triangles[triangle]} - {u, v}
+        if self.neighbours(u) & self.neighbours(v) != opposite:
+            return False
+        # nor fold what is left onto itself, as the last collapses of a closed mesh would
+        existing = {frozenset(self.triangles[triangle].tolist()) for triangle in self.around[v] - shared}
+        for triangle in self.around[u] - shared:
+            if frozenset(v if p == u else p for p in self.triangles[triangle].tolist()) in existing:
+                return False
+            corners = self.points[self.triangles[triangle]]
+            moved = corners.copy()
+            moved[self.triangles[triangle] == u] = self.points[v]
+            before = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+            after = np.cross(moved[1] - moved[0], moved[2] - moved[0])
+            if before @ after <= 0:
+                return False
+        return True
+
+    def collapse(self, u, v, shared):
+        for triangle in shared:
+            self.triangleAlive[triangle] = False
+            for point in self.triangles[triangle]:
+                self.around[point].discard(triangle)
+            self.live -= 1
+        for triangle in self.around[u]:
+            self.triangles[triangle][self.triangles[triangle] == u] = v
+            self.around[v].add(triangle)
+        self.around[u] = set()
+        self.parent[u] = v
+        self.quadrics[v] += self.quadrics[u]
+        self.version[u] += 1
+        self.version[v] += 1
+        for neighbour in self.neighbours(v):
+            self.push(neighbour, v)
+            self.push(v, neighbour)
+
+    def reduce(self, target, maxError=None):
+        # collapses until at most target triangles are left, the cheapest remaining collapse costs more than
+        # maxError (a distance) or nothing more can go, returns whether target was reached
+        while self.live > target and self.heap:
+            cost, u, v, versionU, versionV = heapq.heappop(self.heap)
+            if versionU != self.version[u] or versionV != self.version[v] or self.parent[u] != u:
+                continue
+            if maxError is not None and cost > maxError * maxError:
+                heapq.heappush(self.heap, (cost, u, v, versionU, versionV))
+                return False
+            shared = self.around[u] & self.around[v]
+            if not shared or not self.valid(u, v, shared):
+                continue
+            self.collapse(u, v, shared)
+            self.error = max(self.error, cost ** 0.5)
+        return self.live <= target
+
+    def resolve(self, group):
+        while self.parent[group] != group:
+            group = self.parent[group]
+        return group
+
+    def indices(self, vertices):
+        # the live triangles in vertex indices, a corner whose point moved takes the vertex at its new point
+        # whose uv, normal or colour is closest to the one it had
+        attributes = np.asarray(vertices, dtype=np.float64)[:, 3:]
+        members = {}
+        for vertex, group in enumerate(self.group.tolist()):
+            members.setdefault(group, []).append(vertex)
+        chosen = {}
+
+        def vertexAt(vertex, group):
+            if self.group[vertex] == group:
+                return vertex
+            key = (vertex, group)
+            if key not in chosen:
+                candidates = members[group]
+                distances = ((attributes[candidates] - attributes[vertex]) ** 2).sum(axis=1)
+                chosen[key] = candidates[int(np.argmin(distances))]
+            return chosen[key]
+
+        alive = np.flatnonzero(self.triangleAlive)
+        result = np.empty((len(alive), 3), dtype=np.int64)
+        for row, triangle in enumerate(alive.tolist()):
+            for k in range(3):
+                result[row, k] = vertexAt(int(self.corners[triangle, k]), int(self.triangles[triangle, k]))
+        return result, vertexAt
+
+
+def subset(mesh, indices, lines):
+    # a mesh of only the vertices indices and lines use, renumbered in order of first use
+    used, first = np.unique(np.concatenate((indices.ravel(), lines.ravel())), return_index=True)
+    used = used[np.argsort(first)]
+    remap = np.zeros(len(mesh.vertices), dtype=np.uint32)
+    remap[used] = np.arange(len(used), dtype=np.uint32)
+    vertices = np.array(mesh.vertices)[used]
+    return Mesh(vertices, remap[indices.ravel()], remap[lines.ravel()], mesh.layout)
+
+
+def buildLodChain(mesh, ratios=LOD_RATIOS, maxError=None):
+    # returns (meshes, report): the full mesh followed by one simplified mesh per ratio of its triangles,
+    # the chain ends early when a level cannot be reached within maxError or would not drop any triangles
+    # pure numpy on the float layouts, no GL involved
+    vertices = np.asarray(mesh.vertices, dtype=np.float32)
+    indices = np.asarray(mesh.indices, dtype=np.int64).reshape(-1, 3)
+    lines = np.asarray(mesh.lines, dtype=np.int64).reshape(-1, 2)
+    simplifier = Simplifier(vertices[:, 0:3], indices)
+    meshes = [mesh]
+    report = {"layout": mesh.layout, "levels": [{"triangles": len(indices), "vertices": len(vertices), "error": 0.0}]}
+    for ratio in ratios:
+        reached = simplifier.reduce(int(len(indices) * ratio), maxError)
+        if simplifier.live >= report["levels"][-1]["triangles"]:
+            break
+        levelIndices, vertexAt = simplifier.indices(vertices)
+        # outline lines follow their ends, lines that shrank to a point go
+        levelLines = np.array([[vertexAt(int(v), int(simplifier.resolve(simplifier.group[v]))) for v in line]
+                               for line in lines.tolist()], dtype=np.int64).reshape(-1, 2)
+        levelLines = np.unique(np.sort(levelLines[levelLines[:, 0] != levelLines[:, 1]], axis=1), axis=0)
+        level = subset(mesh, levelIndices, levelLines)
+        meshes.append(level)
+        report["levels"].append({"triangles": len(levelIndices), "vertices": level.vertex_count,
+                                 "error": simplifier.error})
+        if not reached:
+            break
+    return meshes, report
+
+
+def describeChain(report):
+    levels = ", ".join(f"{level['triangles']} triangles/{level['vertices']} vertices (error {level['error']:.3g})"
+                       for level in report["levels"])
+    return f"{report['layout']} LOD chain: {levels}"
+
+
+def screenDiameters(centres, radii, cameraPosition, projection, viewportHeight):
+    # projected diameter in pixels of bounding spheres, projection is pyrr style so [1, 1] is cot(fovy / 2)
+    distances = np.linalg.norm(np.asarray(centres) - cameraPosition, axis=1)
+    return 2 * radii * projection[1, 1] * viewportHeight * 0.5 / np.maximum(distances - radii, 1e-6)
+
+
+class LodSelector:
+    # a level per instance from its projected size: level i + 1 below thresholds[i] pixels, thresholds descending
+    # a level only gets coarser once the size is hysteresis below its threshold and finer again once it is
+    # hysteresis above it, so instances sitting on a threshold don't flicker between two levels
+    def __init__(self, capacity, thresholds, hysteresis=0.15):
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.hysteresis = hysteresis
+        self.levels = np.zeros(capacity, dtype=np.int64)
+        self.stats = {"changed": 0, "levels": [0] * (len(thresholds) + 1)}
+
+    def select(self, rows, diameters):
+        # updates and returns the levels of rows, diameters in pixels
+        # higher levels are coarser: finestAllowed is the lowest level a row may keep, the thresholds it is
+        # clearly below, coarsestAllowed the highest, the thresholds it is not clearly above
+        diameters = np.asarray(diameters, dtype=np.float64)[:, None]
+        finestAllowed = (diameters < self.thresholds * (1 - self.hysteresis)).sum(axis=1)
+        coarsestAllowed = (diameters < self.thresholds * (1 + self.hysteresis)).sum(axis=1)
+        levels = np.clip(self.levels[rows], finestAllowed, coarsestAllowed)
+        self.stats["changed"] = int((levels != self.levels[rows]).sum())
+        self.stats["levels"] = np.bincount(levels, minlength=len(self.thresholds) + 1).tolist()
+        self.levels[rows] = levels
+        return levels
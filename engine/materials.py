@@ -0,0 +1,203 @@
+import time
+
+from OpenGL.GL import *
+import numpy as np
+
+from engine.gl_state import state
+from engine.resources import resources
+from engine.textures import buildMipChain
+
+MATERIAL_BINDING = 5
+# std430 struct Material { vec4 diffuseRect; vec4 specularRect; uint diffuseLayer; uint specularLayer; }
+# a rect is (offset.xy, scale.xy) of the image inside its layer, uv' = offset + fract(uv) * scale
+MATERIAL_DTYPE = np.dtype([("diffuseRect", np.float32, 4), ("specularRect", np.float32, 4),
+                           ("diffuseLayer", np.uint32), ("specularLayer", np.uint32), ("pad", np.uint32, 2)])
+# texels of edge colour around every image that shares a layer, so linear filtering never reads a neighbour
+GUTTER = 2
+PLACEHOLDER = np.array([128, 128, 128, 255], dtype=np.uint8)
+
+
+def packLayers(sizes, gutter=GUTTER):
+    # places (width, height) images into layers the size of the largest one, returns (layerWidth, layerHeight),
+    # the layer count and (layer, x, y) of every image, images of the full layer size get a layer to themselves,
+    # the rest go onto shelves inside shared layers, tallest first, with gutter texels around each of them
+    layerWidth = max((width for width, _ in sizes), default=1)
+    layerHeight = max((height for _, height in sizes), default=1)
+    placements = [None] * len(sizes)
+    layers = 0
+    shared = []
+    for i, (width, height) in enumerate(sizes):
+        if width + 2 * gutter > layerWidth or height + 2 * gutter > layerHeight:
+            # full size, or too close to it for a gutter, repeats across its own layer
+            placements[i] = (layers, 0, 0)
+            layers += 1
+        else:
+            shared.append(i)
+    # shelves as [layer, y, height, x], a new image goes on the first shelf it fits, then a new shelf
+    shelves = []
+    layerTop = {}
+    for i in sorted(shared, key=lambda i: (-sizes[i][1], -sizes[i][0], i)):
+        width, height = sizes[i][0] + 2 * gutter, sizes[i][1] + 2 * gutter
+        for shelf in shelves:
+            if shelf[3] + width <= layerWidth and height <= shelf[2]:
+                placements[i] = (shelf[0], shelf[3] + gutter, shelf[1] + gutter)
+                shelf[3] += width
+                break
+        else:
+            layer = next((layer for layer, top in layerTop.items() if top + height <= layerHeight), None)
+            if layer is None:
+                layer = layers
+                layers += 1
+                layerTop[layer] = 0
+            shelves.append([layer, layerTop[layer], height, width])
+            placements[i] = (layer, gutter, layerTop[layer] + gutter)
+            layerTop[layer] += height
+    return (layerWidth, layerHeight), layers, placements
+
+
+def layerLevel(chains, layerSize, layers, placements, level, gutter=GUTTER):
+    # the (layers, height, width, 4) texels of one mip level for packLayers' result, built from every image's own
+    # mip chain, an image past the end of its chain repeats its last level, gutters repeat the image's edge
+    # positions and gutters shrink with the level, so after log2(gutter) levels an image's edge may cover a texel
+    # of its neighbour in a shared layer
+    layerWidth, layerHeight = layerSize
+    width, height = max(layerWidth >> level, 1), max(layerHeight >> level, 1)
+    pad = gutter >> level
+    texels = np.zeros((layers, height, width, 4), dtype=np.uint8)
+    for chain, (layer, x, y) in zip(chains, placements):
+        imageHeight, imageWidth = chain[0].shape[:2]
+        image = chain[min(level, len(chain) - 1)]
+        if imageWidth + 2 * gutter > layerWidth or imageHeight + 2 * gutter > layerHeight:
+            # a layer of its own, what the image does not cover repeats its last row and column
+            image = image[:height, :width]
+            texels[layer] = np.pad(image, ((0, height - image.shape[0]), (0, width - image.shape[1]), (0, 0)),
+                                   mode="edge")
+        else:
+            x, y = (x >> level) - pad, (y >> level) - pad
+            region = np.pad(image, ((pad, pad), (pad, pad), (0, 0)), mode="edge")[:height - y, :width - x]
+            texels[layer, y:y + region.shape[0], x:x + region.shape[1]] = region
+    return texels
+
+
+def imageRects(sizes, layerSize, placements):
+    # (offset.x, offset.y, scale.x, scale.y) of every image in uv units of its layer
+    layerWidth, layerHeight = layerSize
+    return np.array([(x / layerWidth, y / layerHeight, width / layerWidth, height / layerHeight)
+                     for (width, height), (_, x, y) in zip(sizes, placements)], dtype=np.float32).reshape(-1, 4)
+
+
+class MaterialLibrary:
+    # every material's diffuse and specular image in one GL_TEXTURE_2D_ARRAY and their placement in one SSBO,
+    # objects carry a material index, so the whole scene draws with a single texture bind
+    # images decode on the TextureManager's pool, a grey layer stands in until all of them are packed,
+    # the array keeps its name when it is filled, so recorded draws stay valid
+    # every level of the array is built from the images' own cached mip chains, packing copies them into the
+    # layers, so only the decode avoids copies, add() only records the material and the next poll() packs and
+    # uploads everything added since in one go
+    def __init__(self, textures):
+        self.textures = textures
+        self.paths = []
+        self.colours = {}
+        self.materials = []
+        self.pending = {}
+        # mip chains by path, kept to repack the layers when materials are added later
+        self.decoded = {}
+        self.entries = np.zeros(0, dtype=MATERIAL_DTYPE)
+        # materials were added or images finished decoding since the last upload()
+        self.stale = False
+        self.texture = resources.genTextures(1, "material array")
+        state.bindTexture(0, GL_TEXTURE_2D_ARRAY, self.texture)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_NEAREST_MIPMAP_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        # the placeholder has a single level, upload() raises this to the images' levels
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, 0)
+        resources.texImage3D(self.texture, 0, GL_RGBA8, 1, 1, 1, GL_RGBA, GL_UNSIGNED_BYTE, PLACEHOLDER)
+        self.buffer = resources.genBuffers(1, "materials")
+        self.stats = {"materials": 0, "images": 0, "layers": 1, "fill": 1.0, "uploads": 0, "uploadMs": 0.0}
+
+    def image(self, source):
+        # a path to decode, or an (r, g, b[, a]) colour that becomes a small flat image
+        if isinstance(source, str):
+            if source not in self.paths:
+                self.paths.append(source)
+                self.pending[source] = self.textures.decode(source)
+            return source
+        colour = tuple(int(c) for c in source) + (255,) * (4 - len(source))
+        self.colours[colour] = buildMipChain(np.full((4, 4, 4), colour, dtype=np.uint8))
+        return colour
+
+    def add(self, diffuse, specular=(0, 0, 0)):
+        # returns the material index, diffuse and specular are image paths or colours
+        self.materials.append((self.image(diffuse), self.image(specular)))
+        self.stats["materials"] = len(self.materials)
+        self.stale = True
+        return len(self.materials) - 1
+
+    def poll(self, block=False):
+        for path, future in list(self.pending.items()):
+            if not block and not future.done():
+                continue
+            del self.pending[path]
+            self.decoded[path] = self.textures.levels(future)
+            if not self.pending:
+                self.stale = True
+        if self.stale:
+            self.upload()
+
+    def wait(self):
+        self.poll(block=True)
+
+    def upload(self):
+        start = time.perf_counter()
+        self.stale = False
+        entries = np.zeros(len(self.materials), dtype=MATERIAL_DTYPE)
+        if self.pending:
+            # everything samples the grey placeholder layer
+            entries["diffuseRect"] = entries["specularRect"] = (0, 0, 1, 1)
+        else:
+            keys = list(self.decoded) + list(self.colours)
+            chains = [self.decoded[key] if key in self.decoded else self.colours[key] for key in keys]
+            sizes = [(chain[0].shape[1], chain[0].shape[0]) for chain in chains]
+            layerSize, layers, placements = packLayers(sizes)
+            rects = imageRects(sizes, layerSize, placements)
+            slot = {key: i for i, key in enumerate(keys)}
+            for i, (diffuse, specular) in enumerate(self.materials):
+                entries[i]["diffuseRect"] = rects[slot[diffuse]]
+                entries[i]["diffuseLayer"] = placements[slot[diffuse]][0]
+                entries[i]["specularRect"] = rects[slot[specular]]
+                entries[i]["specularLayer"] = placements[slot[specular]][0]
+            state.bindTexture(0, GL_TEXTURE_2D_ARRAY, self.texture)
+            glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+            levels = max(layerSize).bit_length()
+            for level in range(levels):
+                texels = layerLevel(chains, layerSize, layers, placements, level)
+                resources.texImage3D(self.texture, level, GL_RGBA8, texels.shape[2], texels.shape[1], layers,
+                                     GL_RGBA, GL_UNSIGNED_BYTE, texels)
+            glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_LEVEL, levels - 1)
+            self.stats["images"] = len(chains)
+            self.stats["layers"] = layers
+            self.stats["fill"] = sum(w * h for w, h in sizes) / (layers * layerSize[0] * layerSize[1])
+        self.entries = entries
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.buffer)
+        resources.bufferData(GL_SHADER_STORAGE_BUFFER, self.buffer, max(entries.nbytes, MATERIAL_DTYPE.itemsize),
+                             entries.view(np.uint8) if len(entries) else None, GL_STATIC_DRAW)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, MATERIAL_BINDING, self.buffer)
+        self.stats["uploads"] += 1
+        self.stats["uploadMs"] += (time.perf_counter() - start) * 1000
+
+    def textureSet(self):
+        return ((0, GL_TEXTURE_2D_ARRAY, self.texture),)
+
+    def use(self):
+        for unit, target, texture in self.textureSet():
+            state.bindTexture(unit, target, texture)
+
+    def destroy(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        state.forgetTexture(self.texture)
+        resources.deleteTextures(self.texture)
+        resources.deleteBuffers(self.buffer)
@@ -0,0 +1,123 @@
+import hashlib
+import os
+
+import numpy as np
+
+# floats per vertex of the interleaved layouts the labs already use
+LAYOUTS = {
+    "pos_uv_normal": 8,  # x, y, z, s, t, nx, ny, nz -> stride 32
+    "pos_colour": 6,  # x, y, z, r, g, b -> stride 24
+}
+CACHE_VERSION = b"1"
+
+
+class Mesh:
+    def __init__(self, vertices, indices, lines, layout, bounds=None):
+        self.layout = layout
+        # compact layouts are structured arrays, see engine.quantize
+        self.stride = vertices.dtype.itemsize if vertices.dtype.names else LAYOUTS[layout] * 4
+        self.vertices = vertices
+        self.indices = indices
+        self.lines = lines
+        self.vertex_count = len(vertices)
+        self.localBounds = bounds
+
+    def bounds(self):
+        # local axis aligned box, the float layouts start with x, y, z, compact meshes carry theirs
+        if self.localBounds is not None:
+            return self.localBounds
+        positions = np.asarray(self.vertices)[:, 0:3]
+        return positions.min(axis=0), positions.max(axis=0)
+
+
+def parseObj(text):
+    positions, uvs, normals = [], [], []
+    faces, lines = [], []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        kind = parts[0]
+        if kind == "v":
+            # "v x y z r g b" carries a vertex colour, plain "v x y z" does not
+            values = [float(p) for p in parts[1:7]]
+            colour = values[3:6] if len(values) == 6 else [1.0, 1.0, 1.0]
+            positions.append(values[0:3] + colour)
+        elif kind == "vt":
+            uvs.append([float(p) for p in parts[1:3]])
+        elif kind == "vn":
+            normals.append([float(p) for p in parts[1:4]])
+        elif kind == "f":
+            corners = [parseCorner(p, len(positions), len(uvs), len(normals)) for p in parts[1:]]
+            for i in range(1, len(corners) - 1):
+                faces.extend((corners[0], corners[i], corners[i + 1]))
+        elif kind == "l":
+            corners = [parseCorner(p, len(positions), len(uvs), len(normals)) for p in parts[1:]]
+            for i in range(len(corners) - 1):
+                lines.extend((corners[i], corners[i + 1]))
+    return (np.array(positions, dtype=np.float32).reshape(-1, 6),
+            np.array(uvs, dtype=np.float32).reshape(-1, 2),
+            np.array(normals, dtype=np.float32).reshape(-1, 3),
+            np.array(faces, dtype=np.int64).reshape(-1, 3),
+            np.array(lines, dtype=np.int64).reshape(-1, 3))
+
+
+def parseCorner(corner, positionCount, uvCount, normalCount):
+    # "v", "v/vt", "v//vn" or "v/vt/vn", one based, negative counts from the end
+    fields = corner.split("/") + ["", ""]
+    result = []
+    for field, count in zip(fields[:3], (positionCount, uvCount, normalCount)):
+        if field == "":
+            result.append(-1)
+        else:
+            index = int(field)
+            result.append(index - 1 if index > 0 else count + index)
+    return result
+
+
+def buildMesh(positions, uvs, normals, faces, lines, layout):
+    corners = np.concatenate((faces, lines))
+    if layout == "pos_colour":
+        # uv and normal don't exist in this layout, so they must not split vertices either
+        corners[:, 1:] = -1
+
+    # one vertex per distinct (v, vt, vn) triple, kept in order of first use for cache locality
+    unique, first, inverse = np.unique(corners, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    unique = unique[order]
+    remap = rank[inverse.reshape(-1)].astype(np.uint32)
+
+    vertices = np.zeros((len(unique), LAYOUTS[layout]), dtype=np.float32)
+    vertices[:, 0:3] = positions[unique[:, 0], 0:3]
+    if layout == "pos_colour":
+        vertices[:, 3:6] = positions[unique[:, 0], 3:6]
+    else:
+        hasUv = unique[:, 1] >= 0
+        vertices[hasUv, 3:5] = uvs[unique[hasUv, 1]]
+        hasNormal = unique[:, 2] >= 0
+        vertices[hasNormal, 5:8] = normals[unique[hasNormal, 2]]
+    return Mesh(vertices, remap[:len(faces)], remap[len(faces):], layout)
+
+
+def loadMesh(path, layout, cacheDir=".cache/meshes"):
+    with open(path, "rb") as f:
+        content = f.read()
+    key = hashlib.sha1(CACHE_VERSION + layout.encode() + content).hexdigest()
+    base = os.path.join(cacheDir, key)
+    names = [f"{base}_{part}.npy" for part in ("vertices", "indices", "lines")]
+
+    if all(os.path.exists(name) for name in names):
+        # memory mapped, the pages go straight from the file into glBufferData
+        vertices, indices, lines = (np.load(name, mmap_mode="r") for name in names)
+        return Mesh(vertices, indices, lines, layout)
+
+    mesh = buildMesh(*parseObj(content.decode()), layout)
+    os.makedirs(cacheDir, exist_ok=True)
+    for name, array in zip(names, (mesh.vertices, mesh.indices, mesh.lines)):
+        temporary = f"{name}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            np.save(f, array)
+        os.replace(temporary, name)
+    return mesh
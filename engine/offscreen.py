@@ -0,0 +1,90 @@
+import ctypes
+import os
+
+from OpenGL.GL import *
+
+from engine.resources import resources
+
+
+class OffscreenContext:
+    # a 4.5 core context without a window, rendering goes into an FBO of the requested size
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.platform = os.environ.get("PYOPENGL_PLATFORM")
+        if self.platform == "egl":
+            self.createEgl()
+        elif self.platform == "osmesa":
+            self.createOsMesa()
+        else:
+            raise RuntimeError("headless rendering needs PYOPENGL_PLATFORM=egl or osmesa set before importing OpenGL")
+
+        self.fbo = resources.genFramebuffers(1, "offscreen")
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        self.colour, self.depth = resources.genRenderbuffers(2, "offscreen")
+        glBindRenderbuffer(GL_RENDERBUFFER, self.colour)
+        resources.renderbufferStorage(self.colour, GL_RGBA8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.colour)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        resources.renderbufferStorage(self.depth, GL_DEPTH24_STENCIL8, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_STENCIL_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("offscreen framebuffer is incomplete")
+        glViewport(0, 0, width, height)
+
+    def createEgl(self):
+        from OpenGL import EGL
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("eglInitialize failed")
+        attributes = (EGL.EGLint * 13)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                       EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+                                       EGL.EGL_DEPTH_SIZE, 24,
+                                       EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                       EGL.EGL_NONE)
+        config = EGL.EGLConfig()
+        count = EGL.EGLint()
+        if not EGL.eglChooseConfig(self.display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count)) \
+                or count.value == 0:
+            raise RuntimeError("no EGL config with OpenGL and pbuffer support")
+        # the pbuffer only exists to make the context current, drawing goes to the FBO
+        surfaceAttributes = (EGL.EGLint * 5)(EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1, EGL.EGL_NONE)
+        self.surface = EGL.eglCreatePbufferSurface(self.display, config, surfaceAttributes)
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        contextAttributes = (EGL.EGLint * 7)(EGL.EGL_CONTEXT_MAJOR_VERSION, 4, EGL.EGL_CONTEXT_MINOR_VERSION, 5,
+                                             EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+                                             EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+                                             EGL.EGL_NONE)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, contextAttributes)
+        if not self.context:
+            raise RuntimeError("eglCreateContext failed for OpenGL 4.5 core")
+        EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context)
+
+    def createOsMesa(self):
+        from OpenGL import osmesa
+        from OpenGL import arrays
+        attributes = [osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+                      osmesa.OSMESA_DEPTH_BITS, 24,
+                      osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+                      osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 4,
+                      osmesa.OSMESA_CONTEXT_MINOR_VERSION, 5,
+                      0]
+        self.context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+        if not self.context:
+            raise RuntimeError("OSMesaCreateContextAttribs failed for OpenGL 4.5 core")
+        self.buffer = arrays.GLubyteArray.zeros((1, 1, 4))
+        osmesa.OSMesaMakeCurrent(self.context, self.buffer, GL_UNSIGNED_BYTE, 1, 1)
+
+    def destroy(self):
+        resources.deleteRenderbuffers((self.colour, self.depth))
+        resources.deleteFramebuffers(self.fbo)
+        if self.platform == "egl":
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglDestroySurface(self.display, self.surface)
+            EGL.eglTerminate(self.display)
+        else:
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.context)
@@ -0,0 +1,184 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from engine.culling import INTERSECTING, classifyBoxes, transformBounds
+from engine.transforms import composeMatrices
+
+# every array starts on a cache line so chunks written by different workers never share one at their edges
+ALIGNMENT = 64
+
+
+def arrayOffsets(layout, count):
+    # byte offset of every (name, shape, dtype) in layout for count rows, and the block size
+    offsets = {}
+    size = 0
+    for name, shape, dtype in layout:
+        size = (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        offsets[name] = size
+        size += count * int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+    return offsets, size
+
+
+class SharedArrays:
+    # named (count, *shape) arrays in one block of memory, shared blocks live in multiprocessing.shared_memory
+    # so worker processes map the same pages instead of receiving pickled copies, name attaches to an existing one
+    def __init__(self, layout, count, shared=False, name=None):
+        self.layout = layout
+        self.count = count
+        offsets, size = arrayOffsets(layout, count)
+        self.owner = name is None
+        if shared or name is not None:
+            self.memory = SharedMemory(name=name, create=name is None, size=max(size, 1))
+            buffer = self.memory.buf
+        else:
+            self.memory = None
+            buffer = bytearray(max(size, 1))
+        self.arrays = {name: np.ndarray((count, *shape), dtype=dtype, buffer=buffer, offset=offsets[name])
+                       for name, shape, dtype in layout}
+
+    @property
+    def name(self):
+        return self.memory.name if self.memory is not None else None
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        # the views have to go before the mapping can be closed
+        self.arrays = {}
+        if self.memory is not None:
+            self.memory.close()
+            if self.owner:
+                self.memory.unlink()
+            self.memory = None
+
+
+# the blocks a worker process attached to, set once by attachWorker
+attached = None
+
+
+def attachWorker(inputLayout, outputLayout, count, inputName, outputNames):
+    global attached
+    attached = (SharedArrays(inputLayout, count, name=inputName),
+                [SharedArrays(outputLayout, count, name=name) for name in outputNames])
+
+
+def runAttached(work, output, start, stop, params):
+    inputs, outputs = attached
+    return timedWork(work, inputs, outputs[output], start, stop, params)
+
+
+def timedWork(work, inputs, outputs, start, stop, params):
+    # runs a chunk and returns when it completed, perf_counter is system wide so process pools compare too
+    work(inputs, outputs, start, stop, params)
+    return time.perf_counter()
+
+
+class FramePipeline:
+    # frame N+1's update runs on a pool while the GL thread submits frame N:
+    #   finish() waits for the update started last frame and makes its outputs the front buffer
+    #   begin(params) starts the next one writing the back buffer, read front until the next finish()
+    # work(inputs, outputs, start, stop, params) fills rows [start, stop) of outputs, it has to be a module level
+    # function for process pools, params should stay small since it is pickled per chunk
+    # inputs are written by the caller and read by every update, they must not change between begin() and finish()
+    # workers=0 runs the update inline in begin(), processes=True uses a spawned process pool over shared memory
+    def __init__(self, work, inputLayout, outputLayout, count, workers=0, processes=False):
+        self.work = work
+        self.count = count
+        self.workers = workers
+        self.processes = processes and workers > 0
+        self.inputs = SharedArrays(inputLayout, count, self.processes)
+        self.outputs = [SharedArrays(outputLayout, count, self.processes) for _ in range(2)]
+        self.frontIndex = 0
+        self.pending = None
+        self.doneAt = []
+        if workers == 0:
+            self.executor = None
+        elif self.processes:
+            # spawned rather than forked, the parent holds a GL context and SDL's threads
+            self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=attachWorker,
+                                                initargs=(inputLayout, outputLayout, count, self.inputs.name,
+                                                          [outputs.name for outputs in self.outputs]))
+        else:
+            self.executor = ThreadPoolExecutor(workers)
+        bounds = np.linspace(0, count, max(workers, 1) + 1).astype(np.int64)
+        self.chunks = [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        self.stats = {"updateMs": 0.0, "waitMs": 0.0, "chunks": len(self.chunks)}
+
+    @property
+    def front(self):
+        return self.outputs[self.frontIndex]
+
+    def begin(self, params):
+        if self.pending is not None:
+            raise RuntimeError("the previous update has not been finished")
+        back = 1 - self.frontIndex
+        self.started = time.perf_counter()
+        if self.executor is None:
+            for start, stop in self.chunks:
+                self.work(self.inputs, self.outputs[back], start, stop, params)
+            self.pending = []
+            self.doneAt = [time.perf_counter()]
+            return
+        if self.processes:
+            self.pending = [self.executor.submit(runAttached, self.work, back, start, stop, params)
+                            for start, stop in self.chunks]
+        else:
+            self.pending = [self.executor.submit(timedWork, self.work, self.inputs, self.outputs[back], start, stop,
+                                                 params)
+                            for start, stop in self.chunks]
+        self.doneAt = []
+
+    def finish(self):
+        # returns the front buffer, unchanged when no update was started
+        if self.pending is None:
+            return self.front
+        start = time.perf_counter()
+        # when each chunk completed, so updateMs is the update's own time and not how late finish() was called,
+        # result() re-raises whatever a worker raised
+        doneAt = self.doneAt + [future.result() for future in self.pending]
+        end = time.perf_counter()
+        self.stats["waitMs"] = (end - start) * 1000
+        self.stats["updateMs"] = (max(doneAt, default=end) - self.started) * 1000
+        self.pending = None
+        self.frontIndex = 1 - self.frontIndex
+        return self.front
+
+    def destroy(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        self.pending = None
+        self.inputs.close()
+        for outputs in self.outputs:
+            outputs.close()
+
+
+# objects turning about their own z axis, the stock update for FramePipeline
+SPIN_INPUTS = (("positions", (3,), np.float32), ("scales", (3,), np.float32), ("spin", (), np.float32))
+SPIN_OUTPUTS = (("matrices", (4, 4), np.float32), ("mins", (3,), np.float32), ("maxs", (3,), np.float32),
+                ("classes", (), np.int8))
+
+
+def spinObjects(inputs, outputs, start, stop, params):
+    # params: time in seconds, localMin and localMax of the mesh, planes of the frustum to classify against or None
+    # spin is in radians per second, the rotation is rebuilt from the time so no state carries between frames
+    rows = slice(start, stop)
+    half = inputs["spin"][rows] * np.float32(params["time"] * 0.5)
+    rotations = np.zeros((stop - start, 4), dtype=np.float32)
+    rotations[:, 2] = np.sin(half)
+    rotations[:, 3] = np.cos(half)
+    matrices = outputs["matrices"][rows]
+    composeMatrices(inputs["positions"][rows], rotations, inputs["scales"][rows], matrices)
+    mins, maxs = transformBounds(params["localMin"], params["localMax"], matrices)
+    outputs["mins"][rows] = mins
+    outputs["maxs"][rows] = maxs
+    if params.get("planes") is not None:
+        outputs["classes"][rows] = classifyBoxes(params["planes"], mins, maxs)
+    else:
+        # untested, nothing is culled
+        outputs["classes"][rows] = INTERSECTING
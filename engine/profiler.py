@@ -0,0 +1,230 @@
+import ctypes
+import json
+import time
+
+from OpenGL.GL import *
+# PyOpenGL's wrappers have no array type for 64 bit results, the raw entry points take pointers
+from OpenGL.raw.GL.VERSION.GL_3_2 import glGetInteger64v as getInteger64
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v as getQueryResult64
+import numpy as np
+
+from engine.resources import resources
+
+# one row per finished scope, times in ns on the perf_counter_ns clock, gpu times stay 0 until their queries are read
+SCOPE_DTYPE = np.dtype([("frame", np.int64), ("scope", np.int32), ("depth", np.int32), ("cpuStart", np.int64),
+                        ("cpuEnd", np.int64), ("gpuStart", np.int64), ("gpuEnd", np.int64)])
+# frames the rolling percentiles cover
+WINDOW = 240
+# caption() summarises again after this many frames, so it can be called every frame
+CAPTION_FRAMES = 60
+
+
+class NullScope:
+    # what scope() hands out while profiling is off
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        return False
+
+
+class ScopeEnd:
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        self.profiler.end()
+        return False
+
+
+NULL_SCOPE = NullScope()
+
+
+class Profiler:
+    # nestable named scopes, timed on the CPU with perf_counter_ns and on the GPU with GL_TIMESTAMP queries
+    # a frame writes its timestamps into one of latency sets of queries and the set is read when it comes round
+    # again, latency frames later, results the GPU still has not produced then are dropped rather than waited for
+    # finished scopes go into a ring of capacity rows, export() writes them as a Chrome trace, summary() gives
+    # rolling percentiles per scope, while disabled scope() costs one attribute test
+    def __init__(self, capacity=1 << 16, maxScopes=128, latency=3):
+        self.enabled = False
+        self.gpu = False
+        self.records = np.zeros(capacity, dtype=SCOPE_DTYPE)
+        self.written = 0
+        self.names = []
+        self.ids = {}
+        self.stack = []
+        self.frame = 0
+        self.maxScopes = maxScopes
+        self.latency = latency
+        self.queries = None
+        self.used = 0
+        # (row, frame, start and end query) for every set of queries
+        self.pending = [[] for _ in range(latency)]
+        # added to GPU timestamps to put them on the perf_counter_ns clock
+        self.gpuOffset = 0
+        self.result = ctypes.c_uint64()
+        self.ender = ScopeEnd(self)
+        self.captionText = ""
+        self.captionFrame = None
+        self.stats = {"scopes": 0, "gpuRead": 0, "gpuDropped": 0, "gpuOverflow": 0}
+
+    def enable(self, gpu=True):
+        # gpu timing needs the GL context to be current
+        self.enabled = True
+        self.gpu = gpu
+        if gpu and self.queries is None:
+            names = resources.genQueries(self.latency * self.maxScopes * 2, "profiler")
+            self.queries = np.array(names, dtype=np.uint32).reshape(self.latency, self.maxScopes, 2)
+            now = ctypes.c_int64()
+            getInteger64(GL_TIMESTAMP, ctypes.byref(now))
+            self.gpuOffset = time.perf_counter_ns() - now.value
+
+    def disable(self):
+        self.enabled = False
+
+    def beginFrame(self):
+        if not self.enabled:
+            return
+        if self.stack:
+            raise RuntimeError(f"profiler scope {self.names[self.stack[-1][0]]} was never ended")
+        self.frame += 1
+        if self.gpu:
+            # this frame reuses the set written latency frames ago
+            self.collect(self.frame % self.latency)
+        self.used = 0
+
+    def scope(self, name):
+        if not self.enabled:
+            return NULL_SCOPE
+        self.begin(name)
+        return self.ender
+
+    def begin(self, name):
+        scope = self.ids.get(name)
+        if scope is None:
+            scope = self.ids[name] = len(self.names)
+            self.names.append(name)
+        query = None
+        if self.gpu:
+            if self.used < self.maxScopes:
+                query = self.queries[self.frame % self.latency, self.used]
+                self.used += 1
+                glQueryCounter(int(query[0]), GL_TIMESTAMP)
+            else:
+                self.stats["gpuOverflow"] += 1
+        self.stack.append((scope, query, time.perf_counter_ns()))
+
+    def end(self):
+        cpuEnd = time.perf_counter_ns()
+        scope, query, cpuStart = self.stack.pop()
+        row = self.written % len(self.records)
+        self.records[row] = (self.frame, scope, len(self.stack), cpuStart, cpuEnd, 0, 0)
+        self.written += 1
+        self.stats["scopes"] += 1
+        if query is not None:
+            glQueryCounter(int(query[1]), GL_TIMESTAMP)
+            self.pending[self.frame % self.latency].append((row, self.frame, query))
+
+    def collect(self, index):
+        for row, frame, (start, end) in self.pending[index]:
+            if not glGetQueryObjectiv(int(end), GL_QUERY_RESULT_AVAILABLE):
+                self.stats["gpuDropped"] += 1
+                continue
+            if self.records[row]["frame"] != frame:
+                # the ring came round and the row belongs to a newer scope
+                continue
+            getQueryResult64(int(start), GL_QUERY_RESULT, ctypes.byref(self.result))
+            self.records[row]["gpuStart"] = self.result.value + self.gpuOffset
+            getQueryResult64(int(end), GL_QUERY_RESULT, ctypes.byref(self.result))
+            self.records[row]["gpuEnd"] = self.result.value + self.gpuOffset
+            self.stats["gpuRead"] += 1
+        self.pending[index].clear()
+
+    def flush(self):
+        # waits for the GPU and reads every outstanding query, for the end of a run
+        if self.gpu:
+            glFinish()
+            for index in range(self.latency):
+                self.collect(index)
+
+    def rows(self):
+        # the ring's records oldest first
+        count = min(self.written, len(self.records))
+        return np.roll(self.records, -(self.written % len(self.records)))[len(self.records) - count:]
+
+    def summary(self, frames=WINDOW):
+        # per scope over the last frames: calls per frame and p50/p95/p99 of its cpu and gpu ms per frame,
+        # a scope entered several times in a frame counts with its total
+        rows = self.rows()
+        rows = rows[rows["frame"] > self.frame - frames]
+        summary = {}
+        for scope in np.unique(rows["scope"]):
+            mine = rows[rows["scope"] == scope]
+            frameIds, inverse = np.unique(mine["frame"], return_inverse=True)
+            cpu = np.bincount(inverse, weights=(mine["cpuEnd"] - mine["cpuStart"]) / 1e6)
+            entry = {"depth": int(mine["depth"].min()), "calls": len(mine) / len(frameIds),
+                     "cpuP50": None, "cpuP95": None, "cpuP99": None, "gpuP50": None, "gpuP95": None, "gpuP99": None}
+            entry["cpuP50"], entry["cpuP95"], entry["cpuP99"] = (float(v) for v in np.percentile(cpu, (50, 95, 99)))
+            timed = mine[mine["gpuEnd"] > 0]
+            if len(timed):
+                _, inverse = np.unique(timed["frame"], return_inverse=True)
+                gpu = np.bincount(inverse, weights=(timed["gpuEnd"] - timed["gpuStart"]) / 1e6)
+                entry["gpuP50"], entry["gpuP95"], entry["gpuP99"] = (float(v) for v in np.percentile(gpu, (50, 95, 99)))
+            summary[self.names[scope]] = entry
+        return summary
+
+    def describe(self, frames=WINDOW):
+        # a table of summary(), nested scopes indented under their parents
+        lines = [f"{'scope':<24} {'calls':>5} {'cpu p50':>8} {'p95':>7} {'p99':>7} "
+                 f"{'gpu p50':>8} {'p95':>7} {'p99':>7}"]
+        for name, entry in self.summary(frames).items():
+            gpu = " ".join(f"{entry[key]:>7.3f}" if entry[key] is not None else f"{'-':>7}"
+                           for key in ("gpuP50", "gpuP95", "gpuP99"))
+            lines.append(f"{'  ' * entry['depth'] + name:<24} {entry['calls']:>5.1f} {entry['cpuP50']:>8.3f} "
+                         f"{entry['cpuP95']:>7.3f} {entry['cpuP99']:>7.3f} {gpu:>24}")
+        return "\n".join(lines)
+
+    def caption(self, frames=WINDOW):
+        # the outermost scopes' cpu/gpu p50 in one line, for a window title
+        if self.captionFrame is not None and self.frame < self.captionFrame + CAPTION_FRAMES:
+            return self.captionText
+        self.captionFrame = self.frame
+        parts = []
+        for name, entry in self.summary(frames).items():
+            if entry["depth"] == 0:
+                gpu = f"/{entry['gpuP50']:.2f}" if entry["gpuP50"] is not None else ""
+                parts.append(f"{name} {entry['cpuP50']:.2f}{gpu}")
+        self.captionText = f"Profile (cpu/gpu ms): {', '.join(parts)}."
+        return self.captionText
+
+    def export(self, path):
+        # Chrome trace event JSON, open it in chrome://tracing or ui.perfetto.dev, CPU and GPU are separate tracks
+        rows = self.rows()
+        origin = int(rows["cpuStart"].min()) if len(rows) else 0
+        events = [{"name": "thread_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": "CPU"}},
+                  {"name": "thread_name", "ph": "M", "pid": 0, "tid": 1, "args": {"name": "GPU"}}]
+        for frame, scope, depth, cpuStart, cpuEnd, gpuStart, gpuEnd in rows.tolist():
+            name = self.names[scope]
+            events.append({"name": name, "ph": "X", "pid": 0, "tid": 0, "ts": (cpuStart - origin) / 1000,
+                           "dur": (cpuEnd - cpuStart) / 1000, "args": {"frame": frame}})
+            if gpuEnd:
+                events.append({"name": name, "ph": "X", "pid": 0, "tid": 1, "ts": (gpuStart - origin) / 1000,
+                               "dur": (gpuEnd - gpuStart) / 1000, "args": {"frame": frame}})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def destroy(self):
+        if self.queries is not None:
+            resources.deleteQueries(self.queries.ravel())
+            self.queries = None
+        self.gpu = False
+        for pending in self.pending:
+            pending.clear()
+
+
+# like the binding cache, one profiler for the process wide GL context
+profiler = Profiler()
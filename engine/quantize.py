@@ -0,0 +1,114 @@
+import numpy as np
+
+from engine.meshes import Mesh
+
+# compact counterparts of the float layouts, positions are snorm16 inside a decode box, x, y, z plus one pad short
+COMPACT_DTYPES = {
+    # 16 bytes instead of 32: position, half float uv, GL_INT_2_10_10_10_REV normal
+    "pos_uv_normal_compact": np.dtype([("position", np.int16, 4), ("uv", np.float16, 2), ("normal", np.uint32)]),
+    # 8 bytes instead of 24: the colour moves to a uniform or an instance attribute
+    "pos_compact": np.dtype([("position", np.int16, 4)]),
+}
+COMPACT_LAYOUTS = {"pos_uv_normal": "pos_uv_normal_compact", "pos_colour": "pos_compact"}
+SNORM16 = 32767
+SNORM10 = 511
+
+
+def decodeBox(bounds):
+    # (offset, scale) so that position = offset + scale * snorm, the box is padded so no axis has zero scale
+    lo, hi = (np.asarray(b, dtype=np.float64) for b in bounds)
+    offset = (lo + hi) * 0.5
+    scale = np.maximum((hi - lo) * 0.5, 1e-6)
+    return offset.astype(np.float32), scale.astype(np.float32)
+
+
+def quantizePositions(positions, offset, scale):
+    normalized = (positions - offset) / scale
+    if np.abs(normalized).max(initial=0) > 1 + 1e-5:
+        raise ValueError("mesh does not fit inside the decode box")
+    quantized = np.zeros((len(positions), 4), dtype=np.int16)
+    quantized[:, :3] = np.round(np.clip(normalized, -1, 1) * SNORM16)
+    return quantized
+
+
+def decodePositions(quantized, offset, scale):
+    # what the vertex shader computes from the normalized GL_SHORT attribute
+    return offset + scale * np.maximum(quantized[:, :3].astype(np.float32) / SNORM16, -1)
+
+
+def packNormals(normals):
+    # GL_INT_2_10_10_10_REV: x in bits 0-9, y in 10-19, z in 20-29, w unused
+    normals = np.asarray(normals, dtype=np.float32)
+    normals = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    components = np.round(np.clip(normals, -1, 1) * SNORM10).astype(np.int32) & 0x3FF
+    return (components[:, 0] | (components[:, 1] << 10) | (components[:, 2] << 20)).astype(np.uint32)
+
+
+def unpackNormals(packed):
+    packed = packed.astype(np.int64)
+    components = np.stack([(packed >> shift) & 0x3FF for shift in (0, 10, 20)], axis=1)
+    components = np.where(components >= 512, components - 1024, components)
+    return np.maximum(components / SNORM10, -1).astype(np.float32)
+
+
+def compactMesh(mesh, bounds=None):
+    # converts a float layout mesh, returns (compact mesh, report), positions are relative to bounds
+    # (the mesh's own by default) and every error is checked against what the format can guarantee
+    layout = COMPACT_LAYOUTS[mesh.layout]
+    vertices = np.asarray(mesh.vertices, dtype=np.float32)
+    positions = vertices[:, 0:3]
+    meshBounds = (positions.min(axis=0), positions.max(axis=0))
+    offset, scale = decodeBox(meshBounds if bounds is None else bounds)
+    compact = np.zeros(len(vertices), dtype=COMPACT_DTYPES[layout])
+    compact["position"] = quantizePositions(positions, offset, scale)
+    report = {"layout": layout, "vertices": len(vertices),
+              "originalBytes": vertices.nbytes, "compactBytes": compact.nbytes}
+
+    positionError = np.abs(decodePositions(compact["position"], offset, scale) - positions).max(initial=0)
+    # half a quantization step, plus float32 rounding of offset + scale * x
+    positionBound = float((scale / SNORM16).max() * 0.5 + np.abs(meshBounds).max() * 2 ** -22)
+    report["positionError"] = float(positionError)
+    report["positionBound"] = positionBound
+    if positionError > positionBound:
+        raise ValueError(f"position error {positionError} above the {positionBound} bound")
+
+    if layout == "pos_uv_normal_compact":
+        uvs = vertices[:, 3:5]
+        compact["uv"] = uvs
+        uvError = np.abs(compact["uv"].astype(np.float32) - uvs).max(initial=0)
+        # 11 significant bits, so half an ulp is 2^-11 relative, subnormals below 2^-14 are 2^-25 absolute
+        uvBound = float(max(np.abs(uvs).max(initial=0) * 2 ** -11, 2 ** -25))
+        report["uvError"] = float(uvError)
+        report["uvBound"] = uvBound
+        if uvError > uvBound:
+            raise ValueError(f"uv error {uvError} above the {uvBound} bound, uvs may be outside the half range")
+
+        normals = vertices[:, 5:8]
+        unit = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+        decoded = unpackNormals(packNormals(normals))
+        decoded /= np.maximum(np.linalg.norm(decoded, axis=1, keepdims=True), 1e-12)
+        angle = np.degrees(np.arccos(np.clip((decoded * unit).sum(axis=1), -1, 1))).max(initial=0)
+        # every component is off by at most half a step of 1/511
+        angleBound = float(np.degrees(2 * np.arcsin(min(np.sqrt(3) * 0.5 / SNORM10, 1))))
+        compact["normal"] = packNormals(normals)
+        report["normalErrorDegrees"] = float(angle)
+        report["normalBoundDegrees"] = angleBound
+        if angle > angleBound:
+            raise ValueError(f"normal error {angle} degrees above the {angleBound} bound")
+    else:
+        colours = vertices[:, 3:6]
+        if len(colours) and not (colours == colours[0]).all():
+            raise ValueError("pos_colour mesh has per-vertex colours, they cannot move to the object")
+        report["colour"] = colours[0].copy() if len(colours) else np.zeros(3, dtype=np.float32)
+
+    return Mesh(compact, mesh.indices, mesh.lines, layout, bounds=meshBounds), report
+
+
+def describe(report):
+    line = (f"{report['layout']}: {report['vertices']} vertices, {report['originalBytes']} -> {report['compactBytes']} "
+            f"bytes ({1 - report['compactBytes'] / max(report['originalBytes'], 1):.0%} saved), "
+            f"position error {report['positionError']:.2e} <= {report['positionBound']:.2e}")
+    if "uvError" in report:
+        line += (f", uv error {report['uvError']:.2e} <= {report['uvBound']:.2e}, "
+                 f"normal error {report['normalErrorDegrees']:.3f} <= {report['normalBoundDegrees']:.3f} degrees")
+    return line
@@ -0,0 +1,236 @@
+import os
+import sys
+
+from OpenGL.GL import *
+import numpy as np
+
+CATEGORIES = ("buffer", "texture", "vertexArray", "framebuffer", "renderbuffer", "program", "query")
+# bytes per texel of the internal formats the engine allocates
+FORMAT_BYTES = {
+    GL_RED: 1, GL_R8: 1, GL_RG: 2, GL_RG8: 2, GL_RGB: 3, GL_RGB8: 3, GL_RGBA: 4, GL_RGBA8: 4, GL_SRGB8_ALPHA8: 4,
+    GL_R16F: 2, GL_RG16F: 4, GL_RGB16F: 6, GL_RGBA16F: 8, GL_R32F: 4, GL_RG32F: 8, GL_RGB32F: 12, GL_RGBA32F: 16,
+    GL_RGB10_A2: 4, GL_R11F_G11F_B10F: 4,
+    GL_DEPTH_COMPONENT: 4, GL_DEPTH_COMPONENT24: 4, GL_DEPTH_COMPONENT32F: 4, GL_DEPTH24_STENCIL8: 4,
+}
+# frames of memory history kept for the per-frame report
+HISTORY = 240
+
+
+class ResourceBudgetError(MemoryError):
+    pass
+
+
+class Resource:
+    def __init__(self, category, name, label, site, frame):
+        self.category = category
+        self.name = name
+        self.label = label
+        self.site = site
+        self.frame = frame
+        # bytes per texture level, or the whole object under level 0
+        self.levels = {}
+
+    @property
+    def bytes(self):
+        return sum(self.levels.values())
+
+    def describe(self):
+        label = f" {self.label}" if self.label else ""
+        return f"{self.category} {self.name}{label}, {self.bytes} bytes, created in frame {self.frame} at {self.site}"
+
+
+def callSite(depth=3):
+    # the first frames outside this file, innermost first, as folder/file.py:line function
+    frame = sys._getframe(1)
+    here = os.path.abspath(__file__)
+    sites = []
+    while frame is not None and len(sites) < depth:
+        path = os.path.abspath(frame.f_code.co_filename)
+        if path != here:
+            sites.append(f"{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}:{frame.f_lineno} "
+                         f"{frame.f_code.co_name}")
+        frame = frame.f_back
+    return " <- ".join(sites)
+
+
+class ResourceRegistry:
+    # every GL object the engine creates goes through here, so live GPU memory is known per category and frame,
+    # budgets are checked before anything is allocated and whatever is still alive at shutdown is a leak
+    def __init__(self):
+        self.live = {}
+        self.budgets = {}
+        self.bytes = dict.fromkeys(CATEGORIES, 0)
+        self.total = 0
+        self.frame = 0
+        self.history = np.zeros((HISTORY, 4), dtype=np.int64)
+        self.stats = {"created": 0, "deleted": 0, "allocated": 0, "freed": 0, "unknownDeletes": 0}
+        self.lastFrame = dict(self.stats)
+
+    def create(self, category, names, label):
+        names = [int(name) for name in np.atleast_1d(names)]
+        site = callSite()
+        for name in names:
+            self.live[(category, name)] = Resource(category, name, label, site, self.frame)
+        self.stats["created"] += len(names)
+        return names[0] if len(names) == 1 else names
+
+    def genBuffers(self, count=1, label=None):
+        return self.create("buffer", glGenBuffers(count), label)
+
+    def genTextures(self, count=1, label=None):
+        return self.create("texture", glGenTextures(count), label)
+
+    def genVertexArrays(self, count=1, label=None):
+        return self.create("vertexArray", glGenVertexArrays(count), label)
+
+    def genFramebuffers(self, count=1, label=None):
+        return self.create("framebuffer", glGenFramebuffers(count), label)
+
+    def genRenderbuffers(self, count=1, label=None):
+        return self.create("renderbuffer", glGenRenderbuffers(count), label)
+
+    def genQueries(self, count=1, label=None):
+        return self.create("query", glGenQueries(count), label)
+
+    def createProgram(self, label=None):
+        return self.create("program", glCreateProgram(), label)
+
+    def adoptProgram(self, program, label=None):
+        # for programs linked elsewhere, e.g. by OpenGL.GL.shaders.compileProgram
+        return self.create("program", program, label)
+
+    def setBytes(self, category, name, size, level=0):
+        resource = self.live.get((category, int(name)))
+        if resource is None:
+            raise KeyError(f"{category} {name} was not created through the resource registry")
+        change = int(size) - resource.levels.get(level, 0)
+        if change > 0:
+            self.checkBudget(category, change)
+            self.stats["allocated"] += change
+        else:
+            self.stats["freed"] -= change
+        resource.levels[level] = int(size)
+        self.bytes[category] += change
+        self.total += change
+
+    def checkBudget(self, category, change):
+        for key, used in ((category, self.bytes[category]), ("total", self.total)):
+            budget = self.budgets.get(key)
+            if budget is not None and used + change > budget:
+                raise ResourceBudgetError(f"{key} GPU memory budget of {budget} bytes exceeded: "
+                                          f"{used} in use, {change} more requested at {callSite()}")
+
+    def setBudget(self, category, size):
+        # a category from CATEGORIES or "total", None removes the budget
+        if category != "total" and category not in CATEGORIES:
+            raise ValueError(f"unknown resource category {category}")
+        self.budgets[category] = size
+
+    def bufferData(self, target, buffer, size, data, usage):
+        # the buffer has to be bound to target
+        self.setBytes("buffer", buffer, size)
+        glBufferData(target, size, data, usage)
+
+    def bufferStorage(self, target, buffer, size, data, flags):
+        self.setBytes("buffer", buffer, size)
+        glBufferStorage(target, size, data, flags)
+
+    def texImage2D(self, texture, level, internalFormat, width, height, format, kind, pixels):
+        # the texture has to be bound to GL_TEXTURE_2D on the active unit
+        self.setBytes("texture", texture, width * height * FORMAT_BYTES[internalFormat], level)
+        glTexImage2D(GL_TEXTURE_2D, level, internalFormat, width, height, 0, format, kind, pixels)
+
+    def texImage3D(self, texture, level, internalFormat, width, height, depth, format, kind, pixels):
+        # the texture has to be bound to GL_TEXTURE_2D_ARRAY on the active unit
+        self.setBytes("texture", texture, width * height * depth * FORMAT_BYTES[internalFormat], level)
+        glTexImage3D(GL_TEXTURE_2D_ARRAY, level, internalFormat, width, height, depth, 0, format, kind, pixels)
+
+    def renderbufferStorage(self, renderbuffer, internalFormat, width, height):
+        # the renderbuffer has to be bound to GL_RENDERBUFFER
+        self.setBytes("renderbuffer", renderbuffer, width * height * FORMAT_BYTES[internalFormat])
+        glRenderbufferStorage(GL_RENDERBUFFER, internalFormat, width, height)
+
+    def release(self, category, names):
+        names = [int(name) for name in np.atleast_1d(names)]
+        for name in names:
+            resource = self.live.pop((category, name), None)
+            if resource is None:
+                # deleted twice, or created behind the registry's back
+                self.stats["unknownDeletes"] += 1
+                continue
+            size = resource.bytes
+            self.bytes[category] -= size
+            self.total -= size
+            self.stats["freed"] += size
+            self.stats["deleted"] += 1
+        # an array GL can take as is, lists are refused when PyOpenGL runs with ERROR_ON_COPY
+        return np.array(names, dtype=np.uint32)
+
+    def deleteBuffers(self, buffers):
+        buffers = self.release("buffer", buffers)
+        glDeleteBuffers(len(buffers), buffers)
+
+    def deleteTextures(self, textures):
+        textures = self.release("texture", textures)
+        glDeleteTextures(len(textures), textures)
+
+    def deleteVertexArrays(self, vaos):
+        vaos = self.release("vertexArray", vaos)
+        glDeleteVertexArrays(len(vaos), vaos)
+
+    def deleteFramebuffers(self, framebuffers):
+        framebuffers = self.release("framebuffer", framebuffers)
+        glDeleteFramebuffers(len(framebuffers), framebuffers)
+
+    def deleteRenderbuffers(self, renderbuffers):
+        renderbuffers = self.release("renderbuffer", renderbuffers)
+        glDeleteRenderbuffers(len(renderbuffers), renderbuffers)
+
+    def deleteQueries(self, queries):
+        queries = self.release("query", queries)
+        glDeleteQueries(len(queries), queries)
+
+    def deleteProgram(self, program):
+        self.release("program", program)
+        glDeleteProgram(program)
+
+    def beginFrame(self):
+        # closes the frame in progress: (frame, live bytes, allocated, freed) goes into the history
+        self.history[self.frame % HISTORY] = (self.frame, self.total, self.stats["allocated"], self.stats["freed"])
+        self.lastFrame = dict(self.stats)
+        for key in ("allocated", "freed"):
+            self.stats[key] = 0
+        self.frame += 1
+
+    def frames(self):
+        # the history oldest first
+        count = min(self.frame, HISTORY)
+        return np.roll(self.history, -(self.frame % HISTORY), axis=0)[HISTORY - count:]
+
+    def report(self):
+        counts = dict.fromkeys(CATEGORIES, 0)
+        for category, _ in self.live:
+            counts[category] += 1
+        report = {category: {"count": counts[category], "bytes": self.bytes[category]} for category in CATEGORIES}
+        report["total"] = {"count": len(self.live), "bytes": self.total}
+        return report
+
+    def describe(self):
+        return ", ".join(f"{category} {values['bytes'] / 2 ** 20:.1f} MB ({values['count']})"
+                         for category, values in self.report().items() if values["count"])
+
+    def leaks(self):
+        return sorted(self.live.values(), key=lambda resource: (resource.category, resource.name))
+
+    def checkLeaks(self):
+        # call after everything was destroyed, prints and returns whatever is still alive
+        leaks = self.leaks()
+        if leaks:
+            print(f"{len(leaks)} GPU resources not released, {sum(leak.bytes for leak in leaks)} bytes:")
+            for leak in leaks:
+                print(f"  {leak.describe()}")
+        return leaks
+
+
+# like the binding cache, one registry for the process wide GL context
+resources = ResourceRegistry()
@@ -0,0 +1,148 @@
+import hashlib
+import os
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL.KHR.parallel_shader_compile import glMaxShaderCompilerThreadsKHR
+from OpenGL.GL.shaders import ShaderCompilationError, ShaderLinkError
+
+from engine.resources import resources
+from engine.uniforms import ShaderProgram
+
+CACHE_VERSION = "1"
+
+
+def hasExtension(name):
+    count = glGetIntegerv(GL_NUM_EXTENSIONS)
+    return any(glGetStringi(GL_EXTENSIONS, i).decode() == name for i in range(count))
+
+
+def preprocess(source, defines):
+    # the #defines go right after #version, which has to stay the first line
+    lines = source.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith("#version"):
+            block = "".join(f"#define {name} {value}\n" for name, value in sorted(defines.items()))
+            return "".join(lines[:i + 1]) + block + "".join(lines[i + 1:])
+    raise ValueError("shader source has no #version line")
+
+
+class ShaderCache:
+    def __init__(self, cacheDir=".cache/shaders"):
+        self.cacheDir = cacheDir
+        self.parallel = hasExtension("GL_KHR_parallel_shader_compile")
+        if self.parallel:
+            # let the driver use as many compiler threads as it likes
+            glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+        self.driver = "|".join(glGetString(name).decode() for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+        self.stats = {"binaryHits": 0, "compiled": 0, "rejected": 0}
+
+    def key(self, vertexSource, fragmentSource):
+        content = "\0".join((CACHE_VERSION, self.driver, vertexSource, fragmentSource))
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def build(self, requests):
+        # requests are (vertexPath, fragmentPath) or (vertexPath, fragmentPath, defines), one program each
+        programs = [None] * len(requests)
+        compiling = []
+        for index, request in enumerate(requests):
+            vertexPath, fragmentPath = request[0], request[1]
+            defines = request[2] if len(request) > 2 else {}
+            with open(vertexPath, 'r') as f:
+                vertexSource = preprocess(f.read(), defines)
+            with open(fragmentPath, 'r') as f:
+                fragmentSource = preprocess(f.read(), defines)
+            key = self.key(vertexSource, fragmentSource)
+            label = f"{vertexPath} + {fragmentPath}"
+            program = self.loadBinary(key, label)
+            if program is not None:
+                programs[index] = program
+                self.stats["binaryHits"] += 1
+            else:
+                compiling.append((index, key, self.startCompile(vertexSource, fragmentSource, label)))
+
+        # everything is queued before the first status query, which is where the driver would block,
+        # so with parallel compile the remaining programs keep building while we wait on this one
+        finished = 0
+        try:
+            for index, key, (program, shaders) in compiling:
+                finished += 1
+                self.finishCompile(program, shaders, requests[index])
+                programs[index] = program
+                self.saveBinary(key, program)
+                self.stats["compiled"] += 1
+        except Exception:
+            # finishCompile deletes the program that failed, the rest of the batch goes with it
+            for index, key, (program, shaders) in compiling[finished:]:
+                self.abandonCompile(program, shaders)
+            for program in programs:
+                if program is not None:
+                    resources.deleteProgram(program)
+            raise
+        return [ShaderProgram(program) for program in programs]
+
+    def startCompile(self, vertexSource, fragmentSource, label=None):
+        shaders = []
+        for source, kind in ((vertexSource, GL_VERTEX_SHADER), (fragmentSource, GL_FRAGMENT_SHADER)):
+            shader = glCreateShader(kind)
+            glShaderSource(shader, source)
+            glCompileShader(shader)
+            shaders.append(shader)
+        program = resources.createProgram(label)
+        for shader in shaders:
+            glAttachShader(program, shader)
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program)
+        return program, shaders
+
+    def finishCompile(self, program, shaders, request):
+        error = None
+        for shader, path in zip(shaders, request[:2]):
+            if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+                error = ShaderCompilationError(f"{path}: {glGetShaderInfoLog(shader).decode()}")
+                break
+        if error is None and not glGetProgramiv(program, GL_LINK_STATUS):
+            error = ShaderLinkError(f"{request[0]} + {request[1]}: {glGetProgramInfoLog(program).decode()}")
+        for shader in shaders:
+            glDetachShader(program, shader)
+            glDeleteShader(shader)
+        if error is not None:
+            resources.deleteProgram(program)
+            raise error
+
+    def abandonCompile(self, program, shaders):
+        for shader in shaders:
+            glDetachShader(program, shader)
+            glDeleteShader(shader)
+        resources.deleteProgram(program)
+
+    def loadBinary(self, key, label=None):
+        path = os.path.join(self.cacheDir, f"{key}.bin")
+        if not os.path.exists(path):
+            return None
+        data = np.fromfile(path, dtype=np.uint8)
+        binaryFormat = int(data[:4].view(np.uint32)[0])
+        program = resources.createProgram(label)
+        glProgramBinary(program, binaryFormat, data[4:], len(data) - 4)
+        if glGetProgramiv(program, GL_LINK_STATUS):
+            return program
+        # driver update or different GPU, compile from source and overwrite the entry
+        resources.deleteProgram(program)
+        self.stats["rejected"] += 1
+        return None
+
+    def saveBinary(self, key, program):
+        size = int(glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH))
+        if size == 0:
+            return
+        length = np.zeros(1, dtype=np.int32)
+        binaryFormat = np.zeros(1, dtype=np.uint32)
+        binary = np.zeros(size, dtype=np.uint8)
+        glGetProgramBinary(program, size, length, binaryFormat, binary)
+        os.makedirs(self.cacheDir, exist_ok=True)
+        path = os.path.join(self.cacheDir, f"{key}.bin")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(binaryFormat.tobytes())
+            f.write(binary[:length[0]].tobytes())
+        os.replace(temporary, path)
@@ -0,0 +1,269 @@
+import numpy as np
+
+from engine.culling import (BVH, boxesOverlap, expandRanges, nearestPerQuery, normalizeRays, rayBoxes,
+                            spheresOverlap)
+
+# cell coordinates are packed 21 bits per axis into one int64 key, so cells are unique rather than hashed
+CELL_BITS = 21
+CELL_OFFSET = 1 << (CELL_BITS - 1)
+CELL_MASK = (1 << CELL_BITS) - 1
+# the recent table is merged into the main one once it holds this fraction of the main table's pairs
+MERGE_FRACTION = 0.25
+MIN_MERGE = 1024
+
+
+def packCells(cells):
+    cells = np.clip(cells + CELL_OFFSET, 0, CELL_MASK).astype(np.int64)
+    return (cells[..., 0] << (2 * CELL_BITS)) | (cells[..., 1] << CELL_BITS) | cells[..., 2]
+
+
+def expandCells(owners, cellMins, cellMaxs):
+    # (owner, key) for every cell of every owner's cell box, without a python loop
+    spans = cellMaxs - cellMins + 1
+    counts = spans.prod(axis=1)
+    local = expandRanges(np.zeros(len(counts), dtype=np.int64), counts)
+    index = np.repeat(np.arange(len(counts)), counts)
+    spans = spans[index]
+    cells = cellMins[index].copy()
+    cells[:, 0] += local % spans[:, 0]
+    cells[:, 1] += local // spans[:, 0] % spans[:, 1]
+    cells[:, 2] += local // (spans[:, 0] * spans[:, 1])
+    return owners[index], packCells(cells)
+
+
+class PairTable:
+    # (key, handle, version) rows sorted by key, a cell's objects are one searchsorted range
+    def __init__(self, keys=None, handles=None, versions=None):
+        empty = np.zeros(0, dtype=np.int64)
+        keys = empty if keys is None else keys
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.handles = empty if handles is None else handles[order]
+        self.versions = empty if versions is None else versions[order]
+
+    def lookup(self, owners, keys):
+        # (owner, pair row) for every row whose key one of the owners asks for
+        low = np.searchsorted(self.keys, keys, side="left")
+        high = np.searchsorted(self.keys, keys, side="right")
+        counts = high - low
+        return np.repeat(owners, counts), expandRanges(low, counts)
+
+
+class SpatialHash:
+    # a uniform grid over object AABBs, every object is listed in each cell its box touches,
+    # queries only look at the objects of the cells they touch and test those exactly
+    # moves that stay in the same cells only change the bounds, others add rows to a small recent table and
+    # leave stale rows behind, rows are checked against the object's version and dropped when the tables merge
+    # objects spanning more than maxCells cells are kept apart and tested by every query
+    def __init__(self, capacity, cellSize=2.0, maxCells=64):
+        self.cellSize = cellSize
+        self.maxCells = maxCells
+        self.mins = np.zeros((capacity, 3), dtype=np.float32)
+        self.maxs = np.zeros((capacity, 3), dtype=np.float32)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.oversized = np.zeros(capacity, dtype=bool)
+        self.version = np.zeros(capacity, dtype=np.int64)
+        self.cellMins = np.zeros((capacity, 3), dtype=np.int64)
+        self.cellMaxs = np.zeros((capacity, 3), dtype=np.int64)
+        self.count = 0
+        # a box around everything ever inserted, rays stop walking cells where they leave it
+        self.worldMin = np.full(3, np.inf, dtype=np.float32)
+        self.worldMax = np.full(3, -np.inf, dtype=np.float32)
+        self.main = PairTable()
+        self.recent = PairTable()
+        self.stats = {"pairs": 0, "stale": 0, "merges": 0, "tested": 0}
+
+    def cellsOf(self, mins, maxs):
+        return (np.floor(mins / self.cellSize).astype(np.int64), np.floor(maxs / self.cellSize).astype(np.int64))
+
+    def add(self, mins, maxs):
+        return self.addMany(np.reshape(mins, (1, 3)), np.reshape(maxs, (1, 3)))
+
+    def addMany(self, mins, maxs):
+        # handles of the new objects are consecutive, the first one is returned
+        first = self.count
+        if first + len(mins) > len(self.mins):
+            raise IndexError(f"spatial hash is full ({len(self.mins)} objects)")
+        self.count += len(mins)
+        handles = np.arange(first, self.count)
+        self.mins[handles] = mins
+        self.maxs[handles] = maxs
+        self.alive[handles] = True
+        self.insert(handles)
+        return first
+
+    def setBounds(self, handles, mins, maxs):
+        # one handle, a slice or an array of them, like BVH.setBounds
+        handles = np.atleast_1d(np.arange(self.count)[handles])
+        self.mins[handles] = mins
+        self.maxs[handles] = maxs
+        cellMins, cellMaxs = self.cellsOf(self.mins[handles], self.maxs[handles])
+        moved = (cellMins != self.cellMins[handles]).any(axis=1) | (cellMaxs != self.cellMaxs[handles]).any(axis=1)
+        # removed objects keep their bounds but stay unlisted
+        moved &= self.alive[handles]
+        if moved.any():
+            self.insert(handles[moved])
+
+    def remove(self, handles):
+        handles = np.atleast_1d(np.arange(self.count)[handles])
+        self.alive[handles] = False
+        self.oversized[handles] = False
+        self.version[handles] += 1
+
+    def insert(self, handles):
+        # (re)lists handles under their current cells, rows for earlier cells go stale
+        self.version[handles] += 1
+        if len(handles):
+            self.worldMin = np.minimum(self.worldMin, self.mins[handles].min(axis=0))
+            self.worldMax = np.maximum(self.worldMax, self.maxs[handles].max(axis=0))
+        cellMins, cellMaxs = self.cellsOf(self.mins[handles], self.maxs[handles])
+        self.cellMins[handles] = cellMins
+        self.cellMaxs[handles] = cellMaxs
+        oversized = (cellMaxs - cellMins + 1).prod(axis=1) > self.maxCells
+        self.oversized[handles] = oversized
+        handles, cellMins, cellMaxs = handles[~oversized], cellMins[~oversized], cellMaxs[~oversized]
+        owners, keys = expandCells(handles, cellMins, cellMaxs)
+        rows = PairTable(np.concatenate((self.recent.keys, keys)), np.concatenate((self.recent.handles, owners)),
+                         np.concatenate((self.recent.versions, self.version[owners])))
+        if len(rows.keys) > max(MIN_MERGE, MERGE_FRACTION * len(self.main.keys)):
+            self.merge(rows)
+        else:
+            self.recent = rows
+        self.stats["pairs"] = len(self.main.keys) + len(self.recent.keys)
+
+    def merge(self, rows):
+        keys = np.concatenate((self.main.keys, rows.keys))
+        handles = np.concatenate((self.main.handles, rows.handles))
+        versions = np.concatenate((self.main.versions, rows.versions))
+        current = versions == self.version[handles]
+        self.stats["stale"] = int((~current).sum())
+        self.main = PairTable(keys[current], handles[current], versions[current])
+        self.recent = PairTable()
+        self.stats["merges"] += 1
+
+    def candidates(self, owners, keys):
+        # (owner, handle) of every live object listed under the keys, duplicates included
+        found = []
+        for table in (self.main, self.recent):
+            pairOwners, rows = table.lookup(owners, keys)
+            handles = table.handles[rows]
+            current = table.versions[rows] == self.version[handles]
+            found.append((pairOwners[current], handles[current]))
+        return np.concatenate([pair[0] for pair in found]), np.concatenate([pair[1] for pair in found])
+
+    def query(self, lows, highs, test):
+        # (query, handle) pairs of the objects test accepts among those in the cells of each query's box,
+        # test(queries, handles) is pairwise, pairs come back sorted by query
+        cellMins, cellMaxs = self.cellsOf(lows, highs)
+        owners, keys = expandCells(np.arange(len(lows)), cellMins, cellMaxs)
+        queries, handles = self.candidates(owners, keys)
+        # an object sharing several cells with a query is found once per cell
+        unique = np.unique(queries * len(self.mins) + handles)
+        queries, handles = unique // len(self.mins), unique % len(self.mins)
+        oversized = np.flatnonzero(self.oversized[:self.count])
+        if len(oversized):
+            queries = np.concatenate((queries, np.repeat(np.arange(len(lows)), len(oversized))))
+            handles = np.concatenate((handles, np.tile(oversized, len(lows))))
+        self.stats["tested"] = len(handles)
+        hit = test(queries, handles)
+        order = np.lexsort((handles[hit], queries[hit]))
+        return queries[hit][order], handles[hit][order]
+
+    def queryBoxes(self, mins, maxs):
+        # (query, handle) for every object overlapping each of the boxes
+        mins = np.asarray(mins, dtype=np.float32).reshape(-1, 3)
+        maxs = np.asarray(maxs, dtype=np.float32).reshape(-1, 3)
+        return self.query(mins, maxs, lambda q, h: boxesOverlap(mins[q], maxs[q], self.mins[h], self.maxs[h]))
+
+    def querySpheres(self, centres, radii):
+        centres = np.asarray(centres, dtype=np.float32).reshape(-1, 3)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float32), len(centres))
+        extents = radii[:, None]
+        return self.query(centres - extents, centres + extents,
+                          lambda q, h: spheresOverlap(centres[q], radii[q], self.mins[h], self.maxs[h]))
+
+    def raycast(self, origins, directions, maxDistance=np.inf):
+        # the nearest object along each ray as (handles, distances), -1 and inf for rays that hit nothing
+        # every ray walks its cells in order (Amanatides and Woo), all rays one cell per step, and stops once
+        # its best hit is no further than the cell's far side
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions, inverse = normalizeRays(directions)
+        limit = np.broadcast_to(np.asarray(maxDistance, dtype=np.float64), len(origins)).copy()
+        entry, exit = rayBoxes(origins, inverse, np.broadcast_to(self.worldMin, origins.shape),
+                               np.broadcast_to(self.worldMax, origins.shape))
+        limit = np.where(entry <= exit, np.minimum(limit, exit), -1)
+        # a ray without a direction hits nothing
+        limit[(directions == 0).all(axis=1)] = -1
+        hits = np.full(len(origins), -1, dtype=np.int64)
+        best = np.full(len(origins), np.inf)
+
+        oversized = np.flatnonzero(self.oversized[:self.count])
+        if len(oversized):
+            rays = np.repeat(np.arange(len(origins)), len(oversized))
+            handles = np.tile(oversized, len(origins))
+            entry, exit = rayBoxes(origins[rays], inverse[rays], self.mins[handles], self.maxs[handles])
+            hit = (entry <= exit) & (entry <= limit[rays])
+            hits, best = nearestPerQuery(rays[hit], handles[hit], entry[hit], len(origins))
+
+        cells = np.floor(origins / self.cellSize).astype(np.int64)
+        step = np.sign(directions).astype(np.int64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = np.where(step != 0, self.cellSize * np.abs(inverse), np.inf)
+            boundary = (cells + (step > 0)) * self.cellSize
+            crossing = np.where(step != 0, (boundary - origins) * inverse, np.inf)
+        active = np.arange(len(origins))
+        tested = 0
+        while len(active):
+            rays, handles = self.candidates(active, packCells(cells[active]))
+            tested += len(handles)
+            entry, exit = rayBoxes(origins[rays], inverse[rays], self.mins[handles], self.maxs[handles])
+            hit = (entry <= exit) & (entry <= limit[rays])
+            nearest, distance = nearestPerQuery(rays[hit], handles[hit], entry[hit], len(origins))
+            closer = (distance < best) | ((distance == best) & (nearest >= 0) & (nearest < hits))
+            hits[closer] = nearest[closer]
+            best[closer] = distance[closer]
+            # a hit inside this cell cannot be beaten by anything in the cells after it
+            far = crossing[active].min(axis=1)
+            going = (best[active] > far) & (far <= limit[active])
+            active = active[going]
+            axis = np.argmin(crossing[active], axis=1)
+            cells[active, axis] += step[active, axis]
+            crossing[active, axis] += delta[active, axis]
+        self.stats["tested"] = tested
+        return hits, best
+
+
+def createIndex(backend, capacity, cellSize=2.0):
+    # "grid" for a SpatialHash or "bvh" for the culling BVH, both take the same calls
+    if backend == "grid":
+        return SpatialHash(capacity, cellSize)
+    if backend == "bvh":
+        return BVH(capacity)
+    raise ValueError(f"unknown spatial index backend {backend}")
+
+
+def pushOut(index, position, radius, iterations=4, axes=(0, 1, 2)):
+    # moves a sphere out of the boxes it overlaps, along the shortest way out of the deepest one each time,
+    # only along axes, so something walking at a fixed height is pushed sideways, returns the handles it touched
+    fixed = np.setdiff1d(np.arange(3), axes)
+    touched = []
+    for _ in range(iterations):
+        _, handles = index.querySpheres(position[None], radius)
+        if len(handles) == 0:
+            break
+        touched.append(handles)
+        mins, maxs = index.mins[handles], index.maxs[handles]
+        closest = np.clip(position, mins, maxs)
+        offsets = position - closest
+        offsets[:, fixed] = 0
+        distances = np.linalg.norm(offsets, axis=1)
+        deepest = int(np.argmin(distances))
+        if distances[deepest] > 0:
+            position += offsets[deepest] / distances[deepest] * (radius - distances[deepest])
+        else:
+            # the centre is inside the box, leave through the nearest face
+            exits = np.concatenate((position - mins[deepest], maxs[deepest] - position))
+            exits[np.concatenate((fixed, fixed + 3))] = np.inf
+            face = int(np.argmin(exits))
+            position[face % 3] += (exits[face] + radius) * (1 if face >= 3 else -1)
+    return np.unique(np.concatenate(touched)) if touched else np.zeros(0, dtype=np.int64)
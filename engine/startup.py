@@ -0,0 +1,68 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# like engine.headless this has to be importable before OpenGL.GL, so it must not import it
+
+
+def configureOpenGL(fast=True):
+    # PyOpenGL reads these when it builds its wrappers, so they only apply before the first import of OpenGL.GL,
+    # returns whether they did, fast turns off glGetError after every call and error logging, and makes
+    # arrays that would have to be converted or copied an error instead of a silent per-call cost
+    import OpenGL
+    if "OpenGL.GL" in sys.modules:
+        return False
+    if fast and os.environ.get("PYOPENGL_PLATFORM") == "egl":
+        # PyOpenGL's EGL bindings only work when built with checking on, they don't import OpenGL.GL so they
+        # can be built first
+        import OpenGL.EGL
+    OpenGL.ERROR_CHECKING = not fast
+    OpenGL.ERROR_LOGGING = not fast
+    OpenGL.ERROR_ON_COPY = fast
+    return True
+
+
+class StartupProfile:
+    # milliseconds spent in each named phase of startup, phases can repeat and add up, marks are the time since
+    # the profile was created, which is as early as the lab can import this module
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.marks = {}
+        self.open = {}
+
+    def begin(self, name):
+        self.open[name] = time.perf_counter()
+
+    def end(self, name):
+        self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - self.open.pop(name)) * 1000
+
+    @contextmanager
+    def phase(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def mark(self, name):
+        # only the first mark of a name counts
+        self.marks.setdefault(name, (time.perf_counter() - self.start) * 1000)
+
+    def report(self):
+        return {"phases": dict(self.phases), "marks": dict(self.marks)}
+
+    def describe(self):
+        phases = ", ".join(f"{name} {ms:.1f} ms" for name, ms in self.phases.items())
+        marks = ", ".join(f"{name} at {ms:.1f} ms" for name, ms in self.marks.items())
+        return f"startup: {phases}; {marks}"
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+
+
+# one profile per process, started by the first import
+startup = StartupProfile()
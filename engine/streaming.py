@@ -0,0 +1,136 @@
+import ctypes
+import time
+
+from OpenGL.GL import *
+import numpy as np
+
+from engine.resources import resources
+
+REGIONS = 3
+
+
+class BufferRing:
+    # one buffer split into regions handed out in turn, a region is only handed out again once the fence of the
+    # frame that read it passed. with glBufferStorage the whole buffer stays mapped and mapped holds its bytes,
+    # without it mapped is None and the owner uploads into the region at offset with glBufferSubData
+    def __init__(self, target, buffer, stride, regions=REGIONS, persistent=True, usage=GL_STREAM_DRAW):
+        self.target = target
+        self.buffer = buffer
+        self.stride = stride
+        self.regions = regions
+        self.persistent = persistent and bool(glBufferStorage)
+        glBindBuffer(target, buffer)
+        if self.persistent:
+            flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+            resources.bufferStorage(target, buffer, regions * stride, None, flags)
+            pointer = glMapBufferRange(target, 0, regions * stride, flags)
+            self.mapped = np.ctypeslib.as_array(ctypes.cast(pointer, ctypes.POINTER(ctypes.c_ubyte)),
+                                                shape=(regions * stride,))
+        else:
+            resources.bufferData(target, buffer, regions * stride, None, usage)
+            self.mapped = None
+        glBindBuffer(target, 0)
+        self.fences = [None] * regions
+        self.region = regions - 1
+        self.stats = {"stalls": 0, "waitMs": 0.0}
+
+    def view(self, region, dtype, count):
+        # count elements of dtype at the start of a region of the mapping, written in place
+        return np.ndarray(count, dtype, self.mapped, region * self.stride)
+
+    @property
+    def offset(self):
+        return self.region * self.stride
+
+    def advance(self):
+        # the next region, once the GPU is done reading it
+        self.region = (self.region + 1) % self.regions
+        fence = self.fences[self.region]
+        self.stats["waitMs"] = 0.0
+        if fence is not None:
+            result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 0)
+            if result == GL_TIMEOUT_EXPIRED:
+                self.stats["stalls"] += 1
+                start = time.perf_counter()
+                while result == GL_TIMEOUT_EXPIRED:
+                    result = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1_000_000_000)
+                self.stats["waitMs"] = (time.perf_counter() - start) * 1000
+            if result == GL_WAIT_FAILED:
+                raise RuntimeError("glClientWaitSync failed on a buffer ring fence")
+            glDeleteSync(fence)
+            self.fences[self.region] = None
+        return self.region
+
+    def fence(self):
+        # after the commands that read the current region were issued
+        if self.persistent:
+            self.fences[self.region] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+    def destroy(self):
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * self.regions
+        if self.persistent and self.mapped is not None:
+            glBindBuffer(self.target, self.buffer)
+            glUnmapBuffer(self.target)
+            glBindBuffer(self.target, 0)
+        self.mapped = None
+
+
+class StreamBuffer:
+    # a vertex buffer rewritten every frame through a BufferRing, so the CPU fills one region while the GPU may
+    # still draw from the others. persistently mapped storage gives each region as a numpy view of the buffer
+    # itself, so vertices are written in place, without glBufferStorage the views are plain arrays uploaded
+    # with glBufferSubData by end()
+    # dtype is one vertex, e.g. np.dtype((np.float32, 4)), capacity the vertices per region
+    def __init__(self, capacity, dtype, regions=REGIONS, persistent=True, label="stream"):
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.regions = regions
+        self.stride = capacity * self.dtype.itemsize
+        self.vbo = resources.genBuffers(1, label)
+        self.ring = BufferRing(GL_ARRAY_BUFFER, self.vbo, self.stride, regions, persistent)
+        self.persistent = self.ring.persistent
+        if self.persistent:
+            self.views = [self.ring.view(i, self.dtype, capacity) for i in range(regions)]
+        else:
+            self.views = [np.zeros(capacity, dtype=self.dtype) for _ in range(regions)]
+        self.count = 0
+        self.stats = {"frames": 0, "stalls": 0, "waitMs": 0.0, "bytes": 0}
+
+    @property
+    def region(self):
+        return self.ring.region
+
+    def begin(self):
+        # the next region's view to write this frame's vertices into, waits if the GPU still reads it
+        region = self.ring.advance()
+        self.stats["stalls"] = self.ring.stats["stalls"]
+        self.stats["waitMs"] = self.ring.stats["waitMs"]
+        return self.views[region]
+
+    def end(self, count):
+        # count vertices of the region were written, draw them starting at first
+        self.count = count
+        self.stats["frames"] += 1
+        self.stats["bytes"] = count * self.dtype.itemsize
+        if not self.persistent:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferSubData(GL_ARRAY_BUFFER, self.ring.offset, count * self.dtype.itemsize,
+                            self.views[self.region][:count])
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    @property
+    def first(self):
+        # the region's first vertex, for glDrawArrays with attribute pointers at offset 0
+        return self.region * self.capacity
+
+    def fence(self):
+        # after the draws that read the region were issued
+        self.ring.fence()
+
+    def destroy(self):
+        self.views = None
+        self.ring.destroy()
+        resources.deleteBuffers(self.vbo)
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pygame as pg
+
+CACHE_VERSION = b"1"
+
+
+def buildMipChain(image):
+    # 2x2 box filter down to 1x1, odd edges are repeated before averaging
+    levels = [image]
+    while levels[-1].shape[0] > 1 or levels[-1].shape[1] > 1:
+        level = levels[-1].astype(np.float32)
+        height, width = level.shape[:2]
+        level = np.pad(level, ((0, height % 2), (0, width % 2), (0, 0)), mode="edge")
+        level = (level[0::2, 0::2] + level[1::2, 0::2] + level[0::2, 1::2] + level[1::2, 1::2]) * 0.25
+        levels.append((level + 0.5).astype(np.uint8))
+    return levels
+
+
+def decodeImage(path):
+    # the pixels are read through views of the surface, the only copy is into the array the mip chain starts from
+    image = pg.image.load(path)
+    if image.get_bytesize() < 3:
+        # pygame only has pixel views of 24 and 32 bit surfaces
+        converted = pg.Surface(image.get_size(), pg.SRCALPHA, 32)
+        converted.blit(image, (0, 0))
+        image = converted
+    width, height = image.get_size()
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    # surfarray is indexed x, y
+    pixels[:, :, :3] = pg.surfarray.pixels3d(image).transpose(1, 0, 2)
+    if image.get_flags() & pg.SRCALPHA:
+        pixels[:, :, 3] = pg.surfarray.pixels_alpha(image).T
+    else:
+        pixels[:, :, 3] = 255
+    return pixels
+
+
+def loadMipChain(path, cacheDir):
+    # decoded mip chains live in one raw .npy per image, memory mapped on later runs
+    with open(path, "rb") as f:
+        key = hashlib.sha1(CACHE_VERSION + f.read()).hexdigest()
+    pixelsName = os.path.join(cacheDir, f"{key}_pixels.npy")
+    shapesName = os.path.join(cacheDir, f"{key}_shapes.npy")
+    if os.path.exists(pixelsName) and os.path.exists(shapesName):
+        pixels = np.load(pixelsName, mmap_mode="r")
+        shapes = np.load(shapesName)
+        hit = True
+    else:
+        levels = buildMipChain(decodeImage(path))
+        pixels = np.concatenate([level.reshape(-1) for level in levels])
+        shapes = np.array([level.shape[:2] for level in levels], dtype=np.int64)
+        os.makedirs(cacheDir, exist_ok=True)
+        for name, array in ((pixelsName, pixels), (shapesName, shapes)):
+            temporary = f"{name}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                np.save(f, array)
+            os.replace(temporary, name)
+        hit = False
+
+    levels = []
+    offset = 0
+    for height, width in shapes:
+        size = int(height * width * 4)
+        levels.append(pixels[offset:offset + size])
+        offset += size
+    return levels, shapes, hit
+
+
+class TextureManager:
+    # decodes images into RGBA mip chains on a thread pool, through an on-disk cache that skips the decode on
+    # later runs, whoever owns the GL texture uploads the levels, see engine.materials.MaterialLibrary
+    def __init__(self, workers=4, cacheDir=".cache/textures"):
+        self.cacheDir = cacheDir
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.stats = {"decodeMs": 0.0, "cacheHits": 0, "decoded": 0}
+
+    def decode(self, path):
+        # a future of the image, hand it to levels() once it is done
+        return self.pool.submit(self.loadTimed, path)
+
+    def loadTimed(self, path):
+        start = time.perf_counter()
+        result = loadMipChain(path, self.cacheDir)
+        return result, (time.perf_counter() - start) * 1000
+
+    def levels(self, future):
+        # the mip chain of a decode(), largest level first as (height, width, 4) arrays, blocks until it is done
+        (levels, shapes, hit), decodeMs = future.result()
+        self.stats["decodeMs"] += decodeMs
+        self.stats["cacheHits" if hit else "decoded"] += 1
+        return [np.asarray(pixels).reshape(int(height), int(width), 4)
+                for (height, width), pixels in zip(shapes, levels)]
+
+    def destroy(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
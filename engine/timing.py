@@ -0,0 +1,113 @@
+import time
+
+import numpy as np
+
+# what one frame spent where, kept for the last FrameTimings.size frames
+TIMING_DTYPE = np.dtype([("frameMs", np.float64), ("workMs", np.float64), ("waitMs", np.float64),
+                         ("steps", np.int32), ("alpha", np.float32)])
+
+
+class FixedStep:
+    # runs the simulation in steps of exactly dt seconds however long frames take, what is left over is
+    # returned as alpha so rendering can blend the last two states instead of showing a stale one
+    def __init__(self, rate=120, maxSteps=8):
+        self.dt = 1.0 / rate
+        # a long stall (window drag, breakpoint) is dropped instead of replayed as hundreds of steps
+        self.maxSteps = maxSteps
+        self.accumulator = 0.0
+        self.time = 0.0
+        self.steps = 0
+
+    def advance(self, elapsed, step):
+        self.accumulator += min(elapsed, self.dt * self.maxSteps)
+        steps = 0
+        while self.accumulator >= self.dt:
+            step(self.dt)
+            self.accumulator -= self.dt
+            self.time += self.dt
+            steps += 1
+        self.steps = steps
+        return self.accumulator / self.dt
+
+
+class FramePacer:
+    # holds frames to 1 / targetFps, sleeps through most of the wait and spins only for the last spinMs
+    # where the OS scheduler is too coarse, targetFps None never waits
+    def __init__(self, targetFps=None, spinMs=1.5):
+        self.spin = spinMs / 1000
+        self.setTarget(targetFps)
+
+    def setTarget(self, targetFps):
+        self.period = 1.0 / targetFps if targetFps else 0.0
+        self.deadline = None
+
+    def wait(self):
+        now = time.perf_counter()
+        if self.period == 0:
+            return now
+        if self.deadline is None or now - self.deadline > self.period:
+            # first frame, or so far behind that catching up would mean a burst of unpaced frames
+            self.deadline = now
+        remaining = self.deadline - now - self.spin
+        if remaining > 0:
+            time.sleep(remaining)
+        while time.perf_counter() < self.deadline:
+            pass
+        now = time.perf_counter()
+        self.deadline += self.period
+        return now
+
+
+class FrameTimings:
+    def __init__(self, size=240):
+        self.size = size
+        self.records = np.zeros(size, dtype=TIMING_DTYPE)
+        self.count = 0
+
+    def record(self, frameMs, workMs, waitMs, steps, alpha):
+        self.records[self.count % self.size] = (frameMs, workMs, waitMs, steps, alpha)
+        self.count += 1
+
+    def last(self):
+        return self.records[(self.count - 1) % self.size] if self.count else None
+
+    def stats(self):
+        records = self.records[:min(self.count, self.size)]
+        if len(records) == 0:
+            return {"fps": 0.0, "frameMs": 0.0, "p99Ms": 0.0, "workMs": 0.0, "busy": 0.0}
+        frameMs = records["frameMs"]
+        total = frameMs.sum()
+        return {"fps": float(1000.0 * len(records) / total) if total > 0 else 0.0,
+                "frameMs": float(frameMs.mean()), "p99Ms": float(np.percentile(frameMs, 99)),
+                "workMs": float(records["workMs"].mean()),
+                # share of the frame spent working rather than sleeping or spinning in the pacer
+                "busy": float(records["workMs"].sum() / total) if total > 0 else 0.0}
+
+
+class Scheduler:
+    # per frame: beginFrame() -> real seconds since the last frame, update(step) -> interpolation alpha,
+    # endFrame() waits for the pacer and records the frame's timing
+    def __init__(self, stepRate=120, targetFps=None, spinMs=1.5, history=240):
+        self.fixed = FixedStep(stepRate)
+        self.pacer = FramePacer(targetFps, spinMs)
+        self.timings = FrameTimings(history)
+        self.frameStart = None
+        self.elapsed = 0.0
+        self.alpha = 1.0
+
+    def beginFrame(self):
+        now = time.perf_counter()
+        self.elapsed = 0.0 if self.frameStart is None else now - self.frameStart
+        self.frameStart = now
+        return self.elapsed
+
+    def update(self, step):
+        self.alpha = self.fixed.advance(self.elapsed, step)
+        return self.alpha
+
+    def endFrame(self):
+        workEnd = time.perf_counter()
+        end = self.pacer.wait()
+        # this frame's own start to end, elapsed is the gap from the previous frame's start
+        self.timings.record((end - self.frameStart) * 1000, (workEnd - self.frameStart) * 1000,
+                            (end - workEnd) * 1000, self.fixed.steps, self.alpha)
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def composeMatrices(positions, rotations, scales, m):
+    # writes pyrr style scale * rotation * translation matrices into the (N, 4, 4) m, rotations are normalized here
+    q = rotations / np.linalg.norm(rotations, axis=1, keepdims=True)
+    x, y, z, w = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    s = scales
+
+    m[:, 0, 0] = (1 - 2 * (y * y + z * z)) * s[:, 0]
+    m[:, 0, 1] = 2 * (x * y - z * w) * s[:, 0]
+    m[:, 0, 2] = 2 * (x * z + y * w) * s[:, 0]
+    m[:, 1, 0] = 2 * (x * y + z * w) * s[:, 1]
+    m[:, 1, 1] = (1 - 2 * (x * x + z * z)) * s[:, 1]
+    m[:, 1, 2] = 2 * (y * z - x * w) * s[:, 1]
+    m[:, 2, 0] = 2 * (x * z - y * w) * s[:, 2]
+    m[:, 2, 1] = 2 * (y * z + x * w) * s[:, 2]
+    m[:, 2, 2] = (1 - 2 * (x * x + y * y)) * s[:, 2]
+    m[:, 0:3, 3] = 0
+    m[:, 3, 0:3] = positions
+    m[:, 3, 3] = 1
+
+
+class TransformStore:
+    # structure of arrays for every object's position, rotation (x, y, z, w quaternion) and scale,
+    # model matrices are rebuilt in one vectorized pass, matching pyrr's scale * rotation * translation
+    def __init__(self, capacity):
+        self.positions = np.zeros((capacity, 3), dtype=np.float32)
+        self.rotations = np.zeros((capacity, 4), dtype=np.float32)
+        self.rotations[:, 3] = 1
+        self.scales = np.ones((capacity, 3), dtype=np.float32)
+        self.matrices = np.zeros((capacity, 4, 4), dtype=np.float32)
+        self.matrices[:] = np.identity(4, dtype=np.float32)
+        self.dirty = np.zeros(capacity, dtype=bool)
+        self.count = 0
+
+    def add(self, position, rotation=(0, 0, 0, 1), scale=(1, 1, 1)):
+        if self.count == len(self.positions):
+            raise IndexError(f"transform store is full ({len(self.positions)} objects)")
+        index = self.count
+        self.count += 1
+        self.positions[index] = position
+        self.rotations[index] = rotation
+        self.scales[index] = scale
+        self.dirty[index] = True
+        return index
+
+    def setPosition(self, index, position):
+        self.positions[index] = position
+        self.dirty[index] = True
+
+    def setRotation(self, index, rotation):
+        self.rotations[index] = rotation
+        self.dirty[index] = True
+
+    def setScale(self, index, scale):
+        self.scales[index] = scale
+        self.dirty[index] = True
+
+    def update(self):
+        indices = np.flatnonzero(self.dirty[:self.count])
+        updated = len(indices)
+        if updated == 0:
+            return 0
+        if updated == self.count:
+            # everything moved, write straight into the preallocated matrices
+            indices = slice(0, self.count)
+            m = self.matrices[indices]
+        else:
+            m = np.empty((updated, 4, 4), dtype=np.float32)
+        composeMatrices(self.positions[indices], self.rotations[indices], self.scales[indices], m)
+        if updated != self.count:
+            self.matrices[indices] = m
+        self.dirty[indices] = False
+        return updated
@@ -0,0 +1,99 @@
+from OpenGL.GL import *
+import numpy as np
+
+from engine.gl_state import state
+from engine.resources import resources
+
+
+class ShaderProgram:
+    def __init__(self, program):
+        self.program = program
+        self.locations = {}
+        self.values = {}
+        # counters for the frame in progress and the last finished frame
+        self.stats = {"lookups": 0, "uploads": 0, "skipped": 0}
+        self.lastFrame = dict(self.stats)
+        self.queryUniforms()
+
+    def queryUniforms(self):
+        # one pass over the active uniforms at link time, nothing is looked up per frame afterwards
+        count = glGetProgramiv(self.program, GL_ACTIVE_UNIFORMS)
+        for i in range(count):
+            name, size, kind = glGetActiveUniform(self.program, i)
+            name = name.decode() if isinstance(name, bytes) else str(name)
+            if name.endswith("[0]"):
+                base = name[:-3]
+                self.locations[base] = glGetUniformLocation(self.program, name)
+                for element in range(size):
+                    elementName = f"{base}[{element}]"
+                    self.locations[elementName] = glGetUniformLocation(self.program, elementName)
+            else:
+                self.locations[name] = glGetUniformLocation(self.program, name)
+
+    def location(self, name):
+        location = self.locations.get(name)
+        if location is None:
+            # unknown name (inactive or misspelled), remember the answer so it is only asked once
+            self.stats["lookups"] += 1
+            location = glGetUniformLocation(self.program, name)
+            self.locations[name] = location
+        return location
+
+    def changed(self, name, value):
+        if self.values.get(name) == value:
+            self.stats["skipped"] += 1
+            return False
+        self.values[name] = value
+        self.stats["uploads"] += 1
+        return True
+
+    def setMat4(self, name, value):
+        value = np.ascontiguousarray(value, dtype=np.float32)
+        location = self.location(name)
+        if location != -1 and self.changed(name, value.tobytes()):
+            glProgramUniformMatrix4fv(self.program, location, 1, GL_FALSE, value)
+
+    def setVec3(self, name, value):
+        value = np.ascontiguousarray(value, dtype=np.float32)
+        location = self.location(name)
+        if location != -1 and self.changed(name, value.tobytes()):
+            glProgramUniform3fv(self.program, location, 1, value)
+
+    def setVec2(self, name, value):
+        value = np.ascontiguousarray(value, dtype=np.float32)
+        location = self.location(name)
+        if location != -1 and self.changed(name, value.tobytes()):
+            glProgramUniform2fv(self.program, location, 1, value)
+
+    def setUVec3(self, name, value):
+        value = tuple(int(v) for v in value)
+        location = self.location(name)
+        if location != -1 and self.changed(name, value):
+            glProgramUniform3ui(self.program, location, *value)
+
+    def setFloat(self, name, value):
+        value = float(value)
+        location = self.location(name)
+        if location != -1 and self.changed(name, value):
+            glProgramUniform1f(self.program, location, value)
+
+    def setInt(self, name, value):
+        value = int(value)
+        location = self.location(name)
+        if location != -1 and self.changed(name, value):
+            glProgramUniform1i(self.program, location, value)
+
+    def setBool(self, name, value):
+        self.setInt(name, 1 if value else 0)
+
+    def use(self):
+        state.useProgram(self.program)
+
+    def beginFrame(self):
+        self.lastFrame = dict(self.stats)
+        for key in self.stats:
+            self.stats[key] = 0
+
+    def destroy(self):
+        state.forgetProgram(self.program)
+        resources.deleteProgram(self.program)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import engine the way the labs do, from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+# RangeAllocator on its own, plain python, no GL
+import pytest
+
+from engine.allocator import RangeAllocator
+
+
+def testAllocateFirstFit():
+    allocator = RangeAllocator(100)
+    first, second, third = allocator.allocate(10), allocator.allocate(20), allocator.allocate(30)
+    assert [allocator.offset(handle) for handle in (first, second, third)] == [0, 10, 30]
+    assert allocator.size(second) == 20
+    assert allocator.free == [(60, 40)]
+    assert allocator.used() == 60
+    allocator.release(first)
+    # the hole at the front is the first run big enough
+    assert allocator.offset(allocator.allocate(5)) == 0
+    assert allocator.offset(allocator.allocate(10)) == 60
+
+
+def testReleaseCoalesces():
+    allocator = RangeAllocator(40)
+    handles = [allocator.allocate(10) for _ in range(4)]
+    allocator.release(handles[0])
+    allocator.release(handles[2])
+    assert allocator.free == [(0, 10), (20, 10)]
+    assert allocator.fragmentation() == pytest.approx(0.5)
+    # joins the runs before and after it into one
+    allocator.release(handles[1])
+    assert allocator.free == [(0, 30)]
+    assert allocator.fragmentation() == 0.0
+    allocator.release(handles[3])
+    assert allocator.free == [(0, 40)]
+    assert allocator.used() == 0
+
+
+def testAllocateFailures():
+    allocator = RangeAllocator(20)
+    with pytest.raises(ValueError):
+        allocator.allocate(0)
+    handles = [allocator.allocate(5) for _ in range(4)]
+    allocator.release(handles[0])
+    allocator.release(handles[2])
+    # 10 free in total but no run of 10
+    assert allocator.freeSpace() == 10
+    assert allocator.largestFree() == 5
+    with pytest.raises(IndexError):
+        allocator.allocate(10)
+
+
+def testGrow():
+    allocator = RangeAllocator(10)
+    allocator.allocate(6)
+    allocator.grow(20)
+    # the added space extends the trailing free run
+    assert allocator.free == [(6, 14)]
+    assert allocator.offset(allocator.allocate(14)) == 6
+    allocator.grow(30)
+    assert allocator.free == [(20, 10)]
+    allocator.grow(30)
+    assert allocator.free == [(20, 10)]
+    with pytest.raises(ValueError):
+        allocator.grow(10)
+
+
+def testCompactKeepsHandles():
+    allocator = RangeAllocator(50)
+    handles = [allocator.allocate(size) for size in (5, 10, 5, 10, 5)]
+    allocator.release(handles[0])
+    allocator.release(handles[2])
+    moves = allocator.compact()
+    assert moves == [(handles[1], 5, 0, 10), (handles[3], 20, 10, 10), (handles[4], 30, 20, 5)]
+    # every move is downwards and in order
+    assert all(new < old for _, old, new, _ in moves)
+    assert [allocator.offset(handle) for handle in handles[1::2] + handles[4:]] == [0, 10, 20]
+    assert allocator.free == [(25, 25)]
+    assert allocator.compact() == []
@@ -0,0 +1,172 @@
+# GeometryArena over a fake GL that keeps every buffer as a numpy byte array, so compaction and growth can be
+# checked against the bytes the table rows point at
+import numpy as np
+import pytest
+
+import engine.arena
+import engine.gl_state
+import engine.resources
+from engine.arena import GeometryArena
+from engine.gl_state import state
+from engine.meshes import Mesh
+from engine.resources import resources
+
+
+class FakeGL:
+    def __init__(self):
+        self.buffers = {}
+        self.bound = {}
+        self.nextName = 1
+        self.allocations = {}
+        self.draws = []
+
+    def genNames(self, count):
+        names = list(range(self.nextName, self.nextName + count))
+        self.nextName += count
+        return names[0] if count == 1 else names
+
+    def bindBuffer(self, target, buffer):
+        self.bound[target] = buffer
+
+    def bufferData(self, target, size, data, usage):
+        buffer = self.bound[target]
+        self.buffers[buffer] = np.zeros(size, dtype=np.uint8)
+        self.allocations[buffer] = self.allocations.get(buffer, 0) + 1
+        if data is not None:
+            self.bufferSubData(target, 0, size, data)
+
+    def bufferSubData(self, target, offset, size, data):
+        self.buffers[self.bound[target]][offset:offset + size] = np.ascontiguousarray(data).view(np.uint8).ravel()
+
+    def copyBufferSubData(self, readTarget, writeTarget, readOffset, writeOffset, size):
+        source = self.buffers[self.bound[readTarget]][readOffset:readOffset + size].copy()
+        self.buffers[self.bound[writeTarget]][writeOffset:writeOffset + size] = source
+
+    def deleteBuffers(self, count, buffers):
+        for buffer in buffers:
+            self.buffers.pop(int(buffer), None)
+
+    def multiDrawElementsIndirect(self, mode, kind, offset, count, stride):
+        indirect = self.buffers[self.bound[engine.arena.GL_DRAW_INDIRECT_BUFFER]]
+        self.draws.append(indirect.view(np.uint32)[:count * engine.arena.COMMAND_WIDTH].reshape(count, -1).copy())
+
+    def read(self, buffer, offset, count, dtype):
+        return self.buffers[buffer][offset:].view(dtype)[:count]
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    fake = FakeGL()
+    monkeypatch.setattr(engine.resources, "glGenBuffers", fake.genNames)
+    monkeypatch.setattr(engine.resources, "glGenVertexArrays", fake.genNames)
+    monkeypatch.setattr(engine.resources, "glBufferData", fake.bufferData)
+    monkeypatch.setattr(engine.resources, "glDeleteBuffers", fake.deleteBuffers)
+    monkeypatch.setattr(engine.resources, "glDeleteVertexArrays", lambda *arguments: None)
+    monkeypatch.setattr(engine.arena, "glBindBuffer", fake.bindBuffer)
+    monkeypatch.setattr(engine.arena, "glBufferSubData", fake.bufferSubData)
+    monkeypatch.setattr(engine.arena, "glCopyBufferSubData", fake.copyBufferSubData)
+    monkeypatch.setattr(engine.arena, "glMultiDrawElementsIndirect", fake.multiDrawElementsIndirect)
+    for name in ("glBindVertexBuffer", "glEnableVertexAttribArray", "glVertexAttribFormat", "glVertexAttribBinding"):
+        monkeypatch.setattr(engine.arena, name, lambda *arguments: None)
+    monkeypatch.setattr(engine.gl_state, "glBindVertexArray", lambda *arguments: None)
+    state.reset()
+    live = set(resources.live)
+    yield fake
+    # whatever the test created, scratch buffers included, was deleted again
+    assert set(resources.live) == live
+    state.reset()
+
+
+def makeMesh(key, vertexCount, indexCount):
+    # every value tells which mesh it came from
+    vertices = (key * 1000 + np.arange(vertexCount * 6, dtype=np.float32)).reshape(vertexCount, 6)
+    indices = (key * 1000 + np.arange(indexCount)).astype(np.uint32)
+    return Mesh(vertices, indices, None, "pos_colour")
+
+
+def checkTable(gl, arena, meshes):
+    for handle, mesh in meshes.items():
+        count, firstIndex, baseVertex = arena.table[handle]
+        assert count == len(mesh.indices)
+        np.testing.assert_array_equal(gl.read(arena.ebo, firstIndex * 4, count, np.uint32), mesh.indices)
+        vertices = gl.read(arena.vbo, baseVertex * arena.stride, mesh.vertices.size, np.float32)
+        np.testing.assert_array_equal(vertices, mesh.vertices.ravel())
+
+
+def testAddAndRemove(gl):
+    arena = GeometryArena("pos_colour", vertexCapacity=64, indexCapacity=64)
+    meshes = {arena.add(mesh): mesh for mesh in (makeMesh(key, 4, 6) for key in range(3))}
+    checkTable(gl, arena, meshes)
+    arena.remove(1)
+    del meshes[1]
+    assert list(arena.table[1]) == [0, 0, 0]
+    # the freed ranges are reused by the next mesh
+    mesh = makeMesh(3, 4, 6)
+    handle = arena.add(mesh)
+    meshes[handle] = mesh
+    assert arena.table[handle][2] == 4
+    checkTable(gl, arena, meshes)
+    assert arena.stats == {"compactions": 0, "grown": 0}
+    arena.destroy()
+
+
+def testCompactionKeepsHandles(gl):
+    arena = GeometryArena("pos_colour", vertexCapacity=16, indexCapacity=64)
+    meshes = {arena.add(mesh): mesh for mesh in (makeMesh(key, 4, 6) for key in range(4))}
+    arena.remove(0)
+    arena.remove(2)
+    for handle in (0, 2):
+        del meshes[handle]
+    vbo = arena.vbo
+    # 8 vertices free, but in two runs of 4
+    mesh = makeMesh(4, 8, 12)
+    handle = arena.add(mesh)
+    meshes[handle] = mesh
+    assert arena.stats == {"compactions": 1, "grown": 0}
+    assert arena.vbo == vbo
+    assert sorted(meshes) == [1, 3, 4]
+    assert [arena.table[handle][2] for handle in (1, 3, 4)] == [0, 4, 8]
+    checkTable(gl, arena, meshes)
+    arena.destroy()
+
+
+def testGrowKeepsData(gl):
+    arena = GeometryArena("pos_colour", vertexCapacity=8, indexCapacity=8)
+    meshes = {arena.add(mesh): mesh for mesh in (makeMesh(key, 4, 6) for key in range(3))}
+    # indices grow twice, vertices once
+    assert arena.stats["grown"] == 3
+    assert arena.vertices.capacity == 16
+    assert arena.indices.capacity == 32
+    assert len(gl.buffers[arena.vbo]) == 16 * arena.stride
+    checkTable(gl, arena, meshes)
+    arena.destroy()
+
+
+def testIndirectBufferOnlyGrows(gl):
+    arena = GeometryArena("pos_colour", vertexCapacity=64, indexCapacity=64)
+    for key in range(4):
+        arena.add(makeMesh(key, 4, 6))
+    for handles in ([0], [0, 1], [2], [0, 1, 2, 3], [1, 3], [3, 2, 1]):
+        arena.draw(engine.arena.GL_TRIANGLES, handles)
+        np.testing.assert_array_equal(gl.draws[-1], arena.commands(handles))
+    # one command, then two, then four, shorter lists are written into what is there
+    assert gl.allocations[arena.indirect] == 3
+    assert arena.indirectCapacity == 4 * engine.arena.COMMAND_WIDTH * 4
+    arena.destroy()
+
+
+def testCompactArenaRejectsMeshesOutsideItsBox(gl):
+    def flatMesh(lo, hi):
+        vertices = np.zeros((8, 6), dtype=np.float32)
+        vertices[:, :3] = [[(hi if (i >> axis) & 1 else lo)[axis] for axis in range(3)] for i in range(8)]
+        return Mesh(vertices, np.arange(6, dtype=np.uint32), None, "pos_colour")
+
+    first = flatMesh((0, 0, 0), (1, 1, 1))
+    arena = GeometryArena("pos_compact", vertexCapacity=64, indexCapacity=64, positionBounds=first.bounds())
+    arena.add(first)
+    arena.add(flatMesh((0.25, 0, 0), (0.75, 1, 1)))
+    # one decode box for the whole arena, a mesh past it cannot be stored
+    with pytest.raises(ValueError):
+        arena.add(flatMesh((0, 0, 0), (1, 1, 1.5)))
+    assert arena.vertices.used() == 16
+    arena.destroy()
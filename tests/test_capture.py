@@ -0,0 +1,178 @@
+# FrameCapture over a fake GL whose pixel pack buffers are host memory and whose fences signal when the test says
+# so, with a writer that keeps what it was given, can hold the encoder up and can fail
+import ctypes
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import engine.capture
+import engine.resources
+from engine.capture import FrameCapture
+from engine.resources import resources
+
+WIDTH, HEIGHT = 4, 2
+
+
+class FakeGL:
+    def __init__(self):
+        self.nextName = 1000
+        self.memory = {}
+        self.bound = 0
+        self.fences = {}
+        self.frames = 0
+        self.busy = False
+        self.waits = []
+
+    def genBuffers(self, count):
+        self.nextName += count
+        return list(range(self.nextName - count, self.nextName))
+
+    def bufferData(self, target, buffer, size, data, usage):
+        self.memory[buffer] = ctypes.create_string_buffer(size)
+
+    def bindBuffer(self, target, buffer):
+        self.bound = buffer
+
+    def readPixels(self, x, y, width, height, format, kind, offset):
+        # every pixel of the nth frame read is n
+        ctypes.memset(self.memory[self.bound], self.frames, width * height * 4)
+        self.frames += 1
+
+    def fenceSync(self, condition, flags):
+        fence = len(self.fences) + 1
+        self.fences[fence] = "busy" if self.busy else "signalled"
+        return fence
+
+    def clientWaitSync(self, fence, flags, timeout):
+        # a busy fence is still running when polled and finishes when waited on, a failing one never does
+        self.waits.append(timeout)
+        status = self.fences[fence]
+        if status == "failing":
+            return engine.capture.GL_WAIT_FAILED
+        if status == "busy" and timeout == 0:
+            return engine.capture.GL_TIMEOUT_EXPIRED
+        return engine.capture.GL_CONDITION_SATISFIED
+
+    def deleteSync(self, fence):
+        self.fences[fence] = "deleted"
+
+    def mapBufferRange(self, target, offset, size, access):
+        return ctypes.addressof(self.memory[self.bound])
+
+
+class FakeWriter:
+    def __init__(self, failAt=None):
+        self.frames = []
+        self.failAt = failAt
+        self.release = threading.Event()
+        self.release.set()
+        self.closed = False
+
+    def write(self, index, pixels):
+        self.release.wait()
+        if index == self.failAt:
+            raise OSError(f"disk full at frame {index}")
+        self.frames.append((index, int(pixels[0, 0, 0]), pixels.shape))
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    fake = FakeGL()
+    monkeypatch.setattr(engine.resources, "glGenBuffers", fake.genBuffers)
+    monkeypatch.setattr(engine.resources, "glDeleteBuffers", lambda *arguments: None)
+    monkeypatch.setattr(resources, "bufferData", fake.bufferData)
+    monkeypatch.setattr(engine.capture, "glBindBuffer", fake.bindBuffer)
+    monkeypatch.setattr(engine.capture, "readPixelsInto", fake.readPixels)
+    monkeypatch.setattr(engine.capture, "glFenceSync", fake.fenceSync)
+    monkeypatch.setattr(engine.capture, "glClientWaitSync", fake.clientWaitSync)
+    monkeypatch.setattr(engine.capture, "glDeleteSync", fake.deleteSync)
+    monkeypatch.setattr(engine.capture, "glMapBufferRange", fake.mapBufferRange)
+    monkeypatch.setattr(engine.capture, "glUnmapBuffer", lambda target: None)
+    return fake
+
+
+def testFramesAreWrittenInOrder(gl):
+    writer = FakeWriter()
+    capture = FrameCapture(WIDTH, HEIGHT, writer)
+    for _ in range(7):
+        capture.capture()
+    capture.finish()
+    assert writer.frames == [(frame, frame, (HEIGHT, WIDTH, 4)) for frame in range(7)]
+    assert writer.closed
+    assert capture.stats["captured"] == capture.stats["written"] == 7
+    assert capture.stats["stalls"] == capture.stats["dropped"] == 0
+    # each fence was deleted once its readback was copied out
+    assert set(gl.fences.values()) == {"deleted"}
+
+
+def testAFullRingWaitsForTheOldestReadback(gl):
+    writer = FakeWriter()
+    capture = FrameCapture(WIDTH, HEIGHT, writer, ringSize=2)
+    gl.busy = True
+    for _ in range(5):
+        capture.capture()
+    # the first two fit the ring, every later frame had to wait for the oldest one
+    assert capture.stats["stalls"] == 3
+    assert len(capture.inFlight) == 2
+    assert [frame for _, _, frame in capture.inFlight] == [3, 4]
+    capture.finish()
+    assert [frame for frame, _, _ in writer.frames] == list(range(5))
+
+
+def testFramesAreDroppedWhileTheEncoderIsBehind(gl):
+    writer = FakeWriter()
+    writer.release.clear()
+    capture = FrameCapture(WIDTH, HEIGHT, writer, poolSize=1, dropFrames=True)
+    for _ in range(4):
+        capture.capture()
+    # frame 0 holds the only pooled frame while the writer is stuck, frames 1 and 2 landed with nowhere to go
+    assert capture.stats["dropped"] == 2
+    writer.release.set()
+    while capture.free.qsize() < 1:
+        time.sleep(0.001)
+    capture.finish()
+    assert [(frame, value) for frame, value, _ in writer.frames] == [(0, 0), (3, 3)]
+    assert capture.stats["written"] == 2
+
+
+def testEncoderErrorsRaiseFromFinish(gl):
+    writer = FakeWriter(failAt=1)
+    # held until every frame is captured, so the failure cannot surface from capture() first
+    writer.release.clear()
+    capture = FrameCapture(WIDTH, HEIGHT, writer)
+    for _ in range(4):
+        capture.capture()
+    writer.release.set()
+    with pytest.raises(OSError, match="frame 1"):
+        capture.finish()
+    # frames after the failure are not written, the writer is still closed
+    assert [frame for frame, _, _ in writer.frames] == [0]
+    assert writer.closed
+
+
+def testEncoderErrorsRaiseFromTheNextCapture(gl):
+    writer = FakeWriter(failAt=0)
+    capture = FrameCapture(WIDTH, HEIGHT, writer)
+    capture.capture()
+    capture.capture()
+    while capture.error is None:
+        time.sleep(0.001)
+    with pytest.raises(OSError):
+        capture.capture()
+    with pytest.raises(OSError):
+        capture.finish()
+
+
+def testFailedWaitRaises(gl):
+    capture = FrameCapture(WIDTH, HEIGHT, FakeWriter())
+    capture.capture()
+    gl.fences[1] = "failing"
+    with pytest.raises(RuntimeError, match="capture fence"):
+        capture.capture()
+    gl.fences[1] = "signalled"
+    capture.finish()
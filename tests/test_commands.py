@@ -0,0 +1,72 @@
+# CommandList recording over a fake GL, checked for the runs a rebuild merges and for programs and texture sets
+# that only stay in its tables while something recorded still uses them
+import numpy as np
+import pytest
+
+import engine.commands
+import engine.resources
+from engine.commands import CommandList
+from engine.resources import resources
+
+TRIANGLES = engine.commands.GL_TRIANGLES
+
+
+class FakeSource:
+    def __init__(self, draws):
+        # (program, vao, textures, commands), commands as (count, instances) pairs
+        self.draws = draws
+
+    def record(self, commandList):
+        for program, vao, textures, commands in self.draws:
+            commands = [(count, instances, 0, 0, 0) for count, instances in commands]
+            commandList.draw(program, vao, textures, TRIANGLES, commands)
+
+
+@pytest.fixture
+def commandList(monkeypatch):
+    monkeypatch.setattr(engine.resources, "glGenBuffers", lambda count: 1)
+    monkeypatch.setattr(engine.resources, "glDeleteBuffers", lambda *arguments: None)
+    monkeypatch.setattr(resources, "bufferData", lambda *arguments: None)
+    monkeypatch.setattr(engine.commands, "glBindBuffer", lambda *arguments: None)
+    commandList = CommandList()
+    yield commandList
+    commandList.destroy()
+
+
+def testNeighboursWithTheSameStateMerge(commandList):
+    wood = ((0, 1, 10),)
+    commandList.register(FakeSource([("lit", 1, wood, [(6, 2)]), ("basic", 2, (), [(3, 1)])]))
+    commandList.register(FakeSource([("lit", 1, wood, [(6, 1), (12, 1)])]))
+    commandList.update()
+    assert commandList.stats["entries"] == 3 and commandList.stats["runs"] == 2
+    runs = {run[0]: run for run in commandList.runs}
+    # the two lit entries are one draw of three commands, 6 * 2 / 3 + 6 / 3 + 12 / 3 triangles
+    assert runs["lit"][5:] == (3, 10)
+    assert runs["basic"][5:] == (1, 1)
+    assert commandList.stats["recorded"] == 2
+    commandList.update()
+    assert commandList.stats["recorded"] == 0 and commandList.stats["reused"] == 2
+
+
+def testTablesOnlyHoldWhatIsRecorded(commandList):
+    source = FakeSource([("lit", 1, ((0, 1, 10),), [(6, 1)]), ("basic", 2, ((0, 1, 11),), [(3, 1)])])
+    index = commandList.register(source)
+    commandList.register(FakeSource([("lit", 1, ((0, 1, 10),), [(6, 1)])]))
+    commandList.update()
+    assert sorted(commandList.programs) == ["basic", "lit"] and len(commandList.textureSets) == 2
+    # the only draw with basic and the second texture set is dropped, a new set replaces it
+    source.draws = [("lit", 1, ((0, 1, 12),), [(6, 1)])]
+    commandList.invalidate(index)
+    commandList.update()
+    assert commandList.programs == ["lit"]
+    assert sorted(commandList.textureSets) == [((0, 1, 10),), ((0, 1, 12),)]
+    for run in commandList.runs:
+        assert run[0] == "lit" and run[2] in commandList.textureSets
+    # and nothing recorded leaves nothing behind
+    source.draws = []
+    commandList.invalidate(index)
+    commandList.invalidate(1 - index)
+    commandList.sources[1 - index].draws = []
+    commandList.update()
+    assert commandList.programs == [] and commandList.textureSets == [] and commandList.runs == []
+    np.testing.assert_array_equal(commandList.entries["count"], [])
@@ -0,0 +1,86 @@
+# BVH frustum culling against classifying every box, and how the tree refits and rebuilds as objects move
+import numpy as np
+import pyrr
+import pytest
+
+from engine.culling import BVH, OUTSIDE, classifyBoxes, frustumPlanes
+
+
+def randomBoxes(rng, count, side):
+    centres = rng.uniform(-side, side, (count, 3)).astype(np.float32)
+    extents = rng.uniform(0.1, 1.0, (count, 3)).astype(np.float32)
+    return centres - extents, centres + extents
+
+
+def cameras(rng, count):
+    projection = pyrr.matrix44.create_perspective_projection(60, 1.6, 0.1, 30, dtype=np.float32)
+    for _ in range(count):
+        eye = rng.uniform(-10, 10, 3)
+        view = pyrr.matrix44.create_look_at(eye, eye + rng.normal(size=3), (0, 0, 1), dtype=np.float32)
+        yield frustumPlanes(view, projection)
+
+
+def bruteCull(bvh, planes):
+    handles = np.arange(bvh.count)
+    visible = classifyBoxes(planes, bvh.mins[:bvh.count], bvh.maxs[:bvh.count]) != OUTSIDE
+    return handles[visible & bvh.alive[:bvh.count]]
+
+
+@pytest.mark.parametrize("leafSize", (1, 8))
+def testCullMatchesEveryBox(leafSize):
+    rng = np.random.default_rng(0)
+    bvh = BVH(600, leafSize)
+    bvh.addMany(*randomBoxes(rng, 500, 15))
+    bvh.remove(np.arange(0, 500, 7))
+    for planes in cameras(rng, 20):
+        visible = bvh.cull(planes)
+        np.testing.assert_array_equal(visible, bruteCull(bvh, planes))
+        assert bvh.stats["visible"] + bvh.stats["culled"] == bvh.count
+    assert bvh.stats["builds"] == 1
+
+
+def testRefitAfterSetBounds():
+    rng = np.random.default_rng(1)
+    bvh = BVH(300)
+    bvh.addMany(*randomBoxes(rng, 300, 15))
+    bvh.update()
+    # small moves only refit the leaves they are in and their ancestors
+    moved = rng.choice(300, 30, replace=False)
+    shift = rng.uniform(-0.5, 0.5, (30, 3)).astype(np.float32)
+    bvh.setBounds(moved, bvh.mins[moved] + shift, bvh.maxs[moved] + shift)
+    bvh.update()
+    assert bvh.stats["refitted"] == 30 and bvh.stats["builds"] == 1
+    for planes in cameras(rng, 10):
+        np.testing.assert_array_equal(bvh.cull(planes), bruteCull(bvh, planes))
+    assert bvh.stats["builds"] == 1
+    # every node still holds the boxes below it
+    for node in range(len(bvh.left)):
+        objects = bvh.order[bvh.start[node]:bvh.start[node] + bvh.size[node]]
+        assert (bvh.nodeMin[node] <= bvh.mins[objects]).all() and (bvh.maxs[objects] <= bvh.nodeMax[node]).all()
+
+
+def testScatteredObjectsTriggerARebuild():
+    rng = np.random.default_rng(2)
+    bvh = BVH(201)
+    bvh.addMany(*randomBoxes(rng, 200, 15))
+    bvh.update()
+    # half the objects thrown across the scene blow the leaves up far past twice their built area
+    moved = rng.choice(200, 100, replace=False)
+    scattered = randomBoxes(rng, 100, 15)
+    bvh.setBounds(moved, *scattered)
+    bvh.refit()
+    assert bvh.stats["refitted"] == 100
+    assert bvh.needsBuild
+    planes = next(cameras(rng, 1))
+    np.testing.assert_array_equal(bvh.cull(planes), bruteCull(bvh, planes))
+    assert bvh.stats["builds"] == 2
+    assert bvh.leafArea() <= 2 * bvh.builtArea
+    # adds rebuild as well
+    bvh.add(np.zeros(3), np.ones(3))
+    assert bvh.needsBuild
+
+
+def testEmptyTree():
+    bvh = BVH(4)
+    planes = next(cameras(np.random.default_rng(3), 1))
+    assert bvh.cull(planes).tolist() == []
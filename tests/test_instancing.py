@@ -0,0 +1,123 @@
+# InstanceBatch uploads over a fake GL that keeps the instance buffer as a numpy array, checked against the rows
+# each frame draws and the bytes that were written
+import numpy as np
+import pytest
+
+import engine.gl_state
+import engine.instancing
+import engine.resources
+from engine.gl_state import state
+from engine.instancing import InstanceBatch
+from engine.resources import resources
+
+WIDTH = 4
+
+
+class FakeArena:
+    def attach(self, vao):
+        pass
+
+    def detach(self, vao):
+        pass
+
+    def commands(self, meshes, counts=1, first=0):
+        return np.array([np.asarray(meshes).tolist(), np.broadcast_to(counts, len(meshes)).tolist(),
+                         np.broadcast_to(first, len(meshes)).tolist()])
+
+    def submit(self, mode, commands):
+        pass
+
+
+class FakeGL:
+    def __init__(self):
+        self.buffer = None
+        self.written = 0
+
+    def bufferData(self, target, buffer, size, data, usage):
+        self.buffer = np.zeros(size // 4, dtype=np.float32)
+
+    def bufferSubData(self, target, offset, size, data):
+        self.buffer[offset // 4:(offset + size) // 4] = np.asarray(data, dtype=np.float32).ravel()
+        self.written += size // (4 * WIDTH)
+
+    def slots(self, count):
+        return self.buffer[:count * WIDTH].reshape(count, WIDTH)
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    fake = FakeGL()
+    monkeypatch.setattr(resources, "bufferData", fake.bufferData)
+    monkeypatch.setattr(engine.resources, "glGenBuffers", lambda count: 1)
+    monkeypatch.setattr(engine.resources, "glGenVertexArrays", lambda count: 1)
+    monkeypatch.setattr(engine.resources, "glDeleteBuffers", lambda *arguments: None)
+    monkeypatch.setattr(engine.resources, "glDeleteVertexArrays", lambda *arguments: None)
+    monkeypatch.setattr(engine.instancing, "glBufferSubData", fake.bufferSubData)
+    for name in ("glBindBuffer", "glBindVertexBuffer", "glVertexBindingDivisor", "glEnableVertexAttribArray",
+                 "glVertexAttribFormat", "glVertexAttribBinding"):
+        monkeypatch.setattr(engine.instancing, name, lambda *arguments: None)
+    monkeypatch.setattr(engine.gl_state, "glBindVertexArray", lambda *arguments: None)
+    state.reset()
+    yield fake
+    state.reset()
+
+
+def createBatch(count, capacity=32):
+    batch = InstanceBatch(None, FakeArena(), 0, WIDTH, ((2, WIDTH, 0),), capacity)
+    for row in range(count):
+        batch.add(np.full(WIDTH, row, dtype=np.float32))
+    return batch
+
+
+def drawn(gl, batch):
+    order = batch.drawOrder()
+    written = gl.written
+    batch.upload(order)
+    rows = np.arange(batch.count) if order is None else order
+    np.testing.assert_array_equal(gl.slots(len(rows)), batch.instances[rows])
+    return gl.written - written
+
+
+def testMirroredUploadsOnlyDirtyRows(gl):
+    batch = createBatch(20)
+    assert drawn(gl, batch) == 20
+    assert drawn(gl, batch) == 0
+    batch.set(3, np.full(WIDTH, -3))
+    batch.set(11, np.full(WIDTH, -11))
+    assert drawn(gl, batch) == 2
+    batch.destroy()
+
+
+def testCulledUploadsOnlyChangedSlots(gl):
+    batch = createBatch(20)
+    drawn(gl, batch)
+    visible = np.array([1, 4, 5, 9, 12, 17])
+    batch.setVisible(visible)
+    # slot 0 now holds row 1, slot 1 row 4 and so on
+    assert drawn(gl, batch) == 6
+    # one visible row changing is one row written, not the whole packed set
+    batch.set(9, np.full(WIDTH, -9))
+    assert drawn(gl, batch) == 1
+    # a culled row changing writes nothing until it is visible again
+    batch.set(2, np.full(WIDTH, -2))
+    assert drawn(gl, batch) == 0
+    batch.setVisible(np.array([1, 2, 4, 5, 9, 12, 17]))
+    assert drawn(gl, batch) == 6
+    # back to drawing every row: the first seven slots, and rows 9, 12 and 17 whose data moved out of their own
+    batch.setVisible(None)
+    assert drawn(gl, batch) == 10
+    assert drawn(gl, batch) == 0
+    batch.destroy()
+
+
+def testRowsMovedOutOfASlotAreNotReusedFromIt(gl):
+    batch = createBatch(8)
+    batch.setVisible(np.array([0, 1, 2]))
+    drawn(gl, batch)
+    # row 2 moves to slot 1 and changes there, the stale copy left in slot 2 must not count later
+    batch.setVisible(np.array([0, 2]))
+    batch.set(2, np.full(WIDTH, -2))
+    assert drawn(gl, batch) == 1
+    batch.setVisible(np.array([0, 1, 2]))
+    assert drawn(gl, batch) == 2
+    batch.destroy()
@@ -0,0 +1,140 @@
+# assignLights against brute force: every light's sphere against every cluster's view space box bounds what may be
+# assigned, and the clusters of points sampled inside the spheres are what has to be
+import numpy as np
+import pyrr
+
+import engine.lighting
+from engine.lighting import LightSet, assignLights, clusterBounds, sliceOf
+from engine.resources import resources
+
+TILES = (8, 5)
+SLICES = 12
+NEAR = 0.1
+FAR = 10.0
+PROJECTION = pyrr.matrix44.create_perspective_projection(45, 1.6, NEAR, FAR, dtype=np.float32)
+VIEW = np.eye(4, dtype=np.float32)
+
+
+def bruteForce(positions, radii, view=VIEW):
+    # the set of (cluster, light) whose sphere overlaps the cluster's box
+    mins, maxs = clusterBounds(PROJECTION, TILES, SLICES, NEAR, FAR)
+    centres = positions @ view[:3, :3] + view[3, :3]
+    gap = np.maximum(np.maximum(mins[:, None] - centres[None], centres[None] - maxs[:, None]), 0)
+    cluster, light = np.nonzero((gap ** 2).sum(axis=2) <= radii[None] ** 2)
+    return set(zip(cluster.tolist(), light.tolist()))
+
+
+def sampled(positions, radii, view=VIEW, samples=4000):
+    # the set of (cluster, light) for points inside the spheres, clusters a light certainly reaches
+    rng = np.random.default_rng(0)
+    pairs = set()
+    for light, (position, radius) in enumerate(zip(positions, radii)):
+        directions = rng.normal(size=(samples, 3))
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        points = position + directions * radius * rng.uniform(0, 1, (samples, 1)) ** (1 / 3)
+        points = points @ view[:3, :3] + view[3, :3]
+        depth = -points[:, 2]
+        inside = (depth > NEAR) & (depth < FAR)
+        points, depth = points[inside], depth[inside]
+        x = np.floor((points[:, 0] * PROJECTION[0, 0] / depth + 1) / 2 * TILES[0]).astype(np.int64)
+        y = np.floor((points[:, 1] * PROJECTION[1, 1] / depth + 1) / 2 * TILES[1]).astype(np.int64)
+        z = sliceOf(depth, NEAR, FAR, SLICES)
+        onScreen = (x >= 0) & (x < TILES[0]) & (y >= 0) & (y < TILES[1]) & (z < SLICES)
+        pairs.update((cluster, light) for cluster in clusterOf(x[onScreen], y[onScreen], z[onScreen]).tolist())
+    return pairs
+
+
+def assigned(positions, radii, view=VIEW, maxPerCluster=None):
+    clusters, indices = assignLights(positions, radii, view, PROJECTION, TILES, SLICES, NEAR, FAR, maxPerCluster)
+    pairs = set()
+    for cluster, (offset, count) in enumerate(clusters.tolist()):
+        pairs.update((cluster, int(light)) for light in indices[offset:offset + count])
+    return pairs, clusters, indices
+
+
+def clusterOf(x, y, z):
+    return (z * TILES[1] + y) * TILES[0] + x
+
+
+def testCoversEveryOverlappingCluster():
+    rng = np.random.default_rng(3)
+    positions = rng.uniform([-4, -3, -11], [4, 3, 1], (200, 3)).astype(np.float32)
+    radii = rng.uniform(0.1, 1.5, 200).astype(np.float32)
+    view = pyrr.matrix44.create_look_at([0.5, -0.3, 0.2], [0.4, 0.1, -5], [0, 1, 0], dtype=np.float32)
+    pairs, clusters, indices = assigned(positions, radii, view)
+    # nothing the sphere reaches is missed, nothing its cluster box test rules out is kept
+    assert sampled(positions, radii, view) <= pairs <= bruteForce(positions, radii, view)
+    # offsets are a running sum of the counts over one flat list
+    assert clusters[0, 0] == 0
+    assert np.array_equal(clusters[1:, 0], np.cumsum(clusters[:, 1])[:-1])
+    assert clusters[:, 1].sum() == len(indices)
+
+
+def testLightOnClusterBoundary():
+    # on the edge between tiles 3 and 4 across x and exactly at the start of slice 6
+    depth = NEAR * (FAR / NEAR) ** (6 / SLICES)
+    positions = np.array([[0, 0.3 * depth / PROJECTION[1, 1], -depth]], dtype=np.float32)
+    radii = np.array([0.05], dtype=np.float32)
+    pairs, _, _ = assigned(positions, radii)
+    assert sampled(positions, radii) <= pairs <= bruteForce(positions, radii)
+    for x in (3, 4):
+        for z in (5, 6):
+            assert (clusterOf(x, 3, z), 0) in pairs
+
+
+def testLightBehindCamera():
+    positions = np.array([[0, 0, 2.0], [0, 0, 0.3]], dtype=np.float32)
+    radii = np.array([1.0, 0.5], dtype=np.float32)
+    pairs, _, _ = assigned(positions, radii)
+    lights = {light for _, light in pairs}
+    # the first is entirely behind the near plane, the second reaches past it and covers every tile up front
+    assert 0 not in lights
+    assert {cluster for cluster, light in pairs if light == 1 and cluster < TILES[0] * TILES[1]} == \
+        set(range(TILES[0] * TILES[1]))
+    assert sampled(positions, radii) <= pairs <= bruteForce(positions, radii)
+
+
+def testOverflowCap():
+    rng = np.random.default_rng(5)
+    positions = (np.array([0, 0, -3]) + rng.uniform(-0.01, 0.01, (20, 3))).astype(np.float32)
+    radii = np.full(20, 0.2, dtype=np.float32)
+    full, uncapped, _ = assigned(positions, radii)
+    pairs, clusters, indices = assigned(positions, radii, maxPerCluster=4)
+    assert uncapped[:, 1].max() == 20
+    assert clusters[:, 1].max() == 4
+    assert np.array_equal(clusters[:, 1], np.minimum(uncapped[:, 1], 4))
+    assert clusters[:, 1].sum() == len(indices)
+    # every crowded cluster keeps its four lowest lights, as the shader would have read them
+    for cluster, (offset, count) in enumerate(clusters.tolist()):
+        if count:
+            assert indices[offset:offset + count].tolist() == sorted(light for c, light in full if c == cluster)[:4]
+    assert pairs <= full
+
+
+def testClusterBoundsFollowTheProjection(monkeypatch):
+    monkeypatch.setattr(resources, "genBuffers", lambda count, label=None: (1, 2, 3))
+    monkeypatch.setattr(resources, "bufferData", lambda *arguments: None)
+    for name in ("glBindBuffer", "glBufferSubData", "glBindBufferBase"):
+        monkeypatch.setattr(engine.lighting, name, lambda *arguments: None)
+    computed = []
+
+    def countedBounds(*arguments):
+        computed.append(arguments)
+        return clusterBounds(*arguments)
+
+    monkeypatch.setattr(engine.lighting, "clusterBounds", countedBounds)
+    lights = LightSet(8, TILES, SLICES, NEAR, FAR)
+    lights.add((0, 0, -3), (1, 1, 1), 1.0)
+    for step in range(5):
+        lights.setPosition(0, (0.1 * step, 0, -3))
+        lights.update(VIEW, PROJECTION.copy())
+    assert len(computed) == 1
+    # the same clusters as computing the bounds every time
+    bounds = clusterBounds(PROJECTION, TILES, SLICES, NEAR, FAR)
+    clusters, indices = assignLights(lights.lights["position"][:1], lights.lights["strength"][:1], VIEW, PROJECTION,
+                                     TILES, SLICES, NEAR, FAR, bounds=bounds)
+    np.testing.assert_array_equal(lights.clusters, clusters)
+    np.testing.assert_array_equal(lights.indices, indices)
+    # a new field of view needs new bounds
+    lights.update(VIEW, pyrr.matrix44.create_perspective_projection(60, 1.6, NEAR, FAR, dtype=np.float32))
+    assert len(computed) == 2
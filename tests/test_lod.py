@@ -0,0 +1,120 @@
+# LOD chains and the screen size selector of engine.lod, numpy only
+import numpy as np
+import pytest
+
+from engine.lod import LodSelector, buildLodChain, screenDiameters
+from engine.meshes import Mesh
+
+
+def heightField(size, height):
+    # a size x size grid of quads over [0, 1]^2 in the pos_uv_normal layout, z = height * bumps
+    u, v = np.meshgrid(np.linspace(0, 1, size + 1), np.linspace(0, 1, size + 1), indexing="ij")
+    z = height * np.sin(3 * np.pi * u) * np.sin(2 * np.pi * v)
+    vertices = np.zeros(((size + 1) ** 2, 8), dtype=np.float32)
+    vertices[:, 0], vertices[:, 1], vertices[:, 2] = u.ravel(), v.ravel(), z.ravel()
+    vertices[:, 3], vertices[:, 4] = u.ravel(), v.ravel()
+    vertices[:, 7] = 1
+    corner = (np.arange(size)[:, None] * (size + 1) + np.arange(size)[None, :]).ravel()
+    quads = np.stack((corner, corner + size + 1, corner + size + 2, corner + 1), axis=1)
+    indices = quads[:, [0, 1, 2, 0, 2, 3]].astype(np.uint32).ravel()
+    lines = quads[:, [0, 1, 1, 2]].astype(np.uint32).ravel()
+    return Mesh(vertices, indices, lines, "pos_uv_normal")
+
+
+def heightAt(mesh, points):
+    # z of the mesh's triangles under each (x, y) point, by barycentric interpolation
+    vertices = np.asarray(mesh.vertices, dtype=np.float64)
+    triangles = vertices[np.asarray(mesh.indices).reshape(-1, 3), :3]
+    heights = np.full(len(points), np.nan)
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    area = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])
+    for i, (x, y) in enumerate(points):
+        wb = ((x - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (y - a[:, 1])) / area
+        wc = ((b[:, 0] - a[:, 0]) * (y - a[:, 1]) - (x - a[:, 0]) * (b[:, 1] - a[:, 1])) / area
+        inside = np.flatnonzero((wb >= -1e-9) & (wc >= -1e-9) & (wb + wc <= 1 + 1e-9))
+        if len(inside):
+            t = inside[0]
+            heights[i] = a[t, 2] + wb[t] * (b[t, 2] - a[t, 2]) + wc[t] * (c[t, 2] - a[t, 2])
+    return heights
+
+
+def testTriangleCountsDecrease():
+    mesh = heightField(16, 0.05)
+    meshes, report = buildLodChain(mesh)
+    triangles = [level["triangles"] for level in report["levels"]]
+    assert triangles[0] == 16 * 16 * 2
+    assert len(meshes) == len(triangles) == 4
+    assert all(a > b for a, b in zip(triangles, triangles[1:]))
+    # each level reaches its ratio of the full mesh
+    for count, ratio in zip(triangles[1:], (0.5, 0.25, 0.125)):
+        assert count <= int(triangles[0] * ratio)
+    for level, entry in zip(meshes, report["levels"]):
+        assert len(level.indices) == 3 * entry["triangles"]
+        assert level.vertex_count == entry["vertices"]
+        assert np.asarray(level.indices).max() < level.vertex_count
+    # the error only grows down the chain
+    errors = [level["error"] for level in report["levels"]]
+    assert errors == sorted(errors)
+
+
+def testOutlineIsKept():
+    # boundary edges resist moving, so the simplified field still covers the whole square
+    meshes, _ = buildLodChain(heightField(12, 0.05))
+    coarsest = np.asarray(meshes[-1].vertices)[:, :2]
+    np.testing.assert_allclose(coarsest.min(axis=0), 0)
+    np.testing.assert_allclose(coarsest.max(axis=0), 1)
+
+
+@pytest.mark.parametrize("maxError", (0.002, 0.01))
+def testMaxErrorBound(maxError):
+    mesh = heightField(16, 0.05)
+    meshes, report = buildLodChain(mesh, ratios=(0.5, 0.25, 0.125, 0.01), maxError=maxError)
+    assert all(level["error"] <= maxError for level in report["levels"])
+    # a chain under the bound ends before the 1% level, the bumps need more triangles than that
+    assert len(meshes) < 5
+    # the original grid points stay close to every level's surface
+    points = np.asarray(mesh.vertices, dtype=np.float64)[:, :3]
+    for level in meshes[1:]:
+        deviation = np.abs(heightAt(level, points[:, :2]) - points[:, 2])
+        assert not np.isnan(deviation).any()
+        assert deviation.max() <= 4 * maxError
+
+
+def testFlatMeshCollapsesWithoutError():
+    meshes, report = buildLodChain(heightField(8, 0.0), maxError=1e-6)
+    assert len(meshes) == 4
+    assert all(level["error"] <= 1e-6 for level in report["levels"])
+
+
+def testHysteresisDoesNotFlap():
+    selector = LodSelector(3, (200.0, 100.0, 50.0), hysteresis=0.15)
+    rows = np.arange(3)
+    levels = selector.select(rows, [400.0, 150.0, 20.0])
+    assert levels.tolist() == [0, 1, 3]
+    # jitter around the 100 pixel threshold, inside the hysteresis band, only pulls rows to the nearest level
+    # the band allows and then keeps them there
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        assert selector.select(rows, 100 + rng.uniform(-14, 14, 3)).tolist() == [1, 1, 2]
+    selector.levels[:] = (1, 2, 1)
+    for _ in range(50):
+        assert selector.select(rows, 100 + rng.uniform(-14, 14, 3)).tolist() == [1, 2, 1]
+        assert selector.stats["changed"] == 0
+    # past the band the level follows
+    assert selector.select(rows, [116.0, 84.0, 116.0]).tolist() == [1, 2, 1]
+    assert selector.select(rows, [84.0, 116.0, 84.0]).tolist() == [2, 1, 2]
+    assert selector.stats["changed"] == 3
+
+
+def testLevelsFollowDistance():
+    selector = LodSelector(1, (200.0, 100.0, 50.0))
+    projection = np.diag([1.0, 1.0, 1.0, 1.0])
+    levels = []
+    for distance in np.linspace(1, 40, 200).tolist() + np.linspace(40, 1, 200).tolist():
+        diameter = screenDiameters([(0, 0, -distance)], np.array([1.0]), np.zeros(3), projection, 600)
+        levels.append(int(selector.select([0], diameter)[0]))
+    # coarser going away and finer coming back, each change happening once
+    away, back = levels[:200], levels[200:]
+    assert away == sorted(away) and back == sorted(back, reverse=True)
+    assert away[0] == back[-1] == 0 and away[-1] == 3
+    assert sum(a != b for a, b in zip(levels, levels[1:])) == 6
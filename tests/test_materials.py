@@ -0,0 +1,193 @@
+# the texture array layout of engine.materials: packLayers, layerLevel and imageRects, numpy only, and when
+# MaterialLibrary uploads over a stubbed GL
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+import engine.materials
+from engine.gl_state import state
+from engine.materials import GUTTER, MaterialLibrary, imageRects, layerLevel, packLayers
+from engine.resources import resources
+from engine.textures import buildMipChain
+
+
+def randomSizes(seed, count):
+    rng = np.random.default_rng(seed)
+    sizes = [tuple(int(v) for v in rng.integers(1, 200, 2)) for _ in range(count)]
+    # a full size image, the layer size, and one too close to it for a gutter
+    return sizes + [(256, 256), (254, 100)]
+
+
+def paddedBoxes(sizes, layerSize, placements):
+    # (layer, x0, y0, x1, y1) every shared image covers with its gutter, full layer images cover their layer
+    boxes = []
+    for (width, height), (layer, x, y) in zip(sizes, placements):
+        if width + 2 * GUTTER > layerSize[0] or height + 2 * GUTTER > layerSize[1]:
+            boxes.append((layer, 0, 0, layerSize[0], layerSize[1]))
+        else:
+            boxes.append((layer, x - GUTTER, y - GUTTER, x + width + GUTTER, y + height + GUTTER))
+    return boxes
+
+
+@pytest.mark.parametrize("seed", range(5))
+def testRectsDoNotOverlap(seed):
+    sizes = randomSizes(seed, 60)
+    layerSize, layers, placements = packLayers(sizes)
+    assert layerSize == (256, 256)
+    boxes = paddedBoxes(sizes, layerSize, placements)
+    for i, (layer, x0, y0, x1, y1) in enumerate(boxes):
+        assert 0 <= layer < layers
+        assert 0 <= x0 and 0 <= y0 and x1 <= layerSize[0] and y1 <= layerSize[1]
+        for other, ox0, oy0, ox1, oy1 in boxes[i + 1:]:
+            assert other != layer or x1 <= ox0 or ox1 <= x0 or y1 <= oy0 or oy1 <= y0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def testLayerCount(seed):
+    sizes = randomSizes(seed, 60)
+    layerSize, layers, placements = packLayers(sizes)
+    # every layer is used, and never more of them than images
+    assert {layer for layer, _, _ in placements} == set(range(layers))
+    boxes = paddedBoxes(sizes, layerSize, placements)
+    covered = sum((x1 - x0) * (y1 - y0) for _, x0, y0, x1, y1 in boxes)
+    assert layers >= covered / (layerSize[0] * layerSize[1])
+    assert layers <= len(sizes)
+
+
+def testSmallImagesShareALayer():
+    layerSize, layers, placements = packLayers([(64, 64)] + [(16, 16)] * 8)
+    assert (layerSize, layers) == ((64, 64), 2)
+    assert placements[0] == (0, 0, 0)
+    # 20 texels a piece with the gutter, three to a shelf
+    assert [placement[0] for placement in placements[1:]] == [1] * 8
+    assert sorted(placements[1:])[:3] == [(1, 2, 2), (1, 2, 22), (1, 2, 42)]
+    assert packLayers([]) == ((1, 1), 0, [])
+
+
+def testGuttersRepeatTheEdge():
+    rng = np.random.default_rng(0)
+    sizes = [(32, 32), (7, 5), (9, 12), (26, 3)]
+    images = [rng.integers(0, 256, (height, width, 4), dtype=np.uint8) for width, height in sizes]
+    layerSize, layers, placements = packLayers(sizes)
+    texels = layerLevel([[image] for image in images], layerSize, layers, placements, 0)
+    assert texels.shape == (layers, 32, 32, 4)
+    np.testing.assert_array_equal(texels[placements[0][0]], images[0])
+    for image, (layer, x, y) in zip(images[1:], placements[1:]):
+        height, width = image.shape[:2]
+        region = texels[layer, y - GUTTER:y + height + GUTTER, x - GUTTER:x + width + GUTTER]
+        np.testing.assert_array_equal(region, np.pad(image, ((GUTTER, GUTTER), (GUTTER, GUTTER), (0, 0)), "edge"))
+        np.testing.assert_array_equal(region[0, 0], image[0, 0])
+        np.testing.assert_array_equal(region[-1, -1], image[-1, -1])
+
+
+def testFullLayerImagesRepeatTheirLastRowAndColumn():
+    images = [np.full((8, 8, 4), 1, dtype=np.uint8), np.arange(7 * 6 * 4, dtype=np.uint8).reshape(7, 6, 4)]
+    sizes = [(8, 8), (6, 7)]
+    layerSize, layers, placements = packLayers(sizes)
+    assert layers == 2
+    texels = layerLevel([[image] for image in images], layerSize, layers, placements, 0)
+    layer = texels[placements[1][0]]
+    np.testing.assert_array_equal(layer[:7, :6], images[1])
+    np.testing.assert_array_equal(layer[7, :6], images[1][-1])
+    np.testing.assert_array_equal(layer[:7, 7], images[1][:, -1])
+
+
+def testMipLevelsComeFromEachChain():
+    rng = np.random.default_rng(1)
+    sizes = [(64, 64), (16, 16), (8, 12), (24, 6)]
+    chains = [buildMipChain(rng.integers(0, 256, (height, width, 4), dtype=np.uint8)) for width, height in sizes]
+    layerSize, layers, placements = packLayers(sizes)
+    levels = [layerLevel(chains, layerSize, layers, placements, level) for level in range(7)]
+    # down to 1x1, as GL wants every level of the array
+    assert [level.shape[1:3] for level in levels] == [(64 >> k, 64 >> k) for k in range(7)]
+    for k, texels in enumerate(levels):
+        np.testing.assert_array_equal(texels[placements[0][0]], chains[0][k])
+    # the gutter halves with the level, an image and its one texel gutter sit at half the position on level 1
+    for chain, (layer, x, y) in zip(chains[1:], placements[1:]):
+        image = chain[1]
+        height, width = image.shape[:2]
+        x, y = x // 2 - 1, y // 2 - 1
+        np.testing.assert_array_equal(levels[1][layer, y:y + height + 2, x:x + width + 2],
+                                      np.pad(image, ((1, 1), (1, 1), (0, 0)), "edge"))
+    # past the end of the 8 x 12 chain its 1x1 level repeats
+    assert len(chains[2]) == 5
+    layer, x, y = placements[2]
+    np.testing.assert_array_equal(levels[5][layer, y >> 5, x >> 5], chains[2][-1][0, 0])
+
+
+def testRectsMatchPlacements():
+    sizes = randomSizes(0, 30)
+    layerSize, layers, placements = packLayers(sizes)
+    rects = imageRects(sizes, layerSize, placements)
+    assert rects.shape == (len(sizes), 4) and rects.dtype == np.float32
+    scaled = rects * np.array(layerSize * 2, dtype=np.float32)
+    expected = [(x, y, width, height) for (width, height), (_, x, y) in zip(sizes, placements)]
+    np.testing.assert_allclose(scaled, expected, atol=1e-3)
+    # a rect stays inside its layer, so uv' = offset + fract(uv) * scale never leaves it
+    assert np.all(rects[:, :2] + rects[:, 2:] <= 1.0 + 1e-6)
+    assert imageRects([], layerSize, []).shape == (0, 4)
+
+
+class FakeTextures:
+    # decode() hands out futures the test finishes itself
+    def __init__(self):
+        self.futures = {}
+
+    def decode(self, path):
+        self.futures[path] = Future()
+        return self.futures[path]
+
+    def levels(self, future):
+        return future.result()
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    # the levels passed to texImage3D, in order
+    uploads = []
+    monkeypatch.setattr(resources, "genTextures", lambda count, label=None: 1)
+    monkeypatch.setattr(resources, "genBuffers", lambda count, label=None: 2)
+    monkeypatch.setattr(resources, "texImage3D", lambda texture, level, *arguments: uploads.append(level))
+    monkeypatch.setattr(resources, "bufferData", lambda *arguments: None)
+    monkeypatch.setattr(state, "bindTexture", lambda *arguments: None)
+    for name in ("glTexParameteri", "glPixelStorei", "glBindBuffer", "glBindBufferBase"):
+        monkeypatch.setattr(engine.materials, name, lambda *arguments: None)
+    return uploads
+
+
+@pytest.fixture
+def library(uploads):
+    return MaterialLibrary(FakeTextures())
+
+
+def testAddsUploadOnceOnPoll(library, uploads):
+    # the placeholder
+    assert uploads == [0]
+    for colour in ((255, 0, 0), (0, 255, 0), (0, 0, 255)):
+        library.add(colour)
+    assert library.stats["uploads"] == 0
+    library.poll()
+    # 4x4 images, three mip levels of one array
+    assert library.stats["uploads"] == 1 and uploads[1:] == [0, 1, 2]
+    library.poll()
+    assert library.stats["uploads"] == 1
+    assert len(library.entries) == 3
+
+
+def testPendingImagesUploadWhenTheLastOneIsDone(library, uploads):
+    first = library.add("a.png", "b.png")
+    second = library.add("a.png")
+    library.poll()
+    # the entries point at the placeholder until the images are in, the array is left alone
+    assert library.stats["uploads"] == 1 and uploads == [0]
+    np.testing.assert_array_equal(library.entries["diffuseRect"], [(0, 0, 1, 1)] * 2)
+    futures = library.textures.futures
+    futures["a.png"].set_result(buildMipChain(np.full((8, 8, 4), 10, dtype=np.uint8)))
+    library.poll()
+    assert library.stats["uploads"] == 1
+    futures["b.png"].set_result(buildMipChain(np.full((4, 8, 4), 20, dtype=np.uint8)))
+    library.poll()
+    assert library.stats["uploads"] == 2 and uploads[1:] == [0, 1, 2, 3]
+    assert library.entries["diffuseLayer"][first] == library.entries["diffuseLayer"][second]
+    assert library.stats["images"] == 3
@@ -0,0 +1,76 @@
+# FramePipeline with the stock spinObjects update, inline and on a thread pool
+import time
+
+import numpy as np
+import pyrr
+import pytest
+
+from engine.culling import OUTSIDE, frustumPlanes
+from engine.pipeline import SPIN_INPUTS, SPIN_OUTPUTS, FramePipeline, spinObjects
+
+
+def createPipeline(count, workers, work=spinObjects):
+    pipeline = FramePipeline(work, SPIN_INPUTS, SPIN_OUTPUTS, count, workers)
+    pipeline.inputs["positions"][:] = np.arange(count)[:, None] * (1, 0, 0)
+    pipeline.inputs["scales"][:] = 1
+    pipeline.inputs["spin"][:] = np.pi
+    return pipeline
+
+
+def params(time, planes=None):
+    return {"time": time, "localMin": np.full(3, -0.5, dtype=np.float32),
+            "localMax": np.full(3, 0.5, dtype=np.float32), "planes": planes}
+
+
+def slowSpin(inputs, outputs, start, stop, params):
+    time.sleep(0.02)
+    spinObjects(inputs, outputs, start, stop, params)
+
+
+@pytest.mark.parametrize("workers", (0, 3))
+def testFrontSwapsOnFinish(workers):
+    pipeline = createPipeline(10, workers)
+    pipeline.begin(params(1.0))
+    front = pipeline.finish()
+    # half a turn after a second at pi radians per second
+    np.testing.assert_allclose(front["matrices"][:, 0, 0], -1, atol=1e-6)
+    np.testing.assert_allclose(front["matrices"][:, 3, :3], pipeline.inputs["positions"])
+    pipeline.begin(params(0.0))
+    # the front stays the last finished update until the next finish()
+    assert pipeline.front is front
+    assert pipeline.finish() is not front
+    np.testing.assert_allclose(pipeline.front["matrices"][:, 0, 0], 1, atol=1e-6)
+    with pytest.raises(RuntimeError):
+        pipeline.begin(params(0.0))
+        pipeline.begin(params(0.0))
+    pipeline.destroy()
+
+
+def testUpdateTimeExcludesLateFinish():
+    pipeline = createPipeline(8, 4, slowSpin)
+    for _ in range(3):
+        pipeline.begin(params(0.0))
+        time.sleep(0.2)
+        pipeline.finish()
+        # the chunks took about 20 ms, finishing 200 ms later does not count
+        assert 15 <= pipeline.stats["updateMs"] < 150
+        assert pipeline.stats["waitMs"] < 50
+    pipeline.destroy()
+
+
+
+def testFrustumClassification():
+    pipeline = createPipeline(10, 2)
+    view = pyrr.matrix44.create_look_at((0, 0, -1), (0, 0, -2), (0, 1, 0), dtype=np.float32)
+    projection = pyrr.matrix44.create_perspective_projection(90, 1, 0.1, 100, dtype=np.float32)
+    # looking down -z from z = -1, the objects along x at z = 0 are behind the camera
+    pipeline.begin(params(0.0, frustumPlanes(view, projection)))
+    assert (pipeline.finish()["classes"] == OUTSIDE).all()
+    # and in view looking back at them
+    view = pyrr.matrix44.create_look_at((4.5, 0, -6), (4.5, 0, 0), (0, 1, 0), dtype=np.float32)
+    pipeline.begin(params(0.0, frustumPlanes(view, projection)))
+    assert (pipeline.finish()["classes"] != OUTSIDE).all()
+    # without planes nothing is culled
+    pipeline.begin(params(0.0))
+    assert (pipeline.finish()["classes"] != OUTSIDE).all()
+    pipeline.destroy()
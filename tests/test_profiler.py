@@ -0,0 +1,169 @@
+# Profiler on a fake clock, with GL_TIMESTAMP queries answered by a fake GL that stamps them with the same clock,
+# checked for the ring of rows, the rolling percentiles and the trace export()
+import json
+
+import numpy as np
+import pytest
+
+import engine.profiler
+import engine.resources
+from engine.profiler import Profiler
+
+MS = 1_000_000
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def perf_counter_ns(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += int(ms * MS)
+
+
+class FakeGL:
+    # the GPU runs gpuDelay behind the CPU on a clock gpuAhead ns ahead of it, queries in late never finish
+    def __init__(self, clock):
+        self.clock = clock
+        self.gpuDelay = 2 * MS
+        self.gpuAhead = 10 * MS
+        self.nextName = 1
+        self.stamps = {}
+        self.late = set()
+
+    def genQueries(self, count):
+        self.nextName += count
+        return list(range(self.nextName - count, self.nextName))
+
+    def queryCounter(self, query, target):
+        self.stamps[query] = self.clock.now + self.gpuDelay + self.gpuAhead
+
+    def getInteger64(self, name, result):
+        result._obj.value = self.clock.now + self.gpuAhead
+
+    def getQueryObjectiv(self, query, name):
+        return query not in self.late
+
+    def getQueryResult64(self, query, name, result):
+        result._obj.value = self.stamps[query]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(engine.profiler, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def gl(monkeypatch, clock):
+    fake = FakeGL(clock)
+    monkeypatch.setattr(engine.resources, "glGenQueries", fake.genQueries)
+    monkeypatch.setattr(engine.resources, "glDeleteQueries", lambda *arguments: None)
+    monkeypatch.setattr(engine.profiler, "getInteger64", fake.getInteger64)
+    monkeypatch.setattr(engine.profiler, "glQueryCounter", fake.queryCounter)
+    monkeypatch.setattr(engine.profiler, "glGetQueryObjectiv", fake.getQueryObjectiv)
+    monkeypatch.setattr(engine.profiler, "getQueryResult64", fake.getQueryResult64)
+    monkeypatch.setattr(engine.profiler, "glFinish", lambda: None)
+    return fake
+
+
+def runFrames(profiler, clock, frames):
+    # frame n takes n + 2 ms, two draws of 1 ms each inside it
+    for frame in range(1, frames + 1):
+        profiler.beginFrame()
+        with profiler.scope("frame"):
+            for _ in range(2):
+                with profiler.scope("draw"):
+                    clock.advance(1)
+            clock.advance(frame)
+        clock.advance(5)
+
+
+def testRowsWrapAround(clock):
+    profiler = Profiler(capacity=8)
+    profiler.enable(gpu=False)
+    runFrames(profiler, clock, 5)
+    rows = profiler.rows()
+    # 15 rows were written, the last 8 are left oldest first: draw, draw, frame for frames 3 to 5 without the first
+    assert profiler.written == 15 and len(rows) == 8
+    assert rows["frame"].tolist() == [3, 3, 4, 4, 4, 5, 5, 5]
+    assert [profiler.names[scope] for scope in rows["scope"]] == ["draw", "frame"] + ["draw", "draw", "frame"] * 2
+    assert (np.diff(rows["cpuEnd"]) >= 0).all()
+    # before the ring fills it is just what was written
+    profiler = Profiler(capacity=8)
+    profiler.enable(gpu=False)
+    runFrames(profiler, clock, 2)
+    assert profiler.rows()["frame"].tolist() == [1, 1, 1, 2, 2, 2]
+
+
+def testSummaryPercentiles(clock):
+    profiler = Profiler()
+    profiler.enable(gpu=False)
+    runFrames(profiler, clock, 300)
+    summary = profiler.summary()
+    # the last 240 frames, 63 to 302 ms long
+    expected = np.percentile(np.arange(63, 303), (50, 95, 99))
+    frame = summary["frame"]
+    assert (frame["cpuP50"], frame["cpuP95"], frame["cpuP99"]) == pytest.approx(tuple(expected))
+    assert frame["depth"] == 0 and frame["calls"] == 1 and frame["gpuP50"] is None
+    # the two draws of a frame count together
+    draw = summary["draw"]
+    assert draw["depth"] == 1 and draw["calls"] == 2
+    assert (draw["cpuP50"], draw["cpuP99"]) == pytest.approx((2, 2))
+    assert profiler.summary(frames=10)["frame"]["cpuP50"] == pytest.approx(297.5)
+    assert profiler.caption().startswith("Profile (cpu/gpu ms): frame 182.50")
+
+
+def testGpuTimesAreReadLatencyFramesLater(clock, gl):
+    profiler = Profiler(latency=3)
+    profiler.enable()
+    runFrames(profiler, clock, 2)
+    assert (profiler.rows()["gpuEnd"] == 0).all()
+    runFrames(profiler, clock, 1)
+    # the fourth frame reuses the first frame's queries, reading them first
+    profiler.beginFrame()
+    rows = profiler.rows()
+    read = rows[rows["frame"] == 1]
+    assert (read["gpuStart"] - read["cpuStart"] == gl.gpuDelay).all()
+    assert (read["gpuEnd"] - read["gpuStart"] == read["cpuEnd"] - read["cpuStart"]).all()
+    assert (rows[rows["frame"] > 1]["gpuEnd"] == 0).all()
+    assert profiler.stats["gpuRead"] == 3
+    # a result the GPU has not produced when its set comes round is dropped rather than waited for
+    with profiler.scope("frame"):
+        clock.advance(1)
+    gl.late.update(profiler.queries[2].ravel().tolist())
+    profiler.flush()
+    # frame 2's scopes are dropped, frame 3's and the fourth frame's are read
+    assert profiler.stats["gpuDropped"] == 3
+    assert profiler.stats["gpuRead"] == 7
+    assert profiler.summary()["frame"]["gpuP50"] is not None
+    profiler.destroy()
+
+
+def testExportIsAChromeTrace(clock, gl, tmp_path):
+    profiler = Profiler()
+    profiler.enable()
+    clock.advance(100)
+    runFrames(profiler, clock, 3)
+    profiler.flush()
+    path = tmp_path / "trace.json"
+    profiler.export(str(path))
+    trace = json.loads(path.read_text())
+    assert trace["displayTimeUnit"] == "ms"
+    names, events = trace["traceEvents"][:2], trace["traceEvents"][2:]
+    assert [(event["ph"], event["tid"], event["args"]["name"]) for event in names] == [("M", 0, "CPU"),
+                                                                                       ("M", 1, "GPU")]
+    # a CPU and a GPU event per scope, in microseconds from the first scope's start
+    assert len(events) == 18
+    assert all(event["ph"] == "X" and event["pid"] == 0 for event in events)
+    cpu = [event for event in events if event["tid"] == 0]
+    gpu = [event for event in events if event["tid"] == 1]
+    assert [event["name"] for event in cpu] == ["draw", "draw", "frame"] * 3
+    assert [event["args"]["frame"] for event in cpu] == [1, 1, 1, 2, 2, 2, 3, 3, 3]
+    assert cpu[0]["ts"] == 0 and cpu[0]["dur"] == 1000
+    assert [event["dur"] for event in cpu if event["name"] == "frame"] == [3000, 4000, 5000]
+    assert [event["ts"] - 2000 for event in gpu] == [event["ts"] for event in cpu]
+    profiler.destroy()
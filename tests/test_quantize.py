@@ -0,0 +1,95 @@
+# the compact vertex formats of engine.quantize, numpy only
+import numpy as np
+import pytest
+
+from engine.meshes import Mesh
+from engine.quantize import (SNORM10, SNORM16, compactMesh, decodeBox, decodePositions, packNormals,
+                             quantizePositions, unpackNormals)
+
+
+def boxMesh(lo, hi, count=200, seed=0):
+    # pos_uv_normal points inside the box, its eight corners among them
+    rng = np.random.default_rng(seed)
+    lo, hi = np.asarray(lo, dtype=np.float32), np.asarray(hi, dtype=np.float32)
+    corners = np.array([[(hi if (i >> axis) & 1 else lo)[axis] for axis in range(3)] for i in range(8)])
+    positions = np.concatenate((corners, rng.uniform(lo, hi, (count, 3))))
+    vertices = np.zeros((len(positions), 8), dtype=np.float32)
+    vertices[:, :3] = positions
+    vertices[:, 3:5] = rng.uniform(0, 1, (len(positions), 2))
+    vertices[:, 5:8] = rng.normal(size=(len(positions), 3))
+    indices = np.arange(len(positions) // 3 * 3, dtype=np.uint32)
+    return Mesh(vertices, indices, None, "pos_uv_normal")
+
+
+@pytest.mark.parametrize("bounds", (((-1, -1, -1), (1, 1, 1)), ((2, -30, 0.5), (2.001, 40, 0.75)),
+                                    ((0, 0, 0), (0, 1, 1))))
+def testPositionsRoundTrip(bounds):
+    offset, scale = decodeBox(bounds)
+    lo, hi = (np.asarray(b, dtype=np.float32) for b in bounds)
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(lo, hi, (1000, 3)).astype(np.float32)
+    # every face of the box, corners included
+    positions[:8] = [[(hi if (i >> axis) & 1 else lo)[axis] for axis in range(3)] for i in range(8)]
+    positions[8:14] = np.where(np.eye(3, dtype=bool)[[0, 1, 2, 0, 1, 2]], np.repeat([lo, hi], 3, axis=0),
+                               (lo + hi) / 2)
+    quantized = quantizePositions(positions, offset, scale)
+    assert quantized.dtype == np.int16 and (quantized[:, 3] == 0).all()
+    assert np.abs(quantized[:, :3]).max() <= SNORM16
+    error = np.abs(decodePositions(quantized, offset, scale) - positions)
+    # half a step of the snorm16 grid, plus float32 rounding
+    assert (error <= scale / SNORM16 * 0.5 + np.abs(positions) * 2 ** -22 + 1e-12).all()
+    np.testing.assert_allclose(decodePositions(quantized[:8], offset, scale), positions[:8], atol=1e-6)
+
+
+def testPositionsOutsideTheBoxRaise():
+    offset, scale = decodeBox(((0, 0, 0), (1, 1, 1)))
+    with pytest.raises(ValueError):
+        quantizePositions(np.array([[0.5, 0.5, 1.01]], dtype=np.float32), offset, scale)
+
+
+def testNormalsRoundTrip():
+    axes = np.concatenate((np.eye(3), -np.eye(3)))
+    diagonals = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+    rng = np.random.default_rng(0)
+    normals = np.concatenate((axes, diagonals, rng.normal(size=(1000, 3)))).astype(np.float32)
+    packed = packNormals(normals)
+    assert packed.dtype == np.uint32
+    # the two w bits stay clear
+    assert (packed >> 30 == 0).all()
+    decoded = unpackNormals(packed)
+    unit = normals / np.linalg.norm(normals, axis=1, keepdims=True)
+    assert np.abs(decoded - unit).max() <= 0.5 / SNORM10 + 1e-6
+    # axis-aligned normals, negative ones included, come back exactly
+    np.testing.assert_array_equal(decoded[:6], axes)
+    # -1 is 0x201 in ten bits, the x field of -x
+    assert packed[3] & 0x3FF == 0x201
+
+
+def testCompactMeshReport():
+    mesh = boxMesh((-1, 0, 2), (1, 3, 2.5))
+    compact, report = compactMesh(mesh)
+    assert compact.layout == "pos_uv_normal_compact"
+    assert report["compactBytes"] * 2 == report["originalBytes"]
+    assert report["positionError"] <= report["positionBound"]
+    assert report["normalErrorDegrees"] <= report["normalBoundDegrees"]
+    lo, hi = compact.bounds()
+    np.testing.assert_allclose(lo, (-1, 0, 2))
+    np.testing.assert_allclose(hi, (1, 3, 2.5))
+
+
+def testSecondMeshOutsideTheSharedBoxRaises():
+    first = boxMesh((0, 0, 0), (1, 1, 1))
+    shared = first.bounds()
+    # inside the first mesh's box, so it quantizes against it
+    compactMesh(boxMesh((0.2, 0.2, 0.2), (0.8, 0.8, 1.0), seed=1), shared)
+    with pytest.raises(ValueError):
+        compactMesh(boxMesh((0.2, 0.2, 0.2), (0.8, 0.8, 1.2), seed=2), shared)
+
+
+def testPerVertexColoursRaise():
+    vertices = np.zeros((3, 6), dtype=np.float32)
+    vertices[:, 0] = (0, 1, 0)
+    vertices[:, 1] = (0, 0, 1)
+    vertices[1, 3] = 1
+    with pytest.raises(ValueError):
+        compactMesh(Mesh(vertices, np.arange(3, dtype=np.uint32), None, "pos_colour"))
@@ -0,0 +1,93 @@
+# ShaderCache.build over a fake GL whose compiler rejects any source containing BROKEN, checked for
+# programs and shaders left behind when a batch fails
+import pytest
+
+import engine.resources
+import engine.shaders
+from engine.resources import resources
+from engine.shaders import ShaderCache, ShaderCompilationError
+
+SOURCE = "#version 330 core\nvoid main() {}\n"
+
+
+class FakeGL:
+    def __init__(self):
+        self.nextName = 1
+        self.sources = {}
+        self.shaders = set()
+        self.programs = set()
+
+    def name(self):
+        self.nextName += 1
+        return self.nextName - 1
+
+    def createShader(self, kind):
+        shader = self.name()
+        self.shaders.add(shader)
+        return shader
+
+    def createProgram(self):
+        program = self.name()
+        self.programs.add(program)
+        return program
+
+    def getShaderiv(self, shader, parameter):
+        return "BROKEN" not in self.sources[shader]
+
+    def getProgramiv(self, program, parameter):
+        # links, and has no binary to save
+        return parameter == engine.shaders.GL_LINK_STATUS
+
+    def shaderSource(self, shader, source):
+        self.sources[shader] = source
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    fake = FakeGL()
+    monkeypatch.setattr(engine.resources, "glCreateProgram", fake.createProgram)
+    monkeypatch.setattr(engine.resources, "glDeleteProgram", fake.programs.discard)
+    monkeypatch.setattr(engine.shaders, "hasExtension", lambda name: False)
+    monkeypatch.setattr(engine.shaders, "glGetString", lambda name: b"fake")
+    monkeypatch.setattr(engine.shaders, "glCreateShader", fake.createShader)
+    monkeypatch.setattr(engine.shaders, "glDeleteShader", fake.shaders.discard)
+    monkeypatch.setattr(engine.shaders, "glShaderSource", fake.shaderSource)
+    monkeypatch.setattr(engine.shaders, "glGetShaderiv", fake.getShaderiv)
+    monkeypatch.setattr(engine.shaders, "glGetShaderInfoLog", lambda shader: b"syntax error")
+    monkeypatch.setattr(engine.shaders, "glGetProgramiv", fake.getProgramiv)
+    for name in ("glCompileShader", "glAttachShader", "glDetachShader", "glProgramParameteri", "glLinkProgram"):
+        monkeypatch.setattr(engine.shaders, name, lambda *arguments: None)
+    monkeypatch.setattr(engine.shaders, "ShaderProgram", lambda program: program)
+    live = set(resources.live)
+    yield fake
+    assert set(resources.live) - live == {("program", program) for program in fake.programs}
+
+
+def writeShaders(directory, broken):
+    paths = []
+    for index in range(4):
+        path = directory / f"shader{index}.txt"
+        path.write_text(SOURCE.replace("{}", "{ BROKEN }") if index == broken else SOURCE)
+        paths.append(str(path))
+    return [(paths[0], paths[1]), (paths[2], paths[3])]
+
+
+def testBuildCompilesEveryRequest(gl, tmp_path):
+    cache = ShaderCache(str(tmp_path / "cache"))
+    programs = cache.build(writeShaders(tmp_path, None) * 2)
+    assert len(set(programs)) == 4 and set(programs) == gl.programs
+    assert cache.stats["compiled"] == 4
+    # the shaders are only needed until the programs link
+    assert gl.shaders == set()
+    for program in programs:
+        resources.deleteProgram(program)
+
+
+# the first program failing with three still linking, or the second with one already finished
+@pytest.mark.parametrize("broken", (1, 2))
+def testFailedBuildDeletesTheWholeBatch(gl, tmp_path, broken):
+    cache = ShaderCache(str(tmp_path / "cache"))
+    with pytest.raises(ShaderCompilationError):
+        cache.build(writeShaders(tmp_path, broken) * 2)
+    assert gl.programs == set()
+    assert gl.shaders == set()
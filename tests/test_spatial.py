@@ -0,0 +1,136 @@
+# the SpatialHash grid and the BVH as engine.spatial backends, checked against testing every query against
+# every object, the comparison benchmarks/spatial.py prints at large sizes
+import numpy as np
+import pytest
+
+from engine.culling import boxesOverlap, nearestPerQuery, normalizeRays, rayBoxes, spheresOverlap
+from engine.spatial import SpatialHash, createIndex, pushOut
+
+BACKENDS = ("grid", "bvh")
+
+
+def randomBoxes(rng, count, side):
+    centres = rng.uniform(0, side, (count, 3)).astype(np.float32)
+    extents = rng.uniform(0.1, 1.0, (count, 3)).astype(np.float32)
+    return centres - extents, centres + extents
+
+
+def brutePairs(index, count, test):
+    # (query, handle) of every live object test accepts, sorted like the indices return them
+    queries = np.repeat(np.arange(count), index.count)
+    handles = np.tile(np.arange(index.count), count)
+    live = index.alive[handles]
+    queries, handles = queries[live], handles[live]
+    hit = test(queries, handles)
+    return queries[hit], handles[hit]
+
+
+def bruteBoxes(index, mins, maxs):
+    return brutePairs(index, len(mins), lambda q, h: boxesOverlap(mins[q], maxs[q], index.mins[h], index.maxs[h]))
+
+
+def bruteSpheres(index, centres, radii):
+    return brutePairs(index, len(centres),
+                      lambda q, h: spheresOverlap(centres[q], radii[q], index.mins[h], index.maxs[h]))
+
+
+def bruteRays(index, origins, directions):
+    directions, inverse = normalizeRays(directions)
+    rays, handles = brutePairs(index, len(origins), lambda q, h: np.ones(len(q), dtype=bool))
+    entry, exit = rayBoxes(origins[rays], inverse[rays], index.mins[handles], index.maxs[handles])
+    hit = (entry <= exit) & ~(directions[rays] == 0).all(axis=1)
+    return nearestPerQuery(rays[hit], handles[hit], entry[hit], len(origins))
+
+
+def checkAgainstBruteForce(index, rng, side, queries=60):
+    origins = rng.uniform(0, side, (queries, 3))
+    directions = rng.normal(size=(queries, 3))
+    centres = rng.uniform(0, side, (queries, 3)).astype(np.float32)
+    radii = rng.uniform(0.5, 2.0, queries).astype(np.float32)
+    hits, distances = index.raycast(origins, directions)
+    expectedHits, expectedDistances = bruteRays(index, origins, directions)
+    np.testing.assert_array_equal(hits, expectedHits)
+    np.testing.assert_allclose(distances, expectedDistances)
+    for found, expected in ((index.querySpheres(centres, radii), bruteSpheres(index, centres, radii)),
+                            (index.queryBoxes(centres - radii[:, None], centres + radii[:, None]),
+                             bruteBoxes(index, centres - radii[:, None], centres + radii[:, None]))):
+        for a, b in zip(found, expected):
+            np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def testQueriesMatchBruteForce(backend):
+    rng = np.random.default_rng(0)
+    side = 20.0
+    index = createIndex(backend, 500)
+    index.addMany(*randomBoxes(rng, 400, side))
+    checkAgainstBruteForce(index, rng, side)
+    # a tenth of the objects move, most within their cells, some across several
+    moved = rng.choice(400, 40, replace=False)
+    shift = rng.uniform(-3, 3, (40, 3)).astype(np.float32)
+    index.setBounds(moved, index.mins[moved] + shift, index.maxs[moved] + shift)
+    checkAgainstBruteForce(index, rng, side)
+    # adds after queries
+    index.addMany(*randomBoxes(rng, 100, side))
+    checkAgainstBruteForce(index, rng, side)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def testRemoveThenQuery(backend):
+    rng = np.random.default_rng(1)
+    index = createIndex(backend, 300)
+    index.addMany(*randomBoxes(rng, 300, 15.0))
+    checkAgainstBruteForce(index, rng, 15.0)
+    removed = rng.choice(300, 100, replace=False)
+    index.remove(removed)
+    checkAgainstBruteForce(index, rng, 15.0)
+    # a removed object that moves stays gone
+    index.setBounds(removed[:10], index.mins[removed[:10]] + 5, index.maxs[removed[:10]] + 5)
+    _, handles = index.queryBoxes(np.full(3, -100), np.full(3, 100))
+    assert not np.isin(handles, removed).any()
+    assert len(handles) == 200
+
+
+def testOversizedObjectsInTheGrid():
+    index = SpatialHash(16, cellSize=1.0, maxCells=64)
+    small = index.add((0, 0, 0), (0.5, 0.5, 0.5))
+    # 40 x 40 x 1 cells, kept out of the cell table
+    floor = index.add((-20, -20, -1), (20, 20, -0.5))
+    assert index.oversized[floor] and not index.oversized[small]
+    assert index.stats["pairs"] == 1
+    # found from anywhere it covers, far from any listed cell
+    assert index.queryBoxes((15, -15, -0.75), (15.1, -14.9, -0.6))[1].tolist() == [floor]
+    assert index.querySpheres((0.25, 0.25, 0.25), 1.0)[1].tolist() == [small, floor]
+    hits, distances = index.raycast([(15, 15, 5), (0.25, 0.25, 5)], [(0, 0, -1), (0, 0, -1)])
+    assert hits.tolist() == [floor, small]
+    np.testing.assert_allclose(distances, (5.5, 4.5))
+    index.remove(floor)
+    assert index.raycast([(15, 15, 5)], [(0, 0, -1)])[0].tolist() == [-1]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def testZeroDirectionRays(backend):
+    index = createIndex(backend, 4)
+    index.add((-1, -1, -1), (1, 1, 1))
+    # a zero direction hits nothing, even from inside a box, the other rays are unaffected
+    hits, distances = index.raycast([(0, 0, 0), (0, 0, 5), (0, 0, 5)], [(0, 0, 0), (0, 0, -1), (0, 0, 0)])
+    assert hits.tolist() == [-1, 0, -1]
+    np.testing.assert_array_equal(distances, (np.inf, 4.0, np.inf))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def testPushOutAtFixedHeight(backend):
+    index = createIndex(backend, 4)
+    wall = index.add((1, -5, 0), (2, 5, 3))
+    index.add((-5, -5, -1), (5, 5, 0))
+    position = np.array([1.2, 0.3, 1.5], dtype=np.float32)
+    touched = pushOut(index, position, 0.5, axes=(0, 1))
+    assert wall in touched
+    # out through the near face of the wall, sideways only
+    np.testing.assert_allclose(position, (0.5, 0.3, 1.5), atol=1e-6)
+    # clear of the wall now, nothing to push out of
+    assert pushOut(index, position, 0.45, axes=(0, 1)).tolist() == []
+    # with every axis free the shortest way out of the floor is up
+    position = np.array([0.0, 0.0, -0.2], dtype=np.float32)
+    pushOut(index, position, 0.5)
+    np.testing.assert_allclose(position, (0, 0, 0.5), atol=1e-6)
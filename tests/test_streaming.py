@@ -0,0 +1,179 @@
+# BufferRing, StreamBuffer and CameraBuffer over a fake GL whose fences signal when the test says so, checked for
+# regions handed out while the GPU may still read them and for the wait results glClientWaitSync can return
+import ctypes
+
+import numpy as np
+import pytest
+
+import engine.camera
+import engine.resources
+import engine.streaming
+from engine.camera import CAMERA_BINDING, CameraBuffer
+from engine.resources import resources
+from engine.streaming import BufferRing, StreamBuffer
+
+VERTEX = np.dtype((np.float32, 4))
+
+
+class FakeGL:
+    def __init__(self):
+        self.memory = None
+        self.size = 0
+        self.fences = {}
+        self.nextFence = 1
+        self.waits = []
+        self.uploads = []
+        self.ranges = []
+        self.unmapped = False
+
+    def bufferStorage(self, target, buffer, size, data, flags):
+        self.memory = ctypes.create_string_buffer(size)
+        self.size = size
+
+    def bufferData(self, target, buffer, size, data, usage):
+        self.size = size
+
+    def mapBufferRange(self, target, offset, size, access):
+        return ctypes.addressof(self.memory)
+
+    def bytes(self):
+        return np.frombuffer(self.memory, dtype=np.uint8, count=self.size)
+
+    def fenceSync(self, condition, flags):
+        fence = self.nextFence
+        self.nextFence += 1
+        self.fences[fence] = []
+        return fence
+
+    def clientWaitSync(self, fence, flags, timeout):
+        # each fence answers from its script, then says it has signalled
+        self.waits.append((fence, timeout))
+        script = self.fences[fence]
+        return script.pop(0) if script else engine.streaming.GL_ALREADY_SIGNALED
+
+    def deleteSync(self, fence):
+        del self.fences[fence]
+
+    def bufferSubData(self, target, offset, size, data):
+        self.uploads.append((offset, size))
+
+    def bindBufferRange(self, target, index, buffer, offset, size):
+        self.ranges.append((index, offset, size))
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    fake = FakeGL()
+    monkeypatch.setattr(resources, "bufferStorage", fake.bufferStorage)
+    monkeypatch.setattr(resources, "bufferData", fake.bufferData)
+    monkeypatch.setattr(engine.resources, "glGenBuffers", lambda count: 1)
+    monkeypatch.setattr(engine.resources, "glDeleteBuffers", lambda *arguments: None)
+    monkeypatch.setattr(engine.streaming, "glBufferStorage", fake.bufferStorage)
+    monkeypatch.setattr(engine.streaming, "glMapBufferRange", fake.mapBufferRange)
+    monkeypatch.setattr(engine.streaming, "glUnmapBuffer", lambda target: setattr(fake, "unmapped", True))
+    monkeypatch.setattr(engine.streaming, "glFenceSync", fake.fenceSync)
+    monkeypatch.setattr(engine.streaming, "glClientWaitSync", fake.clientWaitSync)
+    monkeypatch.setattr(engine.streaming, "glDeleteSync", fake.deleteSync)
+    monkeypatch.setattr(engine.streaming, "glBufferSubData", fake.bufferSubData)
+    monkeypatch.setattr(engine.streaming, "glBindBuffer", lambda *arguments: None)
+    monkeypatch.setattr(engine.camera, "glGetIntegerv", lambda name: 256)
+    monkeypatch.setattr(engine.camera, "glBindBuffer", lambda *arguments: None)
+    monkeypatch.setattr(engine.camera, "glBufferSubData", fake.bufferSubData)
+    monkeypatch.setattr(engine.camera, "glBindBufferRange", fake.bindBufferRange)
+    return fake
+
+
+def testRegionsAreReusedOnceTheirFencePassed(gl):
+    ring = BufferRing(engine.streaming.GL_ARRAY_BUFFER, 1, 64)
+    for frame in range(3):
+        assert ring.advance() == frame
+        ring.fence()
+    # nothing was waited on until the ring came back to the first region
+    assert gl.waits == []
+    assert ring.advance() == 0
+    assert gl.waits == [(1, 0)]
+    assert 1 not in gl.fences and ring.fences == [None, 2, 3]
+    assert ring.stats["stalls"] == 0
+    ring.destroy()
+    assert gl.fences == {} and gl.unmapped
+
+
+def testTimeoutsWaitUntilTheFenceSignals(gl):
+    ring = BufferRing(engine.streaming.GL_ARRAY_BUFFER, 1, 64, regions=2)
+    ring.advance()
+    ring.fence()
+    ring.advance()
+    gl.fences[1] = [engine.streaming.GL_TIMEOUT_EXPIRED] * 3
+    assert ring.advance() == 0
+    # one poll, then blocking waits until the GPU is done, never a write into a region still being read
+    assert [timeout for fence, timeout in gl.waits] == [0, 1_000_000_000, 1_000_000_000, 1_000_000_000]
+    assert ring.stats["stalls"] == 1
+    assert 1 not in gl.fences
+    ring.destroy()
+
+
+def testFailedWaitRaises(gl):
+    ring = BufferRing(engine.streaming.GL_ARRAY_BUFFER, 1, 64, regions=2)
+    ring.advance()
+    ring.fence()
+    ring.advance()
+    gl.fences[1] = [engine.streaming.GL_TIMEOUT_EXPIRED, engine.streaming.GL_WAIT_FAILED]
+    with pytest.raises(RuntimeError):
+        ring.advance()
+    ring.destroy()
+
+
+def testStreamBufferWritesInPlace(gl):
+    stream = StreamBuffer(8, VERTEX)
+    for frame in range(4):
+        vertices = stream.begin()
+        vertices[:5] = frame + 1
+        stream.end(5)
+        stream.fence()
+        assert stream.first == stream.region * 8
+    mapped = gl.bytes().view(np.float32).reshape(3, 8, 4)
+    # the fourth frame went back into the first region
+    np.testing.assert_array_equal(mapped[:, :5, 0], [[4] * 5, [2] * 5, [3] * 5])
+    assert gl.uploads == []
+    stream.destroy()
+
+
+def testStreamBufferWithoutStorageUploads(gl):
+    stream = StreamBuffer(8, VERTEX, persistent=False)
+    for frame in range(4):
+        stream.begin()[:5] = frame
+        stream.end(5)
+        stream.fence()
+    assert gl.uploads == [(0, 80), (128, 80), (256, 80), (0, 80)]
+    # no fences without mapped storage, glBufferSubData orders the writes itself
+    assert gl.waits == [] and gl.fences == {}
+    stream.destroy()
+
+
+def testCameraUploadsIntoTheNextBlock(gl):
+    camera = CameraBuffer()
+    for frame in range(4):
+        camera.position[:] = frame
+        camera.upload()
+        camera.endFrame()
+    mapped = gl.bytes().view(np.float32).reshape(3, 64)
+    np.testing.assert_array_equal(mapped[:, 32], (3, 1, 2))
+    assert gl.ranges == [(CAMERA_BINDING, offset, 144) for offset in (0, 256, 512, 0)]
+    assert gl.waits == [(1, 0)]
+    camera.destroy()
+
+
+def testCameraWaitsOutATimeout(gl):
+    camera = CameraBuffer()
+    for frame in range(3):
+        camera.upload()
+        camera.endFrame()
+    gl.fences[1] = [engine.streaming.GL_TIMEOUT_EXPIRED]
+    camera.position[:] = 7
+    camera.upload()
+    assert len(gl.waits) == 2 and 1 not in gl.fences
+    assert gl.bytes().view(np.float32)[32] == 7
+    gl.fences[2] = [engine.streaming.GL_WAIT_FAILED]
+    with pytest.raises(RuntimeError):
+        camera.upload()
+    camera.destroy()
@@ -0,0 +1,64 @@
+# TextureManager's decode through the on-disk mip chain cache, pygame writes the image and decodes it
+import os
+
+import numpy as np
+import pygame as pg
+import pytest
+
+from engine.textures import TextureManager, buildMipChain, decodeImage
+
+WOOD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Lab 3", "gfx", "wood.jpeg")
+
+
+@pytest.fixture
+def image(tmp_path):
+    pixels = np.random.default_rng(0).integers(0, 256, (6, 10, 3), dtype=np.uint8)
+    path = str(tmp_path / "image.png")
+    # surfarray is indexed x, y
+    pg.image.save(pg.surfarray.make_surface(pixels.transpose(1, 0, 2)), path)
+    return path, pixels
+
+
+def testChainHalvesToOneTexel():
+    levels = buildMipChain(np.full((5, 12, 4), 200, dtype=np.uint8))
+    assert [level.shape[:2] for level in levels] == [(5, 12), (3, 6), (2, 3), (1, 2), (1, 1)]
+    assert all((level == 200).all() for level in levels)
+
+
+def testDecodeThroughTheCache(image, tmp_path):
+    path, pixels = image
+    textures = TextureManager(2, str(tmp_path / "cache"))
+    first = textures.levels(textures.decode(path))
+    assert textures.stats["decoded"] == 1 and textures.stats["cacheHits"] == 0
+    np.testing.assert_array_equal(first[0][:, :, :3], pixels)
+    assert (first[0][:, :, 3] == 255).all()
+    assert [level.shape for level in first] == [(6, 10, 4), (3, 5, 4), (2, 3, 4), (1, 2, 4), (1, 1, 4)]
+    # the second decode reads the cached chain instead
+    second = textures.levels(textures.decode(path))
+    assert textures.stats["cacheHits"] == 1
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+    textures.destroy()
+
+
+@pytest.mark.parametrize("kind", ("rgb", "rgba", "palette", "jpeg"))
+def testDecodeMatchesTheSurface(tmp_path, kind):
+    rng = np.random.default_rng(1)
+    if kind == "jpeg":
+        path = WOOD
+    else:
+        surface = pg.Surface((7, 5), pg.SRCALPHA if kind == "rgba" else 0, 32 if kind != "palette" else 8)
+        if kind == "palette":
+            surface.set_palette([tuple(int(v) for v in rng.integers(0, 256, 3)) for _ in range(256)])
+            pg.surfarray.blit_array(surface, rng.integers(0, 256, (7, 5)))
+        else:
+            for x in range(7):
+                for y in range(5):
+                    surface.set_at((x, y), tuple(int(v) for v in rng.integers(0, 256, 4)))
+        path = str(tmp_path / "image.png")
+        pg.image.save(surface, path)
+    loaded = pg.image.load(path)
+    width, height = loaded.get_size()
+    # what pg.image.tostring would have copied out
+    expected = np.frombuffer(pg.image.tostring(loaded, "RGBA"), dtype=np.uint8).reshape(height, width, 4)
+    np.testing.assert_array_equal(decodeImage(path), expected)
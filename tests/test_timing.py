@@ -0,0 +1,33 @@
+# Scheduler's per-frame timing rows, real sleeps of a few milliseconds
+import time
+
+import pytest
+
+from engine.timing import Scheduler
+
+
+def testRowsDescribeTheirOwnFrame():
+    clock = Scheduler(targetFps=None)
+    for workMs in (30, 5, 30):
+        clock.beginFrame()
+        time.sleep(workMs / 1000)
+        clock.endFrame()
+        row = clock.timings.last()
+        # the first frame has no previous one to measure from but still took its 30 ms
+        assert row["frameMs"] == pytest.approx(row["workMs"] + row["waitMs"])
+        assert workMs <= row["frameMs"] < workMs + 15
+        # time between frames is not counted against the next one
+        time.sleep(0.03)
+
+
+def testPacedFramesWaitOutThePeriod():
+    clock = Scheduler(targetFps=50)
+    for _ in range(4):
+        clock.beginFrame()
+        time.sleep(0.005)
+        clock.endFrame()
+    # the first frame sets the deadline and the second starts partway into its period
+    rows = clock.timings.records[2:4]
+    assert (rows["workMs"] < 15).all()
+    assert (rows["frameMs"] > 15).all()
+    assert rows["frameMs"] == pytest.approx(rows["workMs"] + rows["waitMs"])
@@ -0,0 +1,92 @@
+# ShaderProgram over a stubbed GL, no context needed: every GL entry point engine.uniforms and engine.gl_state
+# call is replaced by a recorder
+import numpy as np
+import pytest
+
+import engine.gl_state
+import engine.uniforms
+from engine.gl_state import state
+from engine.uniforms import ShaderProgram
+
+# (name, array size) of the program's active uniforms, as glGetActiveUniform reports them
+ACTIVE = [(b"model", 1), (b"ambient", 1), (b"lights[0]", 2), (b"materialTextures", 1)]
+
+
+class StubGL:
+    def __init__(self):
+        self.calls = {}
+        self.names = {}
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def getProgramiv(self, program, parameter):
+        self.count("glGetProgramiv")
+        return len(ACTIVE)
+
+    def getActiveUniform(self, program, index):
+        self.count("glGetActiveUniform")
+        name, size = ACTIVE[index]
+        return name, size, 0
+
+    def getUniformLocation(self, program, name):
+        self.count("glGetUniformLocation")
+        name = name.decode() if isinstance(name, bytes) else name
+        return self.names.setdefault(name, len(self.names)) if name != "missing" else -1
+
+    def recorder(self, name):
+        return lambda *arguments: self.count(name)
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    stub = StubGL()
+    monkeypatch.setattr(engine.uniforms, "glGetProgramiv", stub.getProgramiv)
+    monkeypatch.setattr(engine.uniforms, "glGetActiveUniform", stub.getActiveUniform)
+    monkeypatch.setattr(engine.uniforms, "glGetUniformLocation", stub.getUniformLocation)
+    for name in ("glProgramUniformMatrix4fv", "glProgramUniform3fv", "glProgramUniform2fv", "glProgramUniform3ui",
+                 "glProgramUniform1f", "glProgramUniform1i"):
+        monkeypatch.setattr(engine.uniforms, name, stub.recorder(name))
+    monkeypatch.setattr(engine.gl_state, "glUseProgram", stub.recorder("glUseProgram"))
+    state.reset()
+    yield stub
+    state.reset()
+
+
+def drawFrame(program, frame):
+    # what a lab does per draw: bind, then set everything whether or not it changed
+    program.beginFrame()
+    for draw in range(3):
+        program.use()
+        model = np.eye(4, dtype=np.float32)
+        model[3, 0] = frame
+        program.setMat4("model", model)
+        program.setVec3("ambient", (0.1, 0.1, 0.1))
+        program.setVec3("lights[1]", (draw, 0, 0))
+        program.setInt("materialTextures", 0)
+        program.setFloat("missing", 1.0)
+
+
+def testNoLookupsAfterWarmup(gl):
+    program = ShaderProgram(7)
+    # link time: one lookup per active uniform, an array's base name and each of its elements
+    assert gl.calls["glGetUniformLocation"] == 6
+    drawFrame(program, 0)
+    # the unknown name is asked once and its -1 remembered
+    warmup = gl.calls["glGetUniformLocation"]
+    assert warmup == 7
+    for frame in range(1, 5):
+        drawFrame(program, frame)
+        assert gl.calls["glGetUniformLocation"] == warmup
+        assert program.stats["lookups"] == 0
+
+
+def testUnchangedValuesAreSkipped(gl):
+    program = ShaderProgram(7)
+    drawFrame(program, 0)
+    drawFrame(program, 0)
+    # the second frame repeats the first, only the light that changes per draw is uploaded again
+    assert program.stats["uploads"] == 3
+    assert program.lastFrame["uploads"] == 6
+    assert gl.calls["glProgramUniform1i"] == 1
+    assert gl.calls["glUseProgram"] == 1